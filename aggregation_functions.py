@@ -0,0 +1,265 @@
+'''
+Functions to aggregate the results of many repetitions in a single pass
+'''
+
+import numpy as np
+import heapq
+
+from profiling_functions import aggregate_profiles
+from history_recorder import USER_HISTORIES
+
+# Histories that are averaged over the repetitions
+ELEMENTS = ["all_bytes_offloaded", "all_prices","all_server_welfare", "all_bytes_to_server", "all_Rs", "all_c", "all_fs", "all_congestion", "all_penetration", "all_relative_price", "all_user_utility", "all_average_bytes_offloaded", "all_average_user_utility"]
+
+class PaddedWelford:
+    '''
+    Online mean and variance of every timeslot of histories with different
+    lengths. A history shorter than the longest one counts with its last
+    value on the remaining timeslots. The statistics are kept in buffers that
+    double their capacity only when a longer history arrives.
+
+    Parameters
+    ----------
+
+    shape: tuple
+        Shape of the value of each timeslot
+    capacity: int
+        Number of timeslots the buffers can hold before they first grow
+    '''
+
+    def __init__(self, shape, capacity=1024):
+        self.count = 0
+        self.length = 0
+        self.mean = np.zeros((capacity,) + tuple(shape))
+        self.M2 = np.zeros((capacity,) + tuple(shape))
+
+        # Statistics of the last value of every history, used for the
+        # timeslots after the end of the shorter histories
+        self.last_mean = np.zeros(shape)
+        self.last_M2 = np.zeros(shape)
+
+    def add(self, history):
+        '''
+        Add the history of one repetition
+
+        Parameters
+        ----------
+
+        history: array
+            The values of every timeslot, with the timeslots on the first axis
+        '''
+
+        L = len(history)
+
+        if L > self.length:
+            if L > len(self.mean):
+                capacity = max(L, 2*len(self.mean))
+                self.mean = _grow(self.mean, capacity, self.length)
+                self.M2 = _grow(self.M2, capacity, self.length)
+
+            # The previous histories are padded with their last value
+            self.mean[self.length:L] = self.last_mean
+            self.M2[self.length:L] = self.last_M2
+            self.length = L
+
+        self.count += 1
+
+        # Welford update of every timeslot, the history padded with its last
+        # value after its end
+        for window, value in ((slice(0, L), history), (slice(L, self.length), history[-1])):
+            delta = value - self.mean[window]
+            self.mean[window] += delta / self.count
+            self.M2[window] += delta * (value - self.mean[window])
+
+        delta = history[-1] - self.last_mean
+        self.last_mean += delta / self.count
+        self.last_M2 += delta * (history[-1] - self.last_mean)
+
+    def average(self):
+        '''
+        The average of every timeslot over the repetitions
+        '''
+
+        return self.mean[:self.length].copy()
+
+    def std(self):
+        '''
+        The standard deviation of every timeslot over the repetitions
+        '''
+
+        return np.sqrt(self.M2[:self.length] / self.count)
+
+class RunningMedian:
+    '''
+    Running median of a stream of numbers kept in two heaps
+    '''
+
+    def __init__(self):
+        # max-heap of the lower half (stored negated) and min-heap of the upper
+        self.lower = []
+        self.upper = []
+
+    def add(self, value):
+        '''
+        Add a number to the stream
+        '''
+
+        if self.lower and value > -self.lower[0]:
+            heapq.heappush(self.upper, value)
+        else:
+            heapq.heappush(self.lower, -value)
+
+        # Keep the lower half at most one element larger than the upper one
+        if len(self.lower) > len(self.upper) + 1:
+            heapq.heappush(self.upper, -heapq.heappop(self.lower))
+        elif len(self.upper) > len(self.lower):
+            heapq.heappush(self.lower, -heapq.heappop(self.upper))
+
+    def median(self):
+        '''
+        The median of the numbers added up to now, as np.median computes it
+        '''
+
+        if len(self.lower) > len(self.upper):
+            return -self.lower[0]
+        return (-self.lower[0] + self.upper[0]) / 2
+
+class StreamingAggregator:
+    '''
+    Aggregates the results of many repetitions of a case reading each one
+    once. Keeps the average and standard deviation of every timeslot of the
+    histories, the number of repetitions that reached every timeslot and the
+    average and median number of timeslots. The profiling reports of the
+    repetitions, if any, are aggregated too.
+
+    The per user histories of results recorded every few timeslots have one
+    row per recorded timeslot, so all the results that keep them must be
+    recorded with the same recorded_every, which the aggregated result keeps.
+
+    Parameters
+    ----------
+
+    S: int
+        Number of servers
+    elements: list
+        Names of the histories to average
+    '''
+
+    def __init__(self, S, elements=ELEMENTS):
+        self.S = S
+        self.elements = elements
+        self.statistics = {}
+        self.number_of_timeslots = np.zeros(0)
+        self.median_timeslots = RunningMedian()
+        self.total_timeslots = 0
+        self.running_time = 0
+        self.repetitions = 0
+        self.first_result = None
+        self.recorded_every = None
+        self.profiles = []
+
+    def add(self, result):
+        '''
+        Add the result of one repetition
+
+        Parameters
+        ----------
+
+        result: dictionary
+            Dictionary containing the results of the repetition
+
+        Raises
+        ------
+
+        ValueError
+            If the result keeps per user histories recorded every other
+            number of timeslots than the results added before
+        '''
+
+        if any(name in result for name in USER_HISTORIES):
+            # Rows of histories sampled differently are different timeslots
+            every = result.get("recorded_every", 1)
+            if self.recorded_every is None:
+                self.recorded_every = every
+            elif every != self.recorded_every:
+                raise ValueError('Cannot aggregate per user histories recorded every ' +
+                        str(every) + ' and every ' + str(self.recorded_every) + ' timeslots')
+
+        if self.first_result is None:
+            # Keep the rest of the keys of the first repetition as they are
+            self.first_result = {key: value for key, value in result.items()
+                    if key not in self.elements and key not in ("all_server_selected", "all_users_on_server", "timeslots", "profile")}
+
+        # Results recorded with the final-state profile keep no history
+        T = result["timeslots"] if "timeslots" in result else len(result["all_prices"])
+
+        self.repetitions += 1
+        self.running_time += result["running_time"]
+        self.total_timeslots += T
+        self.median_timeslots.add(T)
+
+        if "profile" in result:
+            self.profiles.append(result["profile"])
+
+        if T > len(self.number_of_timeslots):
+            self.number_of_timeslots = np.concatenate((self.number_of_timeslots,
+                np.zeros(T - len(self.number_of_timeslots))))
+        self.number_of_timeslots[:T] += 1
+
+        # Results of the cohort engine and of the recording profiles other
+        # than full do not keep the per user histories
+        for element in self.elements:
+            if element in result:
+                self._add_history(element, result[element])
+
+        if "all_users_on_server" in result:
+            self._add_history("all_server_selected", result["all_users_on_server"])
+        elif "all_server_selected" in result:
+            # the bincount finds how many times each server has been selected on
+            # every timeslot
+            all_server_selected = result["all_server_selected"]
+            index = all_server_selected + self.S*np.arange(len(all_server_selected))[:, np.newaxis]
+            users_on_server = np.bincount(index.ravel(), minlength=len(all_server_selected)*self.S)
+            self._add_history("all_server_selected", users_on_server.reshape(-1, self.S))
+
+    def _add_history(self, name, history):
+        if name not in self.statistics:
+            self.statistics[name] = PaddedWelford(np.shape(history)[1:])
+        self.statistics[name].add(history)
+
+    def result(self):
+        '''
+        The aggregated result
+
+        Returns
+        -------
+
+        average_result: dictionary
+            The averages of the histories under their names, their standard
+            deviations under the names with a "_std" suffix, the timeslot
+            statistics and the aggregated profiling report under "profile"
+        '''
+
+        average_result = dict(self.first_result)
+
+        for name, statistics in self.statistics.items():
+            average_result[name] = statistics.average()
+            average_result[name + "_std"] = statistics.std()
+
+        if self.recorded_every is not None:
+            average_result["recorded_every"] = self.recorded_every
+
+        average_result["number_of_timeslots"] = self.number_of_timeslots.copy()
+        average_result["running_time"] = self.running_time / self.repetitions
+        average_result["average_timeslots"] = int(self.total_timeslots / self.repetitions)
+        average_result["median_timeslots"] = int(self.median_timeslots.median())
+
+        if self.profiles:
+            average_result["profile"] = aggregate_profiles(self.profiles)
+
+        return average_result
+
+def _grow(buffer, capacity, length):
+    grown = np.zeros((capacity,) + buffer.shape[1:])
+    grown[:length] = buffer[:length]
+    return grown
@@ -0,0 +1,310 @@
+'''
+Batched versions of the simulation functions. Every array carries a leading
+repetition axis so that one call serves many repetitions of the same case.
+'''
+
+import numpy as np
+
+from server_selection_functions import server_selection
+
+def batched_server_selection(probabilities, U, S, **params):
+    '''
+    Each user of every repetition selects a server to whom it will offload
+    the data.
+
+    Parameters
+    ----------
+
+    probabilities: 3-D array
+        The probabilities that each user of each repetition will select the
+        specific server, with shape (repetitions, U, S)
+
+    Returns
+    -------
+
+    servers: 2-D array
+        The server to which each user of each repetition is associated
+    '''
+
+    return server_selection(probabilities, U, S)
+
+def batched_all_users_sure(probabilities):
+    '''
+    Check on every repetition if all users are certain of the selection they
+    made on the server
+
+    Parameters
+    ----------
+
+    probabilities: 3-D array
+        The probabilities that each user of each repetition will select the
+        specific server
+
+    Returns
+    -------
+
+    sure: 1-D array
+        Boolean for every repetition on whether all users are sure of the
+        selected server or not
+    '''
+
+    return np.all(np.max(probabilities, axis=2) > 0.9, axis=1)
+
+def batched_play_offloading_game(server_selected, b_old, prices, k, l, a, b_max, b_min, **params):
+    '''
+    Users of every repetition play the offloading game to find their best
+    response based on what the other users of the same repetition played.
+
+    Parameters
+    ----------
+
+    server_selected: 2-D array
+        The server to which each user of each repetition is associated
+    b_old: 2-D array
+        offloading data each user had decided to send on the previous
+        iteration
+    prices: 2-D array
+        The prices of the servers on each repetition
+
+    Returns
+    -------
+
+    b: 2-D array
+        offloading data each user has decided to send on the current
+        iteration
+    '''
+
+    # Sum of all best responses of each repetition
+    B = np.sum(b_old, axis=1, keepdims=True)
+
+    # Best response of all users except the user
+    B_minus_u = B - b_old
+
+    # price paid by user based on server's price
+    paid = np.take_along_axis(prices, server_selected, axis=1)
+
+    # calculation of best response for every user based on Theorem 1
+    b = (B_minus_u/l) * ((k*l/(a*paid)) - 1)
+
+    # limit result inside [0, Iu] -> [b_min, b_max]
+    b[b>b_max] = b_max
+    b[b<b_min] = b_min
+
+    return b
+
+def batched_bytes_to_server(server_selected, b, S):
+    '''
+    Sum the offloaded data of every server on every repetition
+
+    Parameters
+    ----------
+
+    server_selected: 2-D array
+        The server to which each user of each repetition is associated
+    b: 2-D array
+        offloading data each user of each repetition decided to send
+    S: int
+        Number of servers
+
+    Returns
+    -------
+
+    bytes_to_server: 2-D array
+        The number of bytes offloaded to each server of each repetition
+    '''
+
+    R = server_selected.shape[0]
+
+    # Offset the servers of each repetition so that a single bincount
+    # computes the sums of every repetition
+    index = server_selected + S*np.arange(R)[:, np.newaxis]
+
+    return np.bincount(index.ravel(), b.ravel(), minlength=R*S).reshape(R, S)
+
+def batched_play_pricing_game(server_selected, b, S, k, l, a, c, fs, price_min, **params):
+    '''
+    Servers of every repetition play the pricing game to find their best
+    response based on what the users of the same repetition played.
+
+    Parameters
+    ----------
+
+    server_selected: 2-D array
+        The server to which each user of each repetition is associated
+    b: 2-D array
+        offloading data each user of each repetition decided to send
+
+    Returns
+    -------
+
+    prices: 2-D array
+        The new prices of the servers on each repetition
+    '''
+
+    # Sum of all best responses on each server
+    B_server = batched_bytes_to_server(server_selected, b, S)
+
+    # Best response of all users except the user on each server
+    B_minus_u = np.take_along_axis(B_server, server_selected, axis=1) - b
+    inside_sum = B_minus_u/a
+
+    numerator_sum = batched_bytes_to_server(server_selected, inside_sum, S)
+    numerator = c*k*l*numerator_sum
+
+    denominator_sum = batched_bytes_to_server(server_selected, B_minus_u, S)
+    denominator = (1 - fs)*denominator_sum
+
+    # If the server has not been chosen, then give a value to the denominator
+    # so that the price is set to 0/0.1 = 0
+    denominator[denominator==0] = 0.1
+
+    prices = np.sqrt(numerator/denominator)
+
+    prices[prices < price_min] = price_min
+
+    return prices
+
+def batched_game_converged(b, b_old, p, p_old, e1, e2, **params):
+    '''
+    Check on every repetition if the game has converged
+
+    Parameters
+    ----------
+
+    b: 2-D array
+        The offloading values the users chose on the last game
+    b_old: 2-D array
+        The offloading values the users chose on the previous game
+    p: 2-D array
+        The prices the servers chose on the last game
+    p_old: 2-D array
+        The prices the servers chose on the previous game
+
+    Returns
+    -------
+
+    convergence: 1-D array
+        Boolean for every repetition on whether the game has converged
+    '''
+
+    return np.all(np.abs(b - b_old) < e1, axis=1) & np.all(np.abs(p - p_old) < e2, axis=1)
+
+def batched_calculate_user_utility(b, server_selected, prices, k, l, a, **params):
+    '''
+    Calculates the utility of users of every repetition at the end of the
+    timeslot
+
+    Parameters
+    ----------
+
+    b: 2-D array
+        offloading data each user of each repetition decided to send
+    server_selected: 2-D array
+        The server to which each user of each repetition is associated
+    prices: 2-D array
+        The prices of the servers on each repetition
+
+    Returns
+    -------
+
+    utility: 2-D array
+        The utility of each user of each repetition
+    '''
+
+    B_minus_u = np.sum(b, axis=1, keepdims=True) - b
+    paid = np.take_along_axis(prices, server_selected, axis=1)
+
+    ru = b / B_minus_u
+    utility = k*np.log(1+l*ru) - a*paid*ru
+
+    return utility
+
+def batched_calculate_competitiveness(bytes_to_server, total_bytes_to_server, prices, U, S, fs, b_max, **params):
+    '''
+    Calculate the competitiveness score Rs of every repetition
+
+    Parameters
+    ----------
+
+    bytes_to_server: 2-D array
+        The number of bytes offloaded to each server of each repetition on
+        the last timeslot
+    total_bytes_to_server: 2-D array
+        The number of bytes offloaded to each server of each repetition up
+        to now
+    prices: 2-D array
+        The prices the servers of each repetition set on the last timeslot
+
+    Returns
+    -------
+
+    Rs: 2-D array
+        the competitiveness score of each server
+    relative_price: 2-D array
+        the relative pricing of each server
+    congestion: 2-D array
+        the congestion of each server
+    penetration: 2-D array
+        the penetration of each server on the offloading market
+    '''
+
+    # calculate relative pricing
+    denominator = prices - fs*prices
+    numerator = np.sum(denominator, axis=1, keepdims=True)/S
+    relative_price = numerator / denominator
+
+    # calculate congestion
+    congestion = np.power((1 + (bytes_to_server/(b_max * U))),3)
+
+    # calculate "penetration"
+    total = np.sum(total_bytes_to_server, axis=1, keepdims=True)
+    penetration = np.divide(total_bytes_to_server, total,
+            out=np.zeros_like(total_bytes_to_server), where=total!=0)
+
+    w1 = w2 = w3 = 1/3
+    Rs = w1*relative_price + w2*1/congestion + w2*penetration
+
+    return Rs,relative_price,congestion,penetration
+
+def batched_update_probabilities(Rs, probabilities, server_selected, learning_rate, **params):
+    '''
+    Update action probabilities of users of every repetition on choosing a
+    server
+
+    Parameters
+    ----------
+
+    Rs: 2-D array
+        the competitiveness score of each server of each repetition
+    probabilities: 3-D array
+        The probabilities that each user of each repetition will select the
+        specific server
+    server_selected: 2-D array
+        The server to which each user of each repetition is associated
+
+    Returns
+    -------
+
+    probabilities: 3-D array
+        The new probabilities that each user will select the specific server
+    '''
+
+    # use np.divide to handle cases where sum(Rs)=0
+    total = np.sum(Rs, axis=1, keepdims=True)
+    reward = np.divide(Rs, total, out=np.zeros_like(Rs), where=total!=0)
+
+    R, U = server_selected.shape
+    repetition = np.arange(R)[:, np.newaxis]
+    user = np.arange(U)[np.newaxis, :]
+
+    # create second part of probabilities update
+    Pr = np.copy(probabilities)
+
+    Pr[repetition, user, server_selected] = -(1-Pr[repetition, user, server_selected])
+    Pr = -Pr*learning_rate
+
+    tmp = np.take_along_axis(reward, server_selected, axis=1)
+
+    Pr = Pr * tmp[:, :, np.newaxis]
+
+    return probabilities + Pr
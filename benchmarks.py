@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""
+    MEC_offloading.benchmarks
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Benchmarks for the MEC_offloading
+
+    :copyright: (c) 2018 by Giorgos Mitsis.
+    :license: MIT License, see LICENSE for more details.
+"""
+
+import numpy as np
+import timeit
+import tracemalloc
+import tempfile
+import shutil
+import argparse
+import json
+import os
+import dill
+
+from parameters import *
+from helper_functions import initialize
+from game_functions import *
+from server_selection_functions import *
+from equilibrium_solvers import solve_game
+from result_store import *
+
+BASELINE = "saved_runs/benchmarks/baseline.json"
+
+# Grid of the scaling benchmark
+U_VALUES = (100, 10000, 1000000)
+S_VALUES = (5, 50, 500, 5000)
+
+# Cells whose probabilities have more elements are skipped, they do not fit
+# in memory
+MAX_ELEMENTS = 2*10**7
+
+# Timeslots of the history given to calculate_competitiveness
+HISTORY_LENGTH = 100
+
+def play_pricing_game_masked(server_selected, b, S, k, l, a, c, fs, price_min, **params):
+    '''
+    Previous implementation of play_pricing_game that sums each server with
+    a boolean mask over all users, costing O(S*U). Kept as a reference for
+    the benchmarks.
+    '''
+
+    B_server = np.bincount(server_selected, b, minlength=S)
+
+    B_minus_u = B_server[server_selected] - b
+    inside_sum = B_minus_u/a
+
+    numerator_sum = []
+    for i in np.arange(S):
+        numerator_sum.append(inside_sum[server_selected==i].sum())
+    numerator_sum = np.array(numerator_sum)
+
+    numerator = c*k*l*numerator_sum
+
+    denominator_sum = []
+    for i in np.arange(S):
+        denominator_sum.append(B_minus_u[server_selected==i].sum())
+    denominator_sum = np.array(denominator_sum)
+
+    denominator = (1 - fs)*denominator_sum
+    denominator[denominator==0] = 0.1
+
+    prices = np.sqrt(numerator/denominator)
+    prices[prices < price_min] = price_min
+
+    return prices
+
+def time_function(function, *args, repeats=5, **kwargs):
+    '''
+    Median running time of a function call in seconds
+
+    Parameters
+    ----------
+
+    function: callable
+        The function to time
+    repeats: int
+        Number of timed calls
+
+    Returns
+    -------
+
+    time: float
+        Median time of the calls
+    '''
+
+    times = timeit.repeat(lambda: function(*args, **kwargs), repeat=repeats, number=1)
+    return np.median(times)
+
+def measure_memory(function, *args, **kwargs):
+    '''
+    Memory allocated by a function call, traced with tracemalloc
+
+    Parameters
+    ----------
+
+    function: callable
+        The function to measure
+
+    Returns
+    -------
+
+    allocated: int
+        Bytes still allocated after the call, including its result
+    peak: int
+        Highest number of bytes allocated during the call
+    '''
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = function(*args, **kwargs)
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    del result
+    return after - before, peak - before
+
+def benchmark_state(U, S):
+    '''
+    Parameters and the state of the simulation on the first timeslot for U
+    users and S servers, used as input of the benchmarked functions
+    '''
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, S=S, U=U)
+    probabilities, prices = initialize(**params)
+    server_selected = server_selection(probabilities, **params)
+    b = play_offloading_game(server_selected, np.ones(U), prices, **params)
+    prices = play_pricing_game(server_selected, b, **params)
+
+    all_bytes_to_server = np.random.random((HISTORY_LENGTH, S)) * params["b_max"]
+    all_bytes_to_server[-1] = np.bincount(server_selected, b, minlength=S)
+    all_fs = np.tile(params["fs"], (HISTORY_LENGTH, 1))
+    all_prices = np.tile(prices, (HISTORY_LENGTH, 1))
+
+    Rs = calculate_competitiveness(all_bytes_to_server, all_fs, all_prices, **params)[0]
+
+    return {
+            "params": params,
+            "probabilities": probabilities,
+            "server_selected": server_selected,
+            "b": b,
+            "prices": prices,
+            "all_bytes_to_server": all_bytes_to_server,
+            "all_fs": all_fs,
+            "all_prices": all_prices,
+            "Rs": Rs,
+            }
+
+def timeslot(probabilities, tracker, **params):
+    '''
+    One full timeslot of simulate: server selection, the game, the
+    competitiveness and the update of the probabilities
+    '''
+
+    server_selected = server_selection(probabilities, **params)
+    b, prices, iterations = solve_game(server_selected, np.ones(params["U"]),
+            np.ones(params["S"]), **params)
+    bytes_to_server = np.bincount(server_selected, b, minlength=params["S"])
+    Rs = tracker.update(bytes_to_server, params["fs"], prices)[0]
+
+    return update_probabilities(Rs, probabilities, server_selected, b, **params)
+
+def benchmark_functions(U_values=U_VALUES, S_values=S_VALUES, repeats=5, max_elements=MAX_ELEMENTS):
+    '''
+    Time and trace the memory of the core functions of the simulation and of
+    a full timeslot on a grid of numbers of users and servers
+
+    Parameters
+    ----------
+
+    U_values: tuple
+        Numbers of users to benchmark
+    S_values: tuple
+        Numbers of servers to benchmark
+    repeats: int
+        Number of timed calls for each measurement
+    max_elements: int
+        Cells with more users times servers are skipped
+
+    Returns
+    -------
+
+    results: list of dictionaries
+        Median time in seconds and bytes allocated and at peak of every
+        function on every cell of the grid
+    '''
+
+    results = []
+    for U in U_values:
+        for S in S_values:
+            if U*S > max_elements:
+                continue
+
+            state = benchmark_state(U, S)
+            params = state["params"]
+
+            # Every call starts from the same random state
+            def seeded(function):
+                def call(*args, **kwargs):
+                    np.random.seed(7)
+                    return function(*args, **kwargs)
+                return call
+
+            calls = {
+                "server_selection": (seeded(server_selection), (state["probabilities"],)),
+                "play_offloading_game": (play_offloading_game,
+                    (state["server_selected"], np.ones(U), state["prices"])),
+                "play_pricing_game": (play_pricing_game, (state["server_selected"], state["b"])),
+                "calculate_competitiveness": (calculate_competitiveness,
+                    (state["all_bytes_to_server"], state["all_fs"], state["all_prices"])),
+                "update_probabilities": (update_probabilities,
+                    (state["Rs"], state["probabilities"], state["server_selected"], state["b"])),
+                "timeslot": (seeded(lambda probabilities, **params: timeslot(probabilities,
+                    CompetitivenessTracker(**params), **params)), (state["probabilities"],)),
+                }
+
+            for name, (function, args) in calls.items():
+                allocated, peak = measure_memory(function, *args, **params)
+                results.append({
+                    "function": name,
+                    "U": U,
+                    "S": S,
+                    "time": time_function(function, *args, repeats=repeats, **params),
+                    "allocated": allocated,
+                    "peak": peak,
+                    })
+
+    return results
+
+def save_baseline(results, path=BASELINE):
+    '''
+    Save the results of benchmark_functions as a JSON baseline
+    '''
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(path, 'w') as fp:
+        json.dump({"numpy": np.__version__, "results": results}, fp, indent=1)
+
+def load_baseline(path=BASELINE):
+    '''
+    Load the results of benchmark_functions saved with save_baseline
+    '''
+
+    with open(path) as fp:
+        return json.load(fp)["results"]
+
+def compare_to_baseline(results, baseline, time_tolerance=0.25, memory_tolerance=0.1, time_floor=1e-3):
+    '''
+    Find the measurements that regressed against a baseline
+
+    Parameters
+    ----------
+
+    results: list of dictionaries
+        The results of benchmark_functions
+    baseline: list of dictionaries
+        The results of the baseline
+    time_tolerance: float
+        Relative increase of the median time that counts as a regression
+    memory_tolerance: float
+        Relative increase of the peak memory that counts as a regression
+    time_floor: float
+        Increases of the time below this many seconds are timer noise and
+        never count as regressions
+
+    Returns
+    -------
+
+    regressions: list of dictionaries
+        Function, cell, metric and the current and baseline values of every
+        regression. Cells missing from the baseline are not compared
+    '''
+
+    reference = {(row["function"], row["U"], row["S"]): row for row in baseline}
+
+    regressions = []
+    for row in results:
+        key = (row["function"], row["U"], row["S"])
+        if key not in reference:
+            continue
+
+        for metric, tolerance, floor in (("time", time_tolerance, time_floor), ("peak", memory_tolerance, 0)):
+            if row[metric] - reference[key][metric] > max(reference[key][metric] * tolerance, floor):
+                regressions.append({
+                    "function": row["function"],
+                    "U": row["U"],
+                    "S": row["S"],
+                    "metric": metric,
+                    "value": row[metric],
+                    "baseline": reference[key][metric],
+                    })
+
+    return regressions
+
+def benchmark_pricing_game(S_values=(5, 50, 500, 5000), U=10000, repeats=5):
+    '''
+    Compare how play_pricing_game and the masked implementation scale with
+    the number of servers
+
+    Parameters
+    ----------
+
+    S_values: tuple
+        Numbers of servers to benchmark
+    U: int
+        Number of users
+    repeats: int
+        Number of timed calls for each measurement
+
+    Returns
+    -------
+
+    results: list of dictionaries
+        Median time of both implementations for every number of servers
+    '''
+
+    results = []
+    for S in S_values:
+        np.random.seed(13)
+        params = set_parameters({"users": "hetero", "servers": "hetero"}, S=S, U=U)
+        server_selected = np.random.randint(S, size=U)
+        b = np.random.random(U) * params["b_max"]
+
+        results.append({
+            "S": S,
+            "U": U,
+            "bincount": time_function(play_pricing_game, server_selected, b, repeats=repeats, **params),
+            "masked": time_function(play_pricing_game_masked, server_selected, b, repeats=repeats, **params),
+            })
+
+    return results
+
+def synthetic_result(T, U, S):
+    '''
+    A result with the shapes and types of the result of simulate
+    '''
+
+    result = {name: np.random.random((T, U)) for name in ["all_bytes_offloaded", "all_user_utility"]}
+    result["all_server_selected"] = np.random.randint(S, size=(T, U))
+    for name in ["all_prices", "all_bytes_to_server", "all_server_welfare", "all_Rs",
+            "all_relative_price", "all_congestion", "all_penetration", "all_fs", "all_c"]:
+        result[name] = np.random.random((T, S))
+    result["all_probabilities"] = np.random.random((U, T+1, S))
+    result["all_game_iterations"] = np.random.randint(50, size=T)
+    result["running_time"] = 1.0
+
+    return result
+
+def directory_size(path):
+    '''
+    Size on disk of a file or of all the files of a directory in bytes
+    '''
+
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+def benchmark_result_store(T=3000, U=100, S=5, repeats=5):
+    '''
+    Compare saving and loading a result as a dill file and as columns
+
+    Parameters
+    ----------
+
+    T: int
+        Number of timeslots of the result
+    U: int
+        Number of users
+    S: int
+        Number of servers
+    repeats: int
+        Number of timed calls for each measurement
+
+    Returns
+    -------
+
+    results: list of dictionaries
+        Median time of writing the result, reading all of it and reading
+        only all_prices for both formats, and their size on disk
+    '''
+
+    result = synthetic_result(T, U, S)
+    case = {"users": "hetero", "servers": "hetero"}
+    directory = tempfile.mkdtemp()
+
+    def write_dill(path):
+        with open(path, 'wb') as fp:
+            dill.dump(result, fp)
+
+    def read_dill(path, column=None):
+        with open(path, 'rb') as in_strm:
+            loaded = dill.load(in_strm)
+        return loaded if column is None else loaded[column]
+
+    def write_columns(path):
+        save_columns(result, path, case, 0.2, 0)
+
+    def read_columns(path, column=None):
+        if column is None:
+            return {name: np.array(value) for name, value in load_columns(path).items()}
+        return np.array(load_column(path, column))
+
+    results = []
+    try:
+        for name, write, read in (("dill", write_dill, read_dill), ("columnar", write_columns, read_columns)):
+            path = os.path.join(directory, name)
+            results.append({
+                "format": name,
+                "write": time_function(write, path, repeats=repeats),
+                "read all": time_function(read, path, repeats=repeats),
+                "read all_prices": time_function(read, path, "all_prices", repeats=repeats),
+                "size (MB)": directory_size(path) / 1e6,
+                })
+    finally:
+        shutil.rmtree(directory)
+
+    return results
+
+def print_functions(results):
+    '''
+    Print the results of benchmark_functions as a table
+    '''
+
+    print("{0:>26} {1:>8} {2:>6} {3:>12} {4:>14} {5:>12}".format("function", "U", "S", "time (s)", "allocated (MB)", "peak (MB)"))
+    for row in results:
+        print("{0:>26} {1:>8} {2:>6} {3:>12.6f} {4:>14.2f} {5:>12.2f}".format(
+            row["function"], row["U"], row["S"], row["time"], row["allocated"] / 1e6, row["peak"] / 1e6))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of the MEC offloading simulation")
+    parser.add_argument("mode", nargs="?", default="tables", choices=["tables", "baseline", "compare"],
+            help="print the tables, save a scaling baseline or compare against it")
+    parser.add_argument("--baseline", default=BASELINE, help="file of the baseline")
+    parser.add_argument("-U", type=int, nargs="+", default=U_VALUES, help="numbers of users")
+    parser.add_argument("-S", type=int, nargs="+", default=S_VALUES, help="numbers of servers")
+    parser.add_argument("--repeats", type=int, default=5, help="timed calls per measurement")
+    args = parser.parse_args()
+
+    if args.mode == "baseline":
+        results = benchmark_functions(args.U, args.S, args.repeats)
+        print_functions(results)
+        save_baseline(results, args.baseline)
+        print()
+        print("Baseline saved to " + args.baseline)
+
+    elif args.mode == "compare":
+        results = benchmark_functions(args.U, args.S, args.repeats)
+        print_functions(results)
+        regressions = compare_to_baseline(results, load_baseline(args.baseline))
+
+        print()
+        for row in regressions:
+            print("REGRESSION {0} U={1} S={2} {3}: {4:.6g} against {5:.6g}".format(
+                row["function"], row["U"], row["S"], row["metric"], row["value"], row["baseline"]))
+        if regressions:
+            raise SystemExit(1)
+        print("No regressions against " + args.baseline)
+
+    else:
+        print("play_pricing_game scaling in S")
+        print("{0:>8} {1:>10} {2:>14} {3:>14} {4:>9}".format("S", "U", "bincount (s)", "masked (s)", "speedup"))
+        for row in benchmark_pricing_game():
+            print("{0:>8} {1:>10} {2:>14.6f} {3:>14.6f} {4:>9.1f}".format(
+                row["S"], row["U"], row["bincount"], row["masked"], row["masked"] / row["bincount"]))
+
+        print()
+        print("Result store, T=3000 U=100 S=5")
+        print("{0:>10} {1:>10} {2:>12} {3:>18} {4:>10}".format("format", "write (s)", "read all (s)", "read all_prices (s)", "size (MB)"))
+        for row in benchmark_result_store():
+            print("{0:>10} {1:>10.4f} {2:>12.4f} {3:>18.6f} {4:>10.1f}".format(
+                row["format"], row["write"], row["read all"], row["read all_prices"], row["size (MB)"]))
@@ -0,0 +1,94 @@
+'''
+Functions to checkpoint and resume simulation campaigns
+'''
+
+from helper_functions import save_checkpoint, load_checkpoint, load_parameters, parameters_fingerprint
+from aggregation_functions import StreamingAggregator
+from parallel_functions import run_repetitions
+
+CAMPAIGN_CHECKPOINT = "saved_runs/checkpoints/campaign"
+
+def run_campaign(cases, repetitions, root_seed=0, workers=None, batch_size=1,
+        path=CAMPAIGN_CHECKPOINT, checkpoint_every=10):
+    '''
+    Run the repetitions of every case, saving the progress of the campaign
+    every checkpoint_every repetitions. A restarted campaign loads the
+    checkpoint and only runs the repetitions that were not completed.
+    Repetitions are seeded from the root seed, so the resumed campaign
+    produces the same results as an uninterrupted one. The campaign and the
+    completed repetitions of every case are keyed by the fingerprint of the
+    parameters and the root seed, and a checkpoint of another campaign is
+    refused. Once the campaign completes its checkpoint is marked finished,
+    and the next run starts a new campaign.
+
+    Parameters
+    ----------
+
+    cases: list of dictionaries
+        The elements of the list are the cases
+    repetitions: int
+        Number of repetitions of each case
+    root_seed: int
+        Seed from which the seed of every repetition is derived
+    workers: int
+        Number of processes, by default the number of cores
+    batch_size: int
+        Number of repetitions each task runs with the batched engine
+    path: string
+        File of the campaign checkpoint
+    checkpoint_every: int
+        Number of completed repetitions between checkpoints, 0 saves the
+        campaign only at its end
+
+    Returns
+    -------
+
+    Generator of (case, repetition, result) tuples of the repetitions run,
+    in order of completion. The campaign state, with the completed
+    repetitions for the fingerprint of every case and the aggregated
+    statistics of every case, is available with load_checkpoint(path)
+    during and after the campaign
+
+    Raises
+    ------
+
+    ValueError
+        If the checkpoint belongs to an unfinished campaign of other
+        parameters or another root seed
+    '''
+
+    parameters = [load_parameters(case) for case in cases]
+    fingerprints = {case["users"] + "_" + case["servers"]: parameters_fingerprint(params, root_seed)
+            for case, params in zip(cases, parameters)}
+    fingerprint = parameters_fingerprint(fingerprints, root_seed)
+
+    campaign = load_checkpoint(path)
+
+    if campaign is None or campaign.get("finished"):
+        campaign = {"fingerprint": fingerprint, "root_seed": root_seed, "completed": {},
+                "aggregators": {}, "finished": False}
+    elif campaign.get("fingerprint") != fingerprint:
+        raise ValueError('Checkpoint ' + path + ' belongs to a campaign with other parameters ' +
+                'or another root seed, remove it to start a new campaign')
+
+    completed = campaign["completed"]
+    aggregators = campaign["aggregators"]
+
+    for case, repetition, result in run_repetitions(cases, repetitions, root_seed,
+            workers, batch_size, completed=completed, parameters=parameters):
+        key = case["users"] + "_" + case["servers"]
+
+        if key not in aggregators:
+            # Results of the final-state profile keep only the final prices
+            prices = result["final_prices"] if "final_prices" in result else result["all_prices"][-1]
+            aggregators[key] = StreamingAggregator(len(prices))
+        aggregators[key].add(result)
+        completed.setdefault(fingerprints[key], set()).add(repetition)
+
+        if checkpoint_every > 0 and sum(len(value) for value in completed.values()) % checkpoint_every == 0:
+            save_checkpoint(path, campaign)
+
+        yield case, repetition, result
+
+    campaign["finished"] = True
+    save_checkpoint(path, campaign)
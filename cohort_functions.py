@@ -0,0 +1,526 @@
+'''
+Mean-field cohort engine. Users with the same parameters and the same
+probabilities behave identically in distribution, so they are kept as one
+weighted class instead of one row each. The cost of every timeslot is
+proportional to the number of distinct classes instead of the number of users.
+The deterministic mean-field mode goes further and evolves the expected
+probabilities of the classes without sampling.
+'''
+
+import numpy as np
+import time
+
+from parameters import EQUILIBRIUM_SOLVER, MAX_GAME_ITERATIONS
+from helper_functions import initialize
+from equilibrium_solvers import solve_game
+from server_selection_functions import update_probabilities, all_users_sure, CompetitivenessTracker
+from metrics import calculate_server_welfare
+from history_recorder import HistoryRecorder
+from simulation_functions import simulate
+
+class Cohorts:
+    '''
+    Weighted classes of users with identical parameters and probabilities
+
+    Parameters
+    ----------
+
+    a_values: 1-D array
+        The distinct values of the parameter a of the users
+    a_index: 1-D array
+        Index on a_values of the a of each class
+    probabilities: 2-D array
+        Each row is the probabilities of a class to select each server
+    weights: 1-D array
+        Number of users of each class
+    '''
+
+    def __init__(self, a_values, a_index, probabilities, weights):
+        self.a_values = a_values
+        self.a_index = a_index
+        self.probabilities = probabilities
+        self.weights = weights
+
+    @classmethod
+    def from_users(cls, a, probabilities):
+        '''
+        Group the users with identical a and probabilities
+
+        Parameters
+        ----------
+
+        a: 1-D array
+            The parameter a of each user
+        probabilities: 2-D array
+            Each row is the probabilities of a user to select each server
+        '''
+
+        a_values, a_index = np.unique(a, return_inverse=True)
+        return cls(a_values, a_index, probabilities, np.ones(len(a), int)).merged()
+
+    def __len__(self):
+        return len(self.weights)
+
+    def merged(self, resolution=None):
+        '''
+        Merge the classes with the same a and probabilities
+
+        Parameters
+        ----------
+
+        resolution: float
+            If set, classes whose probabilities round to the same multiple of
+            resolution are merged too, with the average of their probabilities
+            weighted by their users. Merging is exact by default
+
+        Returns
+        -------
+
+        cohorts: Cohorts
+            The merged classes
+        '''
+
+        key = self.probabilities if resolution is None else np.round(self.probabilities / resolution)
+        _, index, inverse = np.unique(np.column_stack((self.a_index, key)), axis=0,
+                return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+
+        weights = np.bincount(inverse, self.weights)
+
+        if resolution is None:
+            probabilities = self.probabilities[index]
+        else:
+            probabilities = np.zeros((len(index), self.probabilities.shape[1]))
+            np.add.at(probabilities, inverse, self.weights[:, np.newaxis] * self.probabilities)
+            probabilities /= weights[:, np.newaxis]
+
+        return Cohorts(self.a_values, self.a_index[index], probabilities, weights.astype(int))
+
+    def draw(self):
+        '''
+        Draw how many users of each class select each server with one
+        multinomial draw per class
+
+        Returns
+        -------
+
+        counts: 2-D array
+            Number of users of each class (rows) that selected each server
+            (columns)
+        '''
+
+        # The multinomial is drawn as a chain of binomials over the servers,
+        # one vectorized draw for all the classes per server
+        S = self.probabilities.shape[1]
+        counts = np.zeros((len(self), S), int)
+        remaining = self.weights.copy()
+        left = np.ones(len(self))
+
+        for s in range(S-1):
+            share = np.divide(self.probabilities[:, s], left, out=np.zeros(len(self)), where=left>0)
+            counts[:, s] = np.random.binomial(remaining, np.clip(share, 0, 1))
+            remaining -= counts[:, s]
+            left -= self.probabilities[:, s]
+        counts[:, -1] = remaining
+
+        return counts
+
+def cohort_offloading_game(server_selected, b_old, prices, weights, k, l, a, b_max, b_min, **params):
+    '''
+    play_offloading_game on groups of identical users
+
+    Parameters
+    ----------
+
+    server_selected: 1-D array
+        The server of each group
+    b_old: 1-D array
+        offloading data each user of the group had decided to send on the
+        previous iteration
+    prices: 1-D array
+        Set the new prices of the servers
+    weights: 1-D array
+        Number of users of each group
+    a: 1-D array
+        The parameter a of the users of each group
+
+    Returns
+    -------
+
+    b: 1-D array
+        offloading data each user of the group has decided to send on the
+        current iteration
+    '''
+
+    # Sum of all best responses
+    B = np.dot(weights, b_old)
+
+    # Best response of all users except the user
+    B_minus_u = B - b_old
+
+    paid = prices[server_selected]
+
+    b = (B_minus_u/l) * ((k*l/(a*paid)) - 1)
+
+    return np.clip(b, b_min, b_max)
+
+def cohort_pricing_game(server_selected, b, weights, S, k, l, a, c, fs, price_min, **params):
+    '''
+    play_pricing_game on groups of identical users
+
+    Parameters
+    ----------
+
+    server_selected: 1-D array
+        The server of each group
+    b: 1-D array
+        offloading data each user of the group had decided to send
+    weights: 1-D array
+        Number of users of each group
+    a: 1-D array
+        The parameter a of the users of each group
+
+    Returns
+    -------
+
+    prices: 1-D array
+        Set the new prices of the servers
+    '''
+
+    B_server = np.bincount(server_selected, weights*b, minlength=S)
+
+    # Best response of all users except the user on each server. The
+    # expected loads of the mean-field mode can put less than one user on a
+    # server, so the load without the user is kept from going negative
+    B_minus_u = np.maximum(B_server[server_selected] - b, 0)
+
+    numerator = c*k*l*np.bincount(server_selected, weights*B_minus_u/a, minlength=S)
+    denominator = (1 - fs)*np.bincount(server_selected, weights*B_minus_u, minlength=S)
+
+    # If the server has not been chosen the price is set to price_min
+    denominator[denominator==0] = 0.1
+
+    prices = np.sqrt(numerator/denominator)
+    prices[prices < price_min] = price_min
+
+    return prices
+
+def simulate_cohorts(params, resolution=None, classes=None):
+    '''
+    Run one repetition of the simulation with the users grouped in classes.
+    The users of a class draw their servers with one multinomial, and the
+    class splits only into the servers whose update changes its
+    probabilities. Every user of a class that selected the same server
+    offloads the same, so the game is played once per distinct a and server.
+
+    Parameters
+    ----------
+
+    params: dictionary
+        Dictonary of the parameters as returned by set_parameters
+    resolution: float
+        Classes whose probabilities differ less than this are merged, which
+        bounds the number of classes at the cost of an approximation. By
+        default only identical classes are merged and the engine samples the
+        same process as simulate, but every class splits on every timeslot
+        until there are about as many classes as users, so only the
+        approximate mode is faster than simulate
+    classes: int
+        If set, the users are binned in at most this many classes of a, see
+        a_classes, every class taking the mean a of its users. Users of
+        different a are never merged, so with heterogeneous users this
+        bounds the number of classes as much as resolution does
+
+    Returns
+    -------
+
+    result: dictionary
+        The per server histories of simulate, the number of users on each
+        server (all_users_on_server), the number of classes (all_classes) and
+        the average user utility (all_average_user_utility) of every
+        timeslot, the classes at the end (final_a, final_probabilities,
+        final_weights) and the running time. The per user histories are not
+        kept
+    '''
+
+    U = params['U']
+    S = params['S']
+    fs = params['fs']
+    c = params['c']
+    k = params['k']
+    l = params['l']
+
+    start = time.time()
+
+    history = HistoryRecorder()
+    for name in ["all_bytes_to_server", "all_prices",
+            "all_relative_price", "all_server_welfare", "all_Rs",
+            "all_congestion", "all_penetration"]:
+        history.add(name, (S,))
+    history.add("all_users_on_server", (S,), int)
+    history.add("all_game_iterations", (), int)
+    history.add("all_classes", (), int)
+    history.add("all_average_user_utility", ())
+
+    competitiveness = CompetitivenessTracker(**params)
+
+    probabilities, prices = initialize(**params)
+    if classes is None:
+        cohorts = Cohorts.from_users(params['a'], probabilities)
+    else:
+        # All users start from the same probabilities
+        a_values, weights = a_classes(params['a'], classes)
+        K = len(a_values)
+        cohorts = Cohorts(a_values, np.arange(K), probabilities[:K], weights)
+
+    while not all_users_sure(cohorts.probabilities):
+        counts = cohorts.draw()
+        cohort, server = np.nonzero(counts)
+        users = counts[cohort, server]
+
+        # Users of every class with the same a on the same server play the
+        # same, so they form one group of the game
+        _, group, inverse = np.unique(cohorts.a_index[cohort]*S + server,
+                return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        group_server = server[group]
+        group_a = cohorts.a_values[cohorts.a_index[cohort[group]]]
+        group_users = np.bincount(inverse, users)
+
+        game = dict(params, a=group_a, weights=group_users)
+        b, prices, iterations = solve_game(group_server, np.ones(len(group)), np.ones(S),
+                method=EQUILIBRIUM_SOLVER, max_iterations=MAX_GAME_ITERATIONS,
+                offloading_game=cohort_offloading_game, pricing_game=cohort_pricing_game, **game)
+
+        bytes_to_server = np.bincount(group_server, group_users*b, minlength=S)
+        server_welfare = calculate_server_welfare(prices, bytes_to_server, **params)
+
+        B_minus_u = np.dot(group_users, b) - b
+        ru = b / B_minus_u
+        utility = k*np.log(1+l*ru) - group_a*prices[group_server]*ru
+
+        Rs,relative_price,congestion,penetration = competitiveness.update(bytes_to_server, fs, prices)
+
+        # Every class splits into the servers its users selected
+        split = cohorts.probabilities[cohort]
+        split = update_probabilities(Rs, split, server, b[inverse], **params)
+        cohorts = Cohorts(cohorts.a_values, cohorts.a_index[cohort], split, users).merged(resolution)
+
+        history.record("all_bytes_to_server", bytes_to_server)
+        history.record("all_prices", prices)
+        history.record("all_server_welfare", server_welfare)
+        history.record("all_Rs", Rs)
+        history.record("all_congestion", congestion)
+        history.record("all_penetration", penetration)
+        history.record("all_relative_price", relative_price)
+        history.record("all_users_on_server", np.bincount(server, users, minlength=S))
+        history.record("all_game_iterations", iterations)
+        history.record("all_classes", len(cohorts))
+        history.record("all_average_user_utility", np.dot(group_users, utility) / U)
+
+    result = history.to_dict()
+
+    # The discount and cost of the servers never change
+    T = len(result["all_prices"])
+    result["all_fs"] = np.broadcast_to(fs, (T, S))
+    result["all_c"] = np.broadcast_to(c, (T, S))
+
+    result["final_a"] = cohorts.a_values[cohorts.a_index]
+    result["final_probabilities"] = cohorts.probabilities
+    result["final_weights"] = cohorts.weights
+    result["running_time"] = time.time() - start
+
+    return result
+
+def a_classes(a, classes=100):
+    '''
+    Group the users in classes by their parameter a
+
+    Parameters
+    ----------
+
+    a: 1-D array
+        The parameter a of each user
+    classes: int
+        Maximum number of classes. If the users have more distinct values of
+        a they are binned on quantiles of a and every class takes the mean a
+        of its users
+
+    Returns
+    -------
+
+    a_values: 1-D array
+        The a of each class
+    weights: 1-D array
+        Number of users of each class
+    '''
+
+    a_values, weights = np.unique(a, return_counts=True)
+    if len(a_values) <= classes:
+        return a_values, weights
+
+    edges = np.quantile(a, np.linspace(0, 1, classes+1)[1:-1])
+    index = np.searchsorted(edges, a, side='right')
+    weights = np.bincount(index, minlength=classes)
+    a_values = np.bincount(index, a, minlength=classes)
+
+    keep = weights > 0
+    return a_values[keep] / weights[keep], weights[keep]
+
+def simulate_mean_field(params, classes=100, tolerance=1e-6, max_timeslots=10000):
+    '''
+    Run the deterministic mean-field approximation of the simulation, the
+    limit of many users per server. Instead of sampling the servers, every
+    class of users evolves its expected probabilities: the update of
+    update_probabilities for every server averaged with the probability to
+    select it. The game is played on the expected number of users of every
+    class on every server, so there is no randomness at all.
+
+    The expected probabilities of a class stand for the share of its users
+    that end up on every server, so they settle on a fixed point instead of
+    making every class sure of one server. The simulation stops when the
+    classes are sure, when the probabilities change less than tolerance or
+    after max_timeslots.
+
+    Parameters
+    ----------
+
+    params: dictionary
+        Dictonary of the parameters as returned by set_parameters
+    classes: int
+        Maximum number of classes of users, see a_classes
+    tolerance: float
+        Largest change of the probabilities at the fixed point
+    max_timeslots: int
+        Maximum number of timeslots
+
+    Returns
+    -------
+
+    result: dictionary
+        The same keys as the result of simulate_cohorts, with the expected
+        number of users on each server on all_users_on_server
+    '''
+
+    U = params['U']
+    S = params['S']
+    fs = params['fs']
+    c = params['c']
+    k = params['k']
+    l = params['l']
+
+    start = time.time()
+
+    history = HistoryRecorder()
+    for name in ["all_bytes_to_server", "all_prices",
+            "all_relative_price", "all_server_welfare", "all_Rs",
+            "all_congestion", "all_penetration", "all_users_on_server"]:
+        history.add(name, (S,))
+    history.add("all_game_iterations", (), int)
+    history.add("all_classes", (), int)
+    history.add("all_average_user_utility", ())
+
+    competitiveness = CompetitivenessTracker(**params)
+
+    a_values, weights = a_classes(params['a'], classes)
+    K = len(a_values)
+    probabilities, prices = initialize(**dict(params, U=K))
+
+    # Every class plays the game on every server, weighted by the expected
+    # number of its users there
+    group_server = np.tile(np.arange(S), K)
+    group_a = np.repeat(a_values, S)
+
+    timeslot = 0
+    change = np.inf
+    while not all_users_sure(probabilities) and change > tolerance and timeslot < max_timeslots:
+        users = (weights[:, np.newaxis] * probabilities).ravel()
+
+        game = dict(params, a=group_a, weights=users)
+        b, prices, iterations = solve_game(group_server, np.ones(K*S), np.ones(S),
+                method=EQUILIBRIUM_SOLVER, max_iterations=MAX_GAME_ITERATIONS,
+                offloading_game=cohort_offloading_game, pricing_game=cohort_pricing_game, **game)
+
+        bytes_to_server = np.bincount(group_server, users*b, minlength=S)
+        server_welfare = calculate_server_welfare(prices, bytes_to_server, **params)
+
+        B_minus_u = np.dot(users, b) - b
+        ru = b / B_minus_u
+        utility = k*np.log(1+l*ru) - group_a*prices[group_server]*ru
+
+        Rs,relative_price,congestion,penetration = competitiveness.update(bytes_to_server, fs, prices)
+
+        # Update of every class for every server it may select, averaged
+        # with the probabilities to select them. They are normalized as
+        # server_selection does, otherwise rounding errors of the sums grow
+        updated = update_probabilities(Rs, np.repeat(probabilities, S, axis=0), group_server, b, **params)
+        selection = probabilities / probabilities.sum(axis=1, keepdims=True)
+        updated = np.einsum('ks,ksj->kj', selection, updated.reshape(K, S, S))
+
+        change = np.max(np.abs(updated - probabilities))
+        probabilities = updated
+
+        history.record("all_bytes_to_server", bytes_to_server)
+        history.record("all_prices", prices)
+        history.record("all_server_welfare", server_welfare)
+        history.record("all_Rs", Rs)
+        history.record("all_congestion", congestion)
+        history.record("all_penetration", penetration)
+        history.record("all_relative_price", relative_price)
+        history.record("all_users_on_server", np.bincount(group_server, users, minlength=S))
+        history.record("all_game_iterations", iterations)
+        history.record("all_classes", K)
+        history.record("all_average_user_utility", np.dot(users, utility) / U)
+
+        timeslot += 1
+
+    result = history.to_dict()
+
+    # The discount and cost of the servers never change
+    result["all_fs"] = np.broadcast_to(fs, (timeslot, S))
+    result["all_c"] = np.broadcast_to(c, (timeslot, S))
+
+    result["final_a"] = a_values
+    result["final_probabilities"] = probabilities
+    result["final_weights"] = weights
+    result["running_time"] = time.time() - start
+
+    return result
+
+def compare_mean_field(params, repetitions=10, timeslots=50):
+    '''
+    Compare the share of users on every server of the mean-field mode with
+    the average of repetitions of simulate
+
+    Parameters
+    ----------
+
+    params: dictionary
+        Dictonary of the parameters as returned by set_parameters
+    repetitions: int
+        Number of repetitions of simulate
+    timeslots: int
+        Number of first timeslots compared, the ones every repetition reached
+
+    Returns
+    -------
+
+    difference: 1-D array
+        Largest absolute difference of the shares over the servers on every
+        compared timeslot
+    '''
+
+    U = params['U']
+    S = params['S']
+
+    mean_field = simulate_mean_field(params, max_timeslots=timeslots)["all_users_on_server"] / U
+
+    # The summary profile keeps the users on every server whatever RECORDING
+    # is, without the per user histories
+    shares = np.zeros((timeslots, S))
+    for _ in range(repetitions):
+        users_on_server = simulate(params, recording="summary")["all_users_on_server"][:timeslots]
+        shares[:len(users_on_server)] += users_on_server / U
+
+    T = min(timeslots, len(mean_field))
+    return np.max(np.abs(shares[:T] / repetitions - mean_field[:T]), axis=1)
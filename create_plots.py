@@ -15,13 +15,30 @@ import matplotlib.pyplot as plt
 from parameters import *
 from plots import *
 
+from history_recorder import USER_HISTORIES
+
 import itertools
 import dill
 
+# History shown by each plot, in the order of the subplots
+PLOTS = [
+        ("all_bytes_offloaded", plot_data_offloading_of_users),
+        ("all_server_selected", plot_num_of_users_on_each_server),
+        ("all_prices", plot_pricing_of_each_server),
+        ("all_bytes_to_server", plot_receiving_data_on_each_server),
+        ("all_Rs", plot_server_Rs),
+        ("all_congestion", plot_server_congestion),
+        ("all_penetration", plot_server_penetration),
+        ("all_fs", plot_server_discount),
+        ("all_c", plot_server_cost),
+        ("all_relative_price", plot_server_relative_price),
+        ("all_server_welfare", plot_server_welfare),
+        ("all_user_utility", plot_user_utility),
+        ]
 
 def create_plots(results, cases, params):
     '''
-    Create all the plots
+    Create the plots of every history the results keep
 
     Parameters
     ----------
@@ -46,43 +63,26 @@ def create_plots(results, cases, params):
 
         if ONE_FIGURE == True:
             plt.figure(figsize=(40.0, 30.0))
-            plt.subplot(4,4,1)
-            plot_data_offloading_of_users(results[key]['all_bytes_offloaded'][:results[key]["median_timeslots"]])
-            plt.subplot(4,4,2)
-            plot_num_of_users_on_each_server(results[key]['all_server_selected'][:results[key]["median_timeslots"]], **params)
-            plt.subplot(4,4,3)
-            plot_pricing_of_each_server(results[key]['all_prices'][:results[key]["median_timeslots"]])
-            plt.subplot(4,4,4)
-            plot_receiving_data_on_each_server(results[key]['all_bytes_to_server'][:results[key]["median_timeslots"]])
-            plt.subplot(4,4,5)
-            plot_server_Rs(results[key]['all_Rs'][:results[key]["median_timeslots"]])
-            plt.subplot(4,4,6)
-            plot_server_congestion(results[key]['all_congestion'][:results[key]["median_timeslots"]])
-            plt.subplot(4,4,7)
-            plot_server_penetration(results[key]['all_penetration'][:results[key]["median_timeslots"]])
-            plt.subplot(4,4,8)
-            plot_server_discount(results[key]['all_fs'][:results[key]["median_timeslots"]])
-            plt.subplot(4,4,9)
-            plot_server_cost(results[key]['all_c'][:results[key]["median_timeslots"]])
-            plt.subplot(4,4,10)
-            plot_server_relative_price(results[key]['all_relative_price'][:results[key]["median_timeslots"]])
-            plt.subplot(4,4,11)
-            plot_server_welfare(results[key]['all_server_welfare'][:results[key]["median_timeslots"]])
-            plt.subplot(4,4,12)
-            plot_user_utility(results[key]['all_user_utility'][:results[key]["median_timeslots"]])
-        else:
-            plot_data_offloading_of_users(results[key]['all_bytes_offloaded'][:results[key]["median_timeslots"]])
-            plot_num_of_users_on_each_server(results[key]['all_server_selected'][:results[key]["median_timeslots"]], **params)
-            plot_pricing_of_each_server(results[key]['all_prices'][:results[key]["median_timeslots"]])
-            plot_receiving_data_on_each_server(results[key]['all_bytes_to_server'][:results[key]["median_timeslots"]])
-            plot_server_Rs(results[key]['all_Rs'][:results[key]["median_timeslots"]])
-            plot_server_congestion(results[key]['all_congestion'][:results[key]["median_timeslots"]])
-            plot_server_penetration(results[key]['all_penetration'][:results[key]["median_timeslots"]])
-            plot_server_discount(results[key]['all_fs'][:results[key]["median_timeslots"]])
-            plot_server_cost(results[key]['all_c'][:results[key]["median_timeslots"]])
-            plot_server_relative_price(results[key]['all_relative_price'][:results[key]["median_timeslots"]])
-            plot_server_welfare(results[key]['all_server_welfare'][:results[key]["median_timeslots"]])
-            plot_user_utility(results[key]['all_user_utility'][:results[key]["median_timeslots"]])
+
+        # The per user histories may be recorded only every few timeslots
+        every = results[key].get("recorded_every", 1)
+
+        for i, (name, plot) in enumerate(PLOTS):
+            # Skip the histories the recording profile did not keep
+            if name not in results[key]:
+                continue
+
+            # The users on each server are aggregated on every timeslot
+            timeslots = results[key]["median_timeslots"]
+            if name in USER_HISTORIES and name != "all_server_selected":
+                timeslots = (timeslots - 1)//every + 1
+
+            if ONE_FIGURE == True:
+                plt.subplot(4,4,i+1)
+            if plot == plot_num_of_users_on_each_server:
+                plot(results[key][name][:timeslots], **params)
+            else:
+                plot(results[key][name][:timeslots])
 
         # for user in range(U):
         #     plot_user_probability_to_select_server(user, all_probabilities)
@@ -0,0 +1,279 @@
+'''
+Solvers for the fixed point of the offloading and pricing game
+'''
+
+import numpy as np
+import warnings
+import hashlib
+
+from collections import OrderedDict
+
+from parameters import GameParameters
+from game_functions import *
+
+def solve_game(server_selected, b_old, prices_old, method="plain", max_iterations=1000,
+        relaxation=None, memory=5, offloading_game=None, pricing_game=None,
+        game=None, **params):
+    '''
+    Find the equilibrium of the offloading and pricing game. One iteration
+    of the game is the users' best response to the previous offloading and
+    prices followed by the servers' best response to the new offloading.
+
+    Parameters
+    ----------
+
+    server_selected: 1-D array
+        list containing the server to which each user is associated
+    b_old: 1-D array
+        offloading data each user starts the game with
+    prices_old: 1-D array
+        prices the servers start the game with
+    method: string
+        "plain" repeats the best responses, "damped" (relaxation < 1) and
+        "over-relaxed" (relaxation > 1) move the iterate only part of the way
+        (or further) towards the best responses and "anderson" uses Anderson
+        acceleration on the last memory iterates
+    max_iterations: int
+        Maximum number of iterations before giving up on convergence
+    relaxation: float
+        Weight of the best response for the damped and over-relaxed methods,
+        by default 0.5 and 1.5 respectively
+    memory: int
+        Number of previous iterates used by Anderson acceleration
+    offloading_game: function
+        Best response of the users with the signature of
+        play_offloading_game, offloading_best_response by default
+    pricing_game: function
+        Best response of the servers with the signature of
+        play_pricing_game, pricing_best_response by default
+    game: GameParameters
+        The parameters of the game, built from params if not given. Passing
+        the same one on every timeslot keeps its derived constants
+
+    Returns
+    -------
+
+    b: 1-D array
+        offloading data of each user at the equilibrium
+    prices: 1-D array
+        prices of the servers at the equilibrium
+    iterations: int
+        number of best responses played until convergence
+    '''
+
+    if method not in SOLVERS:
+        raise ValueError('Unknown equilibrium solver ' + str(method))
+
+    if game is None:
+        game = GameParameters.from_dict(params)
+
+    def best_response(b, prices):
+        if offloading_game is None:
+            b = offloading_best_response(server_selected, b, prices, game)
+        else:
+            b = offloading_game(server_selected, b, prices, **params)
+
+        if pricing_game is None:
+            prices = pricing_best_response(server_selected, b, game)
+        else:
+            prices = pricing_game(server_selected, b, **params)
+
+        return b, prices
+
+    def converged(b, b_old, prices, prices_old):
+        return best_responses_converged(b, b_old, prices, prices_old, game)
+
+    if relaxation is None:
+        relaxation = 0.5 if method == "damped" else 1.5
+
+    solver = SOLVERS[method]
+
+    return solver(best_response, converged, b_old, prices_old, max_iterations=max_iterations,
+            relaxation=relaxation, memory=memory, **params)
+
+def plain_iteration(best_response, converged, b_old, prices_old, max_iterations, **params):
+    '''
+    Repeat the best responses until the game converges
+    '''
+
+    for iterations in range(1, max_iterations+1):
+        b, prices = best_response(b_old, prices_old)
+
+        if converged(b, b_old, prices, prices_old):
+            return b, prices, iterations
+
+        b_old = b
+        prices_old = prices
+
+    _warn_not_converged(max_iterations)
+    return b, prices, max_iterations
+
+def relaxed_iteration(best_response, converged, b_old, prices_old, max_iterations, relaxation, b_min, b_max, price_min, **params):
+    '''
+    Move the iterate by relaxation times the step towards the best responses,
+    damping the iteration when relaxation < 1 and over-relaxing it when
+    relaxation > 1
+    '''
+
+    for iterations in range(1, max_iterations+1):
+        b, prices = best_response(b_old, prices_old)
+
+        if converged(b, b_old, prices, prices_old):
+            return b, prices, iterations
+
+        b_old = np.clip(b_old + relaxation*(b - b_old), b_min, b_max)
+        prices_old = np.maximum(prices_old + relaxation*(prices - prices_old), price_min)
+
+    _warn_not_converged(max_iterations)
+    return b, prices, max_iterations
+
+def anderson_iteration(best_response, converged, b_old, prices_old, max_iterations, memory, b_min, b_max, price_min, e1, e2, **params):
+    '''
+    Anderson acceleration of the best responses. The next iterate is the
+    combination of the last best responses whose residuals have the smallest
+    norm. Offloading and prices are scaled by their tolerances so that both
+    weigh the same on the least squares problem.
+
+    The game also has a repelling equilibrium where nobody offloads, which
+    extrapolation can jump to while the offloading is still growing. The
+    acceleration is therefore only used while the residuals contract, and
+    the plain best response is played otherwise.
+    '''
+
+    U = len(b_old)
+    scale = np.concatenate((np.full(U, e1), np.full(len(prices_old), e2)))
+
+    x = np.concatenate((b_old, prices_old)) / scale
+    residuals = []
+    responses = []
+
+    for iterations in range(1, max_iterations+1):
+        b, prices = best_response(x[:U]*scale[:U], x[U:]*scale[U:])
+
+        if converged(b, x[:U]*scale[:U], prices, x[U:]*scale[U:]):
+            return b, prices, iterations
+
+        g = np.concatenate((b, prices)) / scale
+        f = g - x
+
+        if residuals and np.linalg.norm(f) >= np.linalg.norm(residuals[-1]):
+            # Not contracting, forget the history and play the best response
+            residuals = []
+            responses = []
+
+        residuals.append(f)
+        responses.append(g)
+        if len(residuals) > memory + 1:
+            residuals.pop(0)
+            responses.pop(0)
+
+        if len(residuals) == 1:
+            x = g
+            continue
+
+        # Differences of the last residuals and best responses
+        dF = np.diff(np.array(residuals), axis=0).T
+        dG = np.diff(np.array(responses), axis=0).T
+
+        gamma = np.linalg.lstsq(dF, f, rcond=None)[0]
+        x = g - dG @ gamma
+
+        if not np.all(np.isfinite(x)):
+            # Restart from the plain best response
+            x = g
+            residuals = [f]
+            responses = [g]
+
+        # Keep the iterate inside the strategy spaces
+        x[:U] = np.clip(x[:U]*scale[:U], b_min, b_max) / scale[:U]
+        x[U:] = np.maximum(x[U:]*scale[U:], price_min) / scale[U:]
+
+    _warn_not_converged(max_iterations)
+    return b, prices, max_iterations
+
+def _warn_not_converged(max_iterations):
+    warnings.warn('Game did not converge in ' + str(max_iterations) + ' iterations', RuntimeWarning)
+
+class EquilibriumCache:
+    '''
+    Bounded least recently used cache of the equilibria of the game. Started
+    from the same offloading and prices, the equilibrium only depends on the
+    servers the users selected and on the parameters, so it is keyed by a
+    hash of server_selected and of the fingerprint of the parameters.
+
+    Parameters
+    ----------
+
+    capacity: int
+        Maximum number of equilibria kept
+    fingerprint: string
+        Fingerprint of the parameters, see parameters_fingerprint
+    '''
+
+    def __init__(self, capacity=128, fingerprint=""):
+        self.capacity = capacity
+        self.fingerprint = fingerprint.encode()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, server_selected):
+        '''
+        Hash of an assignment of the users to the servers
+        '''
+
+        digest = hashlib.blake2b(self.fingerprint, digest_size=16)
+        digest.update(np.ascontiguousarray(server_selected).tobytes())
+        return digest.digest()
+
+    def get(self, server_selected):
+        '''
+        The cached equilibrium of an assignment
+
+        Returns
+        -------
+
+        equilibrium: tuple
+            The cached (b, prices) as read-only arrays, or None if the
+            assignment is not cached
+        '''
+
+        key = self.key(server_selected)
+        if key not in self.entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, server_selected, b, prices):
+        '''
+        Cache the equilibrium of an assignment, evicting the least recently
+        used one if the cache is full
+        '''
+
+        b = b.copy()
+        prices = prices.copy()
+        b.setflags(write=False)
+        prices.setflags(write=False)
+
+        key = self.key(server_selected)
+        self.entries[key] = (b, prices)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def report(self):
+        '''
+        Hits and misses of the cache
+        '''
+
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "capacity": self.capacity}
+
+SOLVERS = {
+        "plain": plain_iteration,
+        "damped": relaxed_iteration,
+        "over-relaxed": relaxed_iteration,
+        "anderson": anderson_iteration,
+        }
@@ -4,10 +4,10 @@ Game theory functions
 
 import numpy as np
 
-def play_offloading_game(server_selected, b_old, prices, k, l, a, b_max, b_min, **params):
+def offloading_best_response(server_selected, b_old, prices, game):
     '''
-    Users play the offloading game to find their best response based on what
-    the other users played.
+    Best response of the users as play_offloading_game, with the parameters
+    read from a GameParameters and k*l computed once
 
     Parameters
     ----------
@@ -19,19 +19,8 @@ def play_offloading_game(server_selected, b_old, prices, k, l, a, b_max, b_min,
         iteration
     prices: 1-D array
         Set the new prices of the servers
-    k: int
-        parameter of the user's satisfaction function
-    l: int
-        parameter of the user's satisfaction function
-    a: 1-D array
-        parameter that reflects users' dynamic behavior to spen more money
-        in order to buy computing support from the MEC servers
-    b_min: int
-        Minimum number of bits that the user is willing to offload
-        Same for all users
-    b_max: int
-        Maximum number of bits that the user is willing to offload
-        Same for all users
+    game: GameParameters
+        The parameters of the simulation
 
     Returns
     -------
@@ -39,9 +28,40 @@ def play_offloading_game(server_selected, b_old, prices, k, l, a, b_max, b_min,
     b: 1-D array
         offloading data each user has decided to send on the current
         iteration
+    '''
+
+    return _offloading_response(server_selected, b_old, prices, game.l, game.kl, game.a,
+            game.b_max, game.b_min)
+
+def pricing_best_response(server_selected, b, game):
+    '''
+    Best response of the servers as play_pricing_game, with the parameters
+    read from a GameParameters and c*k*l and 1-fs computed once
+
+    Parameters
+    ----------
+
+    server_selected: 1-D array
+        list containing the server to which each user is associated
+    b: 1-D array
+        offloading data each user had decided to send
+    game: GameParameters
+        The parameters of the simulation
 
+    Returns
+    -------
+
+    prices: 1-D array
+        Set the new prices of the servers
     '''
 
+    return _pricing_response(server_selected, b, game.S, game.a, game.ckl,
+            game.one_minus_fs, game.price_min)
+
+def _offloading_response(server_selected, b_old, prices, l, kl, a, b_max, b_min):
+    # Best response of the users from the parameters it reads, k*l given
+    # already computed
+
     # Sum of all best responses
     B = np.sum(b_old)
 
@@ -49,10 +69,10 @@ def play_offloading_game(server_selected, b_old, prices, k, l, a, b_max, b_min,
     B_minus_u = B - b_old
 
     # price paid by user based on server's price
-    paid = prices[tuple([server_selected])]
+    paid = prices[server_selected]
 
     # calculation of best response for every user based on Theorem 1
-    b = (B_minus_u/l) * ((k*l/(a*paid)) - 1)
+    b = (B_minus_u/l) * ((kl/(a*paid)) - 1)
 
     # limit result inside [0, Iu] -> [b_min, b_max]
     b[b>b_max] = b_max
@@ -60,10 +80,96 @@ def play_offloading_game(server_selected, b_old, prices, k, l, a, b_max, b_min,
 
     return b
 
+def _pricing_response(server_selected, b, S, a, ckl, one_minus_fs, price_min):
+    # Best response of the servers from the parameters it reads, c*k*l and
+    # 1-fs given already computed
+
+    # The sums and prices are kept in the precision of b, at least float32
+    dtype = np.result_type(b.dtype, np.float32)
+
+    # Sum of all best responses on each server
+    # np.bincount sums all values on the specific index, so all values corresponding
+    # to each server. We specify minlength so that even if the last server
+    # is not chosen, we have 0 as a value
+    B_server = np.bincount(server_selected, b, minlength=S).astype(dtype, copy=False)
+
+    # Best response of all users except the user on each server
+    B_minus_u = B_server[server_selected] - b
+
+    # sum (B_server - b)/a over the users of each server
+    numerator_sum = np.bincount(server_selected, B_minus_u/a, minlength=S)
+    numerator = ckl*numerator_sum
+
+    denominator_sum = np.bincount(server_selected, B_minus_u, minlength=S)
+    denominator = one_minus_fs*denominator_sum
+
+    # If the server has not been chosen, then give a value to the denominator
+    # so that the price is set to 0/0.1 = 0
+    denominator[denominator==0] = 0.1
+
+    prices = np.sqrt(numerator/denominator)
+
+    if prices.any() < 0:
+        raise ValueError('Prices should be > 0')
+
+    prices[prices < price_min] = price_min
+
+    return prices.astype(dtype, copy=False)
+
+def best_responses_converged(b, b_old, p, p_old, game):
+    '''
+    game_converged with the tolerances read from a GameParameters
+    '''
+
+    # e1 and e2 are the error tolerance defined in parameters
+    return bool((np.abs(b - b_old) < game.e1).all() and (np.abs(p - p_old) < game.e2).all())
+
+def play_offloading_game(server_selected, b_old, prices, k, l, a, b_max, b_min, **params):
+    '''
+    Users play the offloading game to find their best response based on what
+    the other users played. Adapter of offloading_best_response for the
+    dictionary of the parameters.
+
+    Parameters
+    ----------
+
+    server_selected: 1-D array
+        list containing the server to which each user is associated
+    b_old: 1-D array
+        offloading data each user had decided to send on the previous
+        iteration
+    prices: 1-D array
+        Set the new prices of the servers
+    k: int
+        parameter of the user's satisfaction function
+    l: int
+        parameter of the user's satisfaction function
+    a: 1-D array
+        parameter that reflects users' dynamic behavior to spen more money
+        in order to buy computing support from the MEC servers
+    b_min: int
+        Minimum number of bits that the user is willing to offload
+        Same for all users
+    b_max: int
+        Maximum number of bits that the user is willing to offload
+        Same for all users
+
+    Returns
+    -------
+
+    b: 1-D array
+        offloading data each user has decided to send on the current
+        iteration
+
+    '''
+
+    return _offloading_response(server_selected, b_old, prices, l, k*l, a, b_max, b_min)
+
 def play_pricing_game(server_selected, b, S, k, l, a, c, fs, price_min, **params):
     '''
     Servers play the pricing game to find their best response based on what
-    the users played. Basically just maximize their gain
+    the users played. Basically just maximize their gain. Adapter of
+    pricing_best_response for the dictionary of the parameters.
 
     Parameters
     ----------
@@ -96,43 +202,7 @@ def play_pricing_game(server_selected, b, S, k, l, a, c, fs, price_min, **params
 
     '''
 
-    # Sum of all best responses on each server
-    # np.bincount sums all values on the specific index, so all values corresponding
-    # to each server. We specify minlength so that even if the last server
-    # is not chosen, we have 0 as a value
-    B_server = np.bincount(server_selected, b, minlength=S)
-
-    # Best response of all users except the user on each server
-    B_minus_u = B_server[server_selected] - b
-    inside_sum = B_minus_u/a
-
-    # sum values on the inside_sum that correspond to the selected servers
-    numerator_sum = []
-    for i in np.arange(S):
-        numerator_sum.append(inside_sum[server_selected==i].sum())
-    numerator_sum = np.array(numerator_sum)
-
-    numerator = c*k*l*numerator_sum
-
-    denominator_sum = []
-    for i in np.arange(S):
-        denominator_sum.append(B_minus_u[server_selected==i].sum())
-    denominator_sum = np.array(denominator_sum)
-
-    denominator = (1 - fs)*denominator_sum
-
-    # If the server has not been chosen, then give a value to the denominator
-    # so that the price is set to 0/0.1 = 0
-    denominator[denominator==0] = 0.1
-
-    prices = np.sqrt(numerator/denominator)
-
-    if prices.any() < 0:
-        raise ValueError('Prices should be > 0')
-
-    prices[prices < price_min] = price_min
-
-    return prices
+    return _pricing_response(server_selected, b, S, a, c*k*l, 1 - fs, price_min)
 
 def game_converged(b, b_old, p, p_old, e1, e2, **params):
     '''
@@ -162,3 +232,242 @@ def game_converged(b, b_old, p, p_old, e1, e2, **params):
         return True
     return False
 
+
+def pricing_game_from_sums(B_server, inverse_a_server, b_over_a_server, users_on_server, k, l, c, fs, price_min, **params):
+    '''
+    play_pricing_game from per server sums over the users instead of the
+    offloading of every user. The numerator of the pricing game is the sum
+    over the users of a server of (B_server - b)/a, which is B_server times
+    the sum of 1/a minus the sum of b/a, and its denominator is (users on
+    the server - 1) times B_server.
+
+    Parameters
+    ----------
+
+    B_server: 1-D array
+        Sum of the offloading of the users of each server
+    inverse_a_server: 1-D array
+        Sum of 1/a of the users of each server
+    b_over_a_server: 1-D array
+        Sum of b/a of the users of each server
+    users_on_server: 1-D array
+        Number of users of each server
+
+    Returns
+    -------
+
+    prices: 1-D array
+        Set the new prices of the servers
+    '''
+
+    # The sums may be slightly negative because of rounding when a server
+    # has a single user
+    numerator_sum = np.maximum(B_server*inverse_a_server - b_over_a_server, 0)
+    numerator = c*k*l*numerator_sum
+
+    denominator = (1 - fs)*(users_on_server - 1)*B_server
+
+    # If the server has not been chosen, then give a value to the denominator
+    # so that the price is set to 0/0.1 = 0
+    denominator[denominator<=0] = 0.1
+
+    prices = np.sqrt(numerator/denominator)
+    prices[prices < price_min] = price_min
+
+    return prices
+
+class IncrementalGameState:
+    '''
+    Per server sums of the game kept up to date under point updates, so that
+    moving a user to another server or changing its offloading costs O(1)
+    and the pricing game is played in O(S) from the sums. It plays the same
+    game as play_offloading_game and play_pricing_game, which recompute the
+    sums over all users and remain the reference.
+
+    Within the game every user changes its offloading on every iteration,
+    since the total offloading changes, so offloading_game updates the sums
+    of the offloading it returns in the same pass. The pricing game and the
+    next best response then take that offloading as it is, only the users
+    that moved to another server are updated one by one, see assign. Every
+    iteration of the game is then still O(U), so simulate does not use it.
+
+    Parameters
+    ----------
+
+    server_selected: 1-D array
+        list containing the server to which each user is associated
+    b: 1-D array
+        offloading data of each user
+    S: int
+        Number of servers
+    a: 1-D array
+        parameter that reflects users' dynamic behavior to spen more money
+        in order to buy computing support from the MEC servers
+    dtype: data-type
+        Type of the offloading and of the sums
+    '''
+
+    def __init__(self, server_selected, b, S, a, dtype=float, **params):
+        self.S = S
+        self.dtype = np.dtype(dtype)
+        self.a = np.asarray(a, self.dtype)
+        self.inverse_a = 1/self.a
+        self.server_selected = np.array(server_selected)
+        self.b = np.array(b, dtype=self.dtype)
+        # The last offloading returned by offloading_game, which the sums hold
+        self.returned = None
+        self.refresh()
+
+    def _sum(self, servers, weights=None):
+        return np.bincount(servers, weights, minlength=self.S).astype(self.dtype, copy=False)
+
+    def refresh(self):
+        '''
+        Recompute every sum over all users, removing the rounding errors the
+        point updates accumulate
+        '''
+
+        self.users_on_server = np.bincount(self.server_selected, minlength=self.S)
+        self.B_server = self._sum(self.server_selected, self.b)
+        self.inverse_a_server = self._sum(self.server_selected, self.inverse_a)
+        self.b_over_a_server = self._sum(self.server_selected, self.b*self.inverse_a)
+        self.B = np.sum(self.b)
+        self.returned = None
+        self.updates = 0
+
+    def _updated(self, count):
+        # Refresh once there were as many point updates as users, which keeps
+        # the amortized cost of an update O(1)
+        self.updates += count
+        if self.updates > len(self.b):
+            self.refresh()
+
+    def move(self, user, server):
+        '''
+        Move a user to another server in O(1)
+        '''
+
+        old = self.server_selected[user]
+        b = self.b[user]
+        inverse_a = self.inverse_a[user]
+
+        self.users_on_server[old] -= 1
+        self.users_on_server[server] += 1
+        self.B_server[old] -= b
+        self.B_server[server] += b
+        self.inverse_a_server[old] -= inverse_a
+        self.inverse_a_server[server] += inverse_a
+        self.b_over_a_server[old] -= b*inverse_a
+        self.b_over_a_server[server] += b*inverse_a
+
+        self.server_selected[user] = server
+        self._updated(1)
+
+    def set(self, user, b):
+        '''
+        Change the offloading of a user in O(1)
+        '''
+
+        server = self.server_selected[user]
+        delta = b - self.b[user]
+
+        self.B_server[server] += delta
+        self.b_over_a_server[server] += delta*self.inverse_a[user]
+        self.B += delta
+
+        self.b[user] = b
+        self.returned = None
+        self._updated(1)
+
+    def assign(self, server_selected):
+        '''
+        Move the users whose server changed, at a cost proportional to their
+        number. If more than an eighth of the users moved the sums are
+        recomputed instead
+        '''
+
+        moved = np.flatnonzero(server_selected != self.server_selected)
+
+        if len(moved) > len(self.b) // 8:
+            self.server_selected[:] = server_selected
+            self.refresh()
+            return
+
+        old = self.server_selected[moved]
+        new = server_selected[moved]
+        for sign, servers in ((-1, old), (1, new)):
+            self.users_on_server += sign*np.bincount(servers, minlength=self.S)
+            self.B_server += sign*self._sum(servers, self.b[moved])
+            self.inverse_a_server += sign*self._sum(servers, self.inverse_a[moved])
+            self.b_over_a_server += sign*self._sum(servers, self.b[moved]*self.inverse_a[moved])
+
+        self.server_selected[moved] = new
+        self._updated(len(moved))
+
+    def update(self, b):
+        '''
+        Change the offloading of the users whose offloading changed, at a cost
+        proportional to their number. If more than an eighth of the users
+        changed the sums are recomputed instead
+        '''
+
+        # The sums already hold the offloading offloading_game returned
+        if b is self.returned:
+            return
+
+        changed = np.flatnonzero(b != self.b)
+
+        # Recomputing the sums is cheaper when many users changed
+        if len(changed) > len(self.b) // 8:
+            self.b[:] = b
+            self.refresh()
+            return
+
+        delta = b[changed] - self.b[changed]
+        servers = self.server_selected[changed]
+
+        self.B_server += self._sum(servers, delta)
+        self.b_over_a_server += self._sum(servers, delta*self.inverse_a[changed])
+        self.B += np.sum(delta)
+
+        self.b[changed] = b[changed]
+        self._updated(len(changed))
+
+    def offloading_game(self, server_selected, b_old, prices, k, l, b_max, b_min, **params):
+        '''
+        play_offloading_game with the total offloading kept by the state. The
+        sums of the offloading returned are computed in the same pass, and it
+        must not be modified before it is given back to the state
+        '''
+
+        self.update(b_old)
+
+        # Best response of all users except the user
+        B_minus_u = self.B - b_old
+
+        paid = prices[server_selected]
+        b = (B_minus_u/l) * ((k*l/(self.a*paid)) - 1)
+        b = np.clip(b, b_min, b_max)
+
+        # Every user changed, so the sums of b are recomputed instead of
+        # comparing b with the previous offloading
+        self.b[:] = b
+        self.B_server = self._sum(self.server_selected, b)
+        self.b_over_a_server = self._sum(self.server_selected, b*self.inverse_a)
+        self.B = np.sum(b)
+        self.returned = b
+
+        return b
+
+    def pricing_game(self, server_selected, b, S, k, l, c, fs, price_min, **params):
+        '''
+        play_pricing_game in O(S) from the sums kept by the state, see
+        pricing_game_from_sums
+        '''
+
+        self.update(b)
+
+        prices = pricing_game_from_sums(self.B_server, self.inverse_a_server,
+                self.b_over_a_server, self.users_on_server, k=k, l=l, c=c, fs=fs, price_min=price_min)
+
+        return prices.astype(self.dtype, copy=False)
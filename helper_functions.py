@@ -3,6 +3,14 @@ Helper functions that are used in the simulation
 '''
 
 import numpy as np
+import dill
+import os
+import hashlib
+import json
+
+from parameters import set_parameters, LOAD_SAVED_PARAMETERS, CONSTANT_PRICING, RESULTS_FORMAT
+from result_store import save_columns
+from profiling_functions import save_profile
 
 def initialize(S, U, **params):
     '''
@@ -29,3 +37,191 @@ def initialize(S, U, **params):
     probabilities = np.ones((U,S))/S
     prices = np.ones(S)*0.5
     return probabilities, prices
+
+def case_name(case, params):
+    '''
+    Name used for the files of the parameters and results of a case
+
+    Parameters
+    ----------
+
+    case: dictionary
+        Dictionary containing infromation about whether the user and the servers
+        are homogeneous or heterogeneous
+    params: dictionary
+        Dictonary of the parameters
+
+    Returns
+    -------
+
+    name: string
+        The name of the case including its learning rate
+    '''
+
+    name = case["users"] + "_" + case["servers"] + "_lr_" + "{0:.2f}".format(params["learning_rate"])
+    if CONSTANT_PRICING == True:
+        name += "_constant-pricing"
+    return name
+
+def parameters_fingerprint(params, seed=None):
+    '''
+    Hash of the full parameter dictionary, including the values of every
+    array, and of the seed of the simulation
+
+    Parameters
+    ----------
+
+    params: dictionary
+        Dictonary of the parameters
+    seed: int
+        Seed of the simulation
+
+    Returns
+    -------
+
+    fingerprint: string
+        Hexadecimal SHA-256 digest
+    '''
+
+    digest = hashlib.sha256()
+    for key in sorted(params):
+        value = params[key]
+        digest.update(key.encode())
+        if isinstance(value, np.ndarray):
+            digest.update(value.dtype.str.encode() + str(value.shape).encode())
+            digest.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, dict):
+            digest.update(json.dumps(value, sort_keys=True).encode())
+        else:
+            digest.update(repr(value).encode())
+    digest.update(("seed=" + repr(seed)).encode())
+
+    return digest.hexdigest()
+
+def load_parameters(case):
+    '''
+    Load the saved parameters of a case or generate new ones, depending on
+    LOAD_SAVED_PARAMETERS
+
+    Parameters
+    ----------
+
+    case: dictionary
+        Dictionary containing infromation about whether the user and the servers
+        are homogeneous or heterogeneous
+
+    Returns
+    -------
+
+    params: dictionary
+        Dictonary of the parameters
+    '''
+
+    if LOAD_SAVED_PARAMETERS == True:
+        print("Loading parameters")
+        infile = "saved_runs/parameters/" + case["users"] + "_" + case["servers"] + "_lr_" + "0.20"
+
+        with open(infile, 'rb') as in_strm:
+            params = dill.load(in_strm)
+    else:
+        # Set random parameter in order to generate the same parameters
+        print("Generating new parameters")
+        np.random.seed(13)
+        params = set_parameters(case)
+
+    return params
+
+def save_parameters(case, params):
+    '''
+    Save the parameters of a case under saved_runs/parameters
+    '''
+
+    outfile = "saved_runs/parameters/" + case_name(case, params)
+
+    with open(outfile, 'wb') as fp:
+        dill.dump(params, fp)
+
+def save_result(result, case, params, repetition):
+    '''
+    Save the result of one repetition under saved_runs/results/individual with
+    the naming generate_aggregated_results expects, as a dill file or as a
+    directory of columns depending on RESULTS_FORMAT. A profiling report is
+    also saved next to it as JSON
+
+    Parameters
+    ----------
+
+    result: dictionary
+        Dictionary containing the results of the repetition
+    case: dictionary
+        The case the repetition belongs to
+    params: dictionary
+        Dictonary of the parameters
+    repetition: int
+        Index of the repetition, starting from 0
+    '''
+
+    outfile = 'saved_runs/results/individual/' + case_name(case, params) + "_rep_" + str(repetition+1)
+
+    if RESULTS_FORMAT == "columnar":
+        save_columns(result, outfile, case, params["learning_rate"], repetition)
+    else:
+        with open(outfile , 'wb') as fp:
+            dill.dump(result, fp)
+
+    if "profile" in result:
+        save_profile(result["profile"], outfile + "_profile.json")
+
+def save_checkpoint(path, state):
+    '''
+    Save a checkpoint atomically, so that a crash while saving leaves the
+    previous checkpoint intact
+
+    Parameters
+    ----------
+
+    path: string
+        File of the checkpoint
+    state: dictionary
+        The state to save
+    '''
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    tmpfile = path + ".tmp"
+    with open(tmpfile, 'wb') as fp:
+        dill.dump(state, fp)
+    os.replace(tmpfile, path)
+
+def load_checkpoint(path):
+    '''
+    Load a checkpoint if it exists
+
+    Parameters
+    ----------
+
+    path: string
+        File of the checkpoint
+
+    Returns
+    -------
+
+    state: dictionary
+        The saved state, None if there is no checkpoint
+    '''
+
+    if path is None or not os.path.isfile(path):
+        return None
+
+    with open(path, 'rb') as in_strm:
+        return dill.load(in_strm)
+
+def remove_checkpoint(path):
+    '''
+    Remove a checkpoint that is no longer needed
+    '''
+
+    if path is not None and os.path.isfile(path):
+        os.remove(path)
@@ -0,0 +1,235 @@
+'''
+Recorder that keeps the history of the simulation in preallocated buffers
+'''
+
+import numpy as np
+
+# Histories with one value per server on every timeslot
+SERVER_HISTORIES = ["all_bytes_to_server", "all_prices", "all_relative_price",
+        "all_server_welfare", "all_Rs", "all_congestion", "all_penetration"]
+
+# Histories with one value per user on every timeslot, the ones that grow
+# with the number of users
+USER_HISTORIES = ["all_server_selected", "all_bytes_offloaded", "all_user_utility", "all_probabilities"]
+
+# Averages over the users of the per user histories
+SUMMARY_HISTORIES = ["all_average_bytes_offloaded", "all_average_user_utility"]
+
+# Histories kept by each recording profile. all_fs and all_c never change
+# during a repetition and are not recorded by any of them
+RECORDING_PROFILES = {
+        "full": SERVER_HISTORIES + USER_HISTORIES + ["all_users_on_server", "all_game_iterations"],
+        "summary": SERVER_HISTORIES + SUMMARY_HISTORIES + ["all_users_on_server", "all_game_iterations"],
+        "server-only": SERVER_HISTORIES + ["all_users_on_server", "all_game_iterations"],
+        "final-state": [],
+        }
+
+def recorded_histories(recording):
+    '''
+    Names of the histories a recording profile keeps
+
+    Parameters
+    ----------
+
+    recording: string
+        One of "full", "summary", "server-only" and "final-state"
+
+    Returns
+    -------
+
+    names: list
+        The names of the histories
+    '''
+
+    if recording not in RECORDING_PROFILES:
+        raise ValueError('Unknown recording profile ' + str(recording))
+
+    return RECORDING_PROFILES[recording]
+
+class HistoryRecorder:
+    '''
+    Keeps the history of every recorded quantity in a buffer whose capacity
+    doubles whenever it fills up, so recording T timeslots costs O(T) instead
+    of the O(T^2) of appending to an array on every timeslot. A quantity can
+    be sampled, keeping only every few of the values recorded.
+
+    Parameters
+    ----------
+
+    capacity: int
+        Number of timeslots the buffers can hold before they first grow
+    '''
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.buffers = {}
+        self.lengths = {}
+        self.axes = {}
+        self.every = {}
+        self.calls = {}
+
+    @classmethod
+    def from_profile(cls, recording, U, S, every=1, dtype=float, probabilities_dtype=float,
+            probabilities_shape=None):
+        '''
+        A recorder with the histories of a recording profile declared
+
+        Parameters
+        ----------
+
+        recording: string
+            The recording profile, see RECORDING_PROFILES
+        U: int
+            Number of users
+        S: int
+            Number of servers
+        every: int
+            Timeslots between the values kept of the per user histories
+        dtype: data-type
+            Type of the histories of real values
+        probabilities_dtype: data-type
+            Type of the history of the probabilities
+        probabilities_shape: tuple
+            Shape of the probabilities on each timeslot, (U, S) by default
+
+        Returns
+        -------
+
+        history: HistoryRecorder
+            The recorder
+        '''
+
+        history = cls()
+        for name in recorded_histories(recording):
+            if name == "all_server_selected":
+                history.add(name, (U,), int, every=every)
+            elif name == "all_probabilities":
+                shape = (U,S) if probabilities_shape is None else probabilities_shape
+                history.add(name, shape, probabilities_dtype, axis=1, every=every)
+            elif name in USER_HISTORIES:
+                history.add(name, (U,), dtype, every=every)
+            elif name == "all_users_on_server":
+                history.add(name, (S,), int)
+            elif name == "all_game_iterations":
+                history.add(name, (), int)
+            elif name in SUMMARY_HISTORIES:
+                history.add(name, (), dtype)
+            else:
+                history.add(name, (S,), dtype)
+
+        return history
+
+    def add(self, name, shape=(), dtype=float, axis=0, every=1):
+        '''
+        Declare a new quantity to be recorded
+
+        Parameters
+        ----------
+
+        name: string
+            Name of the quantity
+        shape: tuple
+            Shape of the value recorded on each timeslot
+        dtype: data-type
+            Type of the recorded values
+        axis: int
+            Position of the timeslot axis in the returned history
+        every: int
+            Keep the first value recorded and then one every that many
+        '''
+
+        shape = tuple(shape)
+        buffer_shape = shape[:axis] + (self.capacity,) + shape[axis:]
+
+        self.buffers[name] = np.empty(buffer_shape, dtype)
+        self.lengths[name] = 0
+        self.axes[name] = axis
+        self.every[name] = every
+        self.calls[name] = 0
+
+    def record(self, name, value):
+        '''
+        Record the value of a quantity on the next timeslot
+
+        Parameters
+        ----------
+
+        name: string
+            Name of the quantity
+        value: array
+            The value of the quantity on this timeslot
+        '''
+
+        calls = self.calls[name]
+        self.calls[name] = calls + 1
+        if calls % self.every[name] != 0:
+            return
+
+        buffer = self.buffers[name]
+        axis = self.axes[name]
+        length = self.lengths[name]
+
+        if length == buffer.shape[axis]:
+            # Double the capacity of the buffer, copying the history once
+            shape = list(buffer.shape)
+            shape[axis] *= 2
+            grown = np.empty(shape, buffer.dtype)
+            grown[self._index(axis, slice(0, length))] = buffer
+            self.buffers[name] = buffer = grown
+
+        buffer[self._index(axis, length)] = value
+        self.lengths[name] = length + 1
+
+    def record_all(self, values):
+        '''
+        Record the value of every declared quantity found in values, the rest
+        of the values are ignored
+
+        Parameters
+        ----------
+
+        values: dictionary
+            Dictionary from the name of each quantity to its value on this
+            timeslot
+        '''
+
+        for name, value in values.items():
+            if name in self.buffers:
+                self.record(name, value)
+
+    def get(self, name):
+        '''
+        The history of a quantity up to now, as a view on the buffer
+
+        Parameters
+        ----------
+
+        name: string
+            Name of the quantity
+
+        Returns
+        -------
+
+        history: array
+            The recorded values of the quantity
+        '''
+
+        axis = self.axes[name]
+        return self.buffers[name][self._index(axis, slice(0, self.lengths[name]))]
+
+    def to_dict(self):
+        '''
+        The trimmed, contiguous history of every recorded quantity
+
+        Returns
+        -------
+
+        histories: dictionary
+            Dictionary from the name of each quantity to its history
+        '''
+
+        return {name: np.ascontiguousarray(self.get(name)) for name in self.buffers}
+
+    @staticmethod
+    def _index(axis, index):
+        return (slice(None),)*axis + (index,)
@@ -0,0 +1,224 @@
+'''
+Fused timeslot kernel that does the per user work of the simulation in work
+buffers allocated once per run
+'''
+
+import numpy as np
+
+from equilibrium_solvers import _warn_not_converged
+
+class TimeslotKernel:
+    '''
+    Server selection, plain iteration of the offloading and pricing game,
+    utility of the users and update of the probabilities with every per user
+    temporary kept in a buffer sized once for the run. The probability matrix
+    is updated in place. Every operation is the one of server_selection,
+    offloading_best_response, pricing_best_response,
+    best_responses_converged, calculate_user_utility and learning_update in
+    the same order, so the results are the same bit for bit. Only the uniform draws of the
+    selection and the per server arrays are still allocated on every call.
+
+    The selected servers, offloading and utility returned are views on the
+    buffers and are overwritten by the next call, copy them to keep them.
+
+    Parameters
+    ----------
+
+    probabilities: 2-D array
+        The initial probabilities that each user will select the specific
+        server, copied into the buffer the kernel updates
+    game: GameParameters
+        The parameters of the simulation
+    '''
+
+    def __init__(self, probabilities, game):
+        U = self.U = game.U
+        S = self.S = game.S
+        self.game = game
+
+        # The buffers have the precision of the probabilities
+        self.probabilities = np.array(probabilities)
+        dtype = self.probabilities.dtype
+
+        # Work buffers of the selection and the update of the probabilities
+        self.work = np.empty((U,S), dtype)
+        self.mask = np.empty((U,S), bool)
+        self.server_selected = np.empty(U, int)
+        self.flat_index = np.empty(U, int)
+        self.rows = np.arange(U) * S
+
+        # Offloading of the last two iterations of the game, and per user
+        # temporaries
+        self.b = [np.empty(U, dtype), np.empty(U, dtype)]
+        self.first = np.empty(U, dtype)
+        self.second = np.empty(U, dtype)
+        self.user_mask = np.empty(U, bool)
+        self.utility = np.empty(U, dtype)
+
+    def server_selection(self, probabilities):
+        '''
+        server_selection into the buffer of the selected servers
+        '''
+
+        cumulative = np.cumsum(probabilities, axis=-1, out=self.work)
+        np.divide(cumulative, cumulative[:, -1:], out=cumulative)
+
+        draws = np.random.random(self.U)
+
+        np.less_equal(cumulative, draws[:, np.newaxis], out=self.mask)
+        return np.sum(self.mask, axis=-1, out=self.server_selected)
+
+    def all_users_sure(self, probabilities):
+        '''
+        all_users_sure without allocating the maximum of every user
+        '''
+
+        np.max(probabilities, axis=1, out=self.first)
+        return bool(np.greater(self.first, 0.9, out=self.user_mask).all())
+
+    def offloading_best_response(self, server_selected, b_old, prices, out):
+        '''
+        offloading_best_response into out
+        '''
+
+        game = self.game
+
+        B = np.sum(b_old)
+
+        B_minus_u = np.subtract(B, b_old, out=self.first)
+        paid = np.take(prices, server_selected, out=self.second)
+
+        np.divide(B_minus_u, game.l, out=B_minus_u)
+        np.multiply(game.a, paid, out=paid)
+        np.divide(game.kl, paid, out=paid)
+        np.subtract(paid, 1, out=paid)
+        b = np.multiply(B_minus_u, paid, out=out)
+
+        # The same as setting the values outside [b_min, b_max] to the limits
+        np.minimum(b, game.b_max, out=b)
+        np.maximum(b, game.b_min, out=b)
+
+        return b
+
+    def pricing_best_response(self, server_selected, b):
+        '''
+        pricing_best_response with the per user temporaries in the buffers
+        '''
+
+        game = self.game
+        S = self.S
+
+        B_server = np.bincount(server_selected, b, minlength=S).astype(b.dtype, copy=False)
+
+        B_minus_u = np.take(B_server, server_selected, out=self.first)
+        np.subtract(B_minus_u, b, out=B_minus_u)
+        inside_sum = np.divide(B_minus_u, game.a, out=self.second)
+
+        numerator_sum = np.bincount(server_selected, inside_sum, minlength=S)
+        numerator = game.ckl*numerator_sum
+
+        denominator_sum = np.bincount(server_selected, B_minus_u, minlength=S)
+        denominator = game.one_minus_fs*denominator_sum
+        denominator[denominator==0] = 0.1
+
+        prices = np.sqrt(numerator/denominator)
+        prices[prices < game.price_min] = game.price_min
+
+        return prices.astype(b.dtype, copy=False)
+
+    def best_responses_converged(self, b, b_old, p, p_old):
+        '''
+        best_responses_converged with the differences of the users in a buffer
+        '''
+
+        difference = np.subtract(b, b_old, out=self.first)
+        np.abs(difference, out=difference)
+        return bool(np.less(difference, self.game.e1, out=self.user_mask).all()
+                and (np.abs(p - p_old) < self.game.e2).all())
+
+    def solve_game(self, server_selected, b_old, prices_old, max_iterations):
+        '''
+        solve_game with the plain method, the iterations alternating between
+        the two offloading buffers
+
+        Returns
+        -------
+
+        b: 1-D array
+            offloading data of each user at the equilibrium, a view on one of
+            the buffers
+        prices: 1-D array
+            prices of the servers at the equilibrium
+        iterations: int
+            number of best responses played until convergence
+        '''
+
+        np.copyto(self.b[0], b_old)
+        b_old = self.b[0]
+
+        for iterations in range(1, max_iterations+1):
+            b = self.b[1] if b_old is self.b[0] else self.b[0]
+            self.offloading_best_response(server_selected, b_old, prices_old, b)
+            prices = self.pricing_best_response(server_selected, b)
+
+            if self.best_responses_converged(b, b_old, prices, prices_old):
+                return b, prices, iterations
+
+            b_old = b
+            prices_old = prices
+
+        _warn_not_converged(max_iterations)
+        return b, prices, max_iterations
+
+    def calculate_user_utility(self, b, server_selected, prices):
+        '''
+        calculate_user_utility into the buffer of the utility
+        '''
+
+        k = self.game.k
+        l = self.game.l
+        a = self.game.a
+
+        B = np.sum(b)
+        B_minus_u = np.subtract(B, b, out=self.first)
+        paid = np.take(prices, server_selected, out=self.second)
+
+        ru = np.divide(b, B_minus_u, out=B_minus_u)
+        utility = np.multiply(l, ru, out=self.utility)
+        np.add(1, utility, out=utility)
+        np.log(utility, out=utility)
+        np.multiply(k, utility, out=utility)
+
+        np.multiply(a, paid, out=paid)
+        np.multiply(paid, ru, out=paid)
+
+        return np.subtract(utility, paid, out=utility)
+
+    def learning_update(self, Rs, probabilities, server_selected):
+        '''
+        learning_update in place. For the servers the users did not select
+        the change is -p*learning_rate*reward and for the selected one
+        (1-p)*learning_rate*reward, which are computed with the negations
+        learning_update applies moved to exact sign changes.
+        '''
+
+        learning_rate = self.game.learning_rate
+
+        tmp1 = Rs
+        tmp2 = np.sum(Rs)
+        reward = np.divide(tmp1, tmp2, out=np.zeros_like(tmp1), where=tmp2!=0)
+        reward = reward.astype(probabilities.dtype, copy=False)
+
+        change = np.multiply(probabilities, learning_rate, out=self.work)
+
+        flat_index = np.add(self.rows, server_selected, out=self.flat_index)
+        selected = np.take(probabilities, flat_index, out=self.first)
+        np.subtract(1, selected, out=selected)
+        np.multiply(selected, learning_rate, out=selected)
+        np.negative(selected, out=selected)
+        np.put(change, flat_index, selected)
+
+        selected_reward = np.take(reward, server_selected, out=self.second)
+        np.multiply(change, selected_reward[:, np.newaxis], out=change)
+
+        return np.subtract(probabilities, change, out=probabilities)
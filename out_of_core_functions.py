@@ -0,0 +1,217 @@
+'''
+Out-of-core simulation for populations of users that do not fit in memory.
+The state and the histories of the users live in memory mapped files and are
+processed in blocks of users, while the per server sums are accumulated
+across the blocks, so the memory used does not depend on the number of users.
+'''
+
+import numpy as np
+import shutil
+import time
+import os
+
+from parameters import CONSTANT_PRICING, CONSTANT_OFFLOADING, MAX_GAME_ITERATIONS, USER_BLOCK_SIZE
+from helper_functions import initialize
+from game_functions import pricing_game_from_sums
+from equilibrium_solvers import _warn_not_converged
+from server_selection_functions import server_selection, update_probabilities, all_users_sure, CompetitivenessTracker
+from metrics import calculate_server_welfare
+from history_recorder import HistoryRecorder
+from result_store import AppendableColumn, write_manifest, load_result
+
+def simulate_out_of_core(params, path, block_size=USER_BLOCK_SIZE, case=None, repetition=0):
+    '''
+    Run one repetition of the simulation with the users processed in blocks.
+    The probabilities, offloading and selected servers of the users are
+    memory mapped files and the per user histories are appended to the
+    columns of the result one block at a time. Every iteration of the game
+    is one pass over the blocks: the offloading of each block is the best
+    response to the total offloading of the previous iteration, and the per
+    server sums the prices need are accumulated along, see
+    pricing_game_from_sums. The game is solved by plain iteration.
+
+    Parameters
+    ----------
+
+    params: dictionary
+        Dictonary of the parameters as returned by set_parameters. a may be
+        a memory mapped array
+    path: string
+        Directory of the result, saved as columns. The per user histories are
+        saved with the timeslots on the first axis, all_probabilities too
+    block_size: int
+        Number of users processed together
+    case: dictionary
+        The case the repetition belongs to, for the manifest
+    repetition: int
+        Index of the repetition, for the manifest
+
+    Returns
+    -------
+
+    result: dictionary
+        The result loaded from path, with the columns memory mapped
+    '''
+
+    if CONSTANT_PRICING or CONSTANT_OFFLOADING:
+        raise ValueError('The out-of-core simulation does not support constant pricing or offloading')
+
+    U = params['U']
+    S = params['S']
+    fs = params['fs']
+    c = params['c']
+    k = params['k']
+    l = params['l']
+    b_min = params['b_min']
+    b_max = params['b_max']
+    e1 = params['e1']
+    e2 = params['e2']
+
+    start = time.time()
+
+    # Scratch files with the state of the users, removed at the end
+    state = os.path.join(path, "state")
+    os.makedirs(state, exist_ok=True)
+
+    def state_array(name, shape, dtype=float):
+        return np.lib.format.open_memmap(os.path.join(state, name + ".npy"), mode='w+', dtype=dtype, shape=shape)
+
+    a = state_array("a", (U,))
+    probabilities = state_array("probabilities", (U,S))
+    b = state_array("b", (U,))
+    b_new = state_array("b_new", (U,))
+    server_selected = state_array("server_selected", (U,), int)
+
+    blocks = [slice(first, min(first + block_size, U)) for first in range(0, U, block_size)]
+
+    columns = {
+            "all_server_selected": AppendableColumn(os.path.join(path, "all_server_selected.npy"), (U,), int),
+            "all_bytes_offloaded": AppendableColumn(os.path.join(path, "all_bytes_offloaded.npy"), (U,)),
+            "all_user_utility": AppendableColumn(os.path.join(path, "all_user_utility.npy"), (U,)),
+            "all_probabilities": AppendableColumn(os.path.join(path, "all_probabilities.npy"), (U,S)),
+            }
+
+    history = HistoryRecorder()
+    for name in ["all_bytes_to_server", "all_prices",
+            "all_relative_price", "all_server_welfare", "all_Rs",
+            "all_congestion", "all_penetration"]:
+        history.add(name, (S,))
+    history.add("all_game_iterations", (), int)
+
+    competitiveness = CompetitivenessTracker(**params)
+
+    sure = True
+    for block in blocks:
+        a[block] = params['a'][block]
+        probabilities[block] = initialize(**dict(params, U=block.stop - block.start))[0]
+        columns["all_probabilities"].write(probabilities[block])
+        sure = sure and all_users_sure(probabilities[block])
+    columns["all_probabilities"].end_timeslot()
+
+    while not sure:
+        # Each user selects a server, drawing the blocks in order uses the
+        # random numbers in the same order as selecting all users at once
+        users_on_server = np.zeros(S)
+        inverse_a_server = np.zeros(S)
+        for block in blocks:
+            selected = server_selection(probabilities[block], U=block.stop - block.start, S=S)
+            server_selected[block] = selected
+            users_on_server += np.bincount(selected, minlength=S)
+            inverse_a_server += np.bincount(selected, 1/a[block], minlength=S)
+
+        # Play the game starting from the same offloading and prices as simulate
+        b[:] = 1
+        B = float(U)
+        prices_old = np.ones(S)
+
+        for iterations in range(1, MAX_GAME_ITERATIONS+1):
+            B_server = np.zeros(S)
+            b_over_a_server = np.zeros(S)
+            B_new = 0.0
+            change = 0.0
+
+            for block in blocks:
+                selected = server_selected[block]
+                b_block = b[block]
+                a_block = a[block]
+
+                # Best response of every user to the total of the previous
+                # iteration, as play_offloading_game
+                response = ((B - b_block)/l) * ((k*l/(a_block*prices_old[selected])) - 1)
+                response = np.clip(response, b_min, b_max)
+                b_new[block] = response
+
+                change = max(change, np.max(np.abs(response - b_block)))
+                B_server += np.bincount(selected, response, minlength=S)
+                b_over_a_server += np.bincount(selected, response/a_block, minlength=S)
+                B_new += np.sum(response)
+
+            prices = pricing_game_from_sums(B_server, inverse_a_server, b_over_a_server,
+                    users_on_server, **params)
+
+            b, b_new = b_new, b
+            converged = change < e1 and np.all(np.abs(prices - prices_old) < e2)
+
+            B = B_new
+            prices_old = prices
+
+            if converged:
+                break
+        else:
+            _warn_not_converged(MAX_GAME_ITERATIONS)
+
+        bytes_to_server = B_server
+        server_welfare = calculate_server_welfare(prices, bytes_to_server, **params)
+
+        Rs,relative_price,congestion,penetration = competitiveness.update(bytes_to_server, fs, prices)
+
+        # Record the users and update their probabilities
+        sure = True
+        for block in blocks:
+            selected = server_selected[block]
+            b_block = b[block]
+
+            ru = b_block / (B - b_block)
+            utility = k*np.log(1+l*ru) - a[block]*prices[selected]*ru
+
+            updated = update_probabilities(Rs, probabilities[block], selected, b_block, **params)
+            probabilities[block] = updated
+            sure = sure and all_users_sure(updated)
+
+            columns["all_server_selected"].write(selected)
+            columns["all_bytes_offloaded"].write(b_block)
+            columns["all_user_utility"].write(utility)
+            columns["all_probabilities"].write(updated)
+
+        for column in columns.values():
+            column.end_timeslot()
+
+        history.record("all_bytes_to_server", bytes_to_server)
+        history.record("all_prices", prices)
+        history.record("all_server_welfare", server_welfare)
+        history.record("all_Rs", Rs)
+        history.record("all_congestion", congestion)
+        history.record("all_penetration", penetration)
+        history.record("all_relative_price", relative_price)
+        history.record("all_game_iterations", iterations)
+
+    del a, probabilities, b, b_new, server_selected
+    shutil.rmtree(state)
+
+    manifest_columns = {name: column.close() for name, column in columns.items()}
+
+    # The discount and cost of the servers never change, they are written
+    # once at the end with a row per timeslot like the other columns
+    histories = history.to_dict()
+    T = len(histories["all_prices"])
+    histories["all_fs"] = np.broadcast_to(fs, (T, S))
+    histories["all_c"] = np.broadcast_to(c, (T, S))
+
+    for name, value in histories.items():
+        np.save(os.path.join(path, name + ".npy"), value)
+        manifest_columns[name] = {"shape": list(value.shape), "dtype": value.dtype.str, "time_axis": 0}
+
+    write_manifest(path, case, params["learning_rate"], repetition, manifest_columns,
+            {"running_time": time.time() - start})
+
+    return load_result(path)
@@ -0,0 +1,240 @@
+'''
+Functions to spread the repetitions of the simulation across processes
+'''
+
+import numpy as np
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from parameters import SAVE_PARAMETERS, SAVE_RESULTS, CHECKPOINT_EVERY, COHORTS, COHORT_RESOLUTION, COHORT_CLASSES, MEAN_FIELD, OUT_OF_CORE, USER_BLOCK_SIZE
+from helper_functions import *
+from simulation_functions import *
+import simulation_functions
+from cohort_functions import simulate_cohorts, simulate_mean_field
+from out_of_core_functions import simulate_out_of_core
+
+def repetition_seed(root_seed, case, repetition):
+    '''
+    Derive the seed of one repetition from the root seed. The seed only
+    depends on the case and the repetition, so results do not depend on the
+    number of workers or on the order in which repetitions are run.
+
+    Parameters
+    ----------
+
+    root_seed: int
+        Seed of the whole campaign
+    case: dictionary
+        The case the repetition belongs to
+    repetition: int
+        Index of the repetition, starting from 0
+
+    Returns
+    -------
+
+    seed: int
+        Seed for the random state of the repetition
+    '''
+
+    key = zlib.crc32((case["users"] + "_" + case["servers"]).encode())
+    sequence = np.random.SeedSequence(root_seed, spawn_key=(key, repetition))
+
+    return int(sequence.generate_state(1)[0])
+
+def engine_settings():
+    '''
+    The settings of the engines run_block runs the repetitions with that
+    change their results, which are not part of the parameters
+
+    Returns
+    -------
+
+    settings: dictionary
+        The value of every setting under its name
+    '''
+
+    return {
+            "PRECISION": simulation_functions.PRECISION,
+            "EQUILIBRIUM_SOLVER": simulation_functions.EQUILIBRIUM_SOLVER,
+            "WARM_START": simulation_functions.WARM_START,
+            "CONSTANT_PRICING": simulation_functions.CONSTANT_PRICING,
+            "CONSTANT_OFFLOADING": simulation_functions.CONSTANT_OFFLOADING,
+            "RECORDING": simulation_functions.RECORDING,
+            "RECORDING_EVERY": simulation_functions.RECORDING_EVERY,
+            "CANDIDATES": simulation_functions.CANDIDATES,
+            "COHORTS": COHORTS,
+            "COHORT_RESOLUTION": COHORT_RESOLUTION,
+            "COHORT_CLASSES": COHORT_CLASSES,
+            "MEAN_FIELD": MEAN_FIELD,
+            }
+
+def run_block(params, first_repetition, repetitions, seed):
+    '''
+    Run a block of consecutive repetitions of a case with its own random
+    stream. Executed inside the worker processes.
+
+    Parameters
+    ----------
+
+    params: dictionary
+        Dictonary of the parameters
+    first_repetition: int
+        Index of the first repetition of the block
+    repetitions: int
+        Number of repetitions of the block, more than one uses the batched
+        engine. Single repetitions are checkpointed every CHECKPOINT_EVERY
+        timeslots under saved_runs/checkpoints. With COHORTS set every
+        repetition runs with the cohort engine, with a resolution of
+        1/sqrt(U) if COHORT_RESOLUTION is not set, with MEAN_FIELD set the
+        mean-field approximation is run once for the block and with
+        OUT_OF_CORE set every repetition is written as columns under
+        saved_runs/results/individual while it runs
+    seed: int
+        Seed for the random state of the block
+
+    Returns
+    -------
+
+    first_repetition: int
+        Index of the first repetition of the block
+    results: list of dictionaries
+        The result of each repetition of the block
+    '''
+
+    np.random.seed(seed)
+
+    if OUT_OF_CORE:
+        # The result is written in place, where save_result would save it
+        results = []
+        for repetition in range(first_repetition, first_repetition + repetitions):
+            path = 'saved_runs/results/individual/' + case_name(params["case"], params) + "_rep_" + str(repetition+1)
+            results.append(simulate_out_of_core(params, path, USER_BLOCK_SIZE, params["case"], repetition))
+    elif MEAN_FIELD:
+        # Deterministic, every repetition would be the same
+        results = [simulate_mean_field(params)] * repetitions
+    elif COHORTS:
+        # Without merging, the classes split until they are about as many as
+        # the users and the engine is slower than simulate
+        resolution = COHORT_RESOLUTION
+        if resolution is None:
+            resolution = 1/np.sqrt(params["U"])
+        results = [simulate_cohorts(params, resolution, COHORT_CLASSES)
+                for _ in range(repetitions)]
+    elif repetitions == 1:
+        # A checkpoint of the repetition, if any, also restores the random
+        # state. Its name holds the fingerprint of the parameters and the
+        # seed, so a checkpoint of another configuration is never resumed
+        checkpoint_path = None
+        if CHECKPOINT_EVERY and "case" in params:
+            checkpoint_path = ("saved_runs/checkpoints/" + case_name(params["case"], params) + "_" +
+                    parameters_fingerprint(params, seed)[:16] + "_rep_" + str(first_repetition+1))
+
+        results = [simulate(params, checkpoint_path)]
+    else:
+        results = simulate_batch(params, repetitions)
+
+    return first_repetition, results
+
+def run_repetitions(cases, repetitions, root_seed=0, workers=None, batch_size=1, save=True, completed=None,
+        parameters=None):
+    '''
+    Run the repetitions of every case on a pool of processes and yield the
+    results as soon as they complete
+
+    Parameters
+    ----------
+
+    cases: list of dictionaries
+        The elements of the list are the cases
+    repetitions: int
+        Number of repetitions of each case
+    root_seed: int
+        Seed from which the seed of every repetition is derived
+    workers: int
+        Number of processes, by default the number of cores. With 1 the
+        repetitions run in this process
+    batch_size: int
+        Number of repetitions each task runs with the batched engine
+    save: Boolean
+        Whether to save parameters and results in saved_runs
+    completed: dictionary
+        Repetitions that are already completed and are not run, as a set of
+        indices for the parameters_fingerprint(params, root_seed) of each case
+    parameters: list of dictionaries
+        The parameters of every case, loaded with load_parameters by default
+
+    Returns
+    -------
+
+    Generator of (case, repetition, result) tuples in order of completion
+    '''
+
+    if parameters is None:
+        parameters = [load_parameters(case) for case in cases]
+
+    tasks = []
+    for case, params in zip(cases, parameters):
+        if save and SAVE_PARAMETERS == True:
+            save_parameters(case, params)
+
+        done = set()
+        if completed is not None:
+            done = completed.get(parameters_fingerprint(params, root_seed), set())
+
+        for first_repetition in range(0, repetitions, batch_size):
+            block = min(batch_size, repetitions - first_repetition)
+            if all(repetition in done for repetition in range(first_repetition, first_repetition + block)):
+                continue
+            seed = repetition_seed(root_seed, case, first_repetition)
+            tasks.append((case, params, first_repetition, block, seed, done))
+
+    blocks = [(params, first_repetition, block, seed) for case, params, first_repetition, block, seed, done in tasks]
+
+    for index, (first_repetition, results) in run_blocks(blocks, workers):
+        case, params = tasks[index][:2]
+        done = tasks[index][-1]
+
+        for offset, result in enumerate(results):
+            repetition = first_repetition + offset
+
+            # Blocks of the batched engine may contain completed repetitions
+            if repetition in done:
+                continue
+
+            # Out-of-core results are already saved as columns
+            if save and SAVE_RESULTS == True and not OUT_OF_CORE:
+                save_result(result, case, params, repetition)
+
+            yield case, repetition, result
+
+def run_blocks(blocks, workers=None):
+    '''
+    Run blocks of repetitions on a pool of processes and yield them as soon
+    as they complete
+
+    Parameters
+    ----------
+
+    blocks: list of tuples
+        The (params, first_repetition, repetitions, seed) arguments of
+        run_block for every block
+    workers: int
+        Number of processes, by default the number of cores. With 1 the
+        blocks run in this process
+
+    Returns
+    -------
+
+    Generator of (index of the block, (first_repetition, results)) tuples in
+    order of completion
+    '''
+
+    if workers == 1:
+        for index, block in enumerate(blocks):
+            yield index, run_block(*block)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_block, *block): index for index, block in enumerate(blocks)}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
@@ -9,11 +9,80 @@ ONE_FIGURE = True
 LOAD_SAVED_PARAMETERS = True
 SAVE_PARAMETERS = False
 SAVE_RESULTS = True
+# Format of the saved results: dill (one file per repetition) or columnar
+RESULTS_FORMAT = "dill"
+# Histories kept by the simulation: full, summary (per server histories and
+# averages over the users), server-only or final-state (only the final values)
+RECORDING = "full"
+# Timeslots between the values kept of the per user histories of full
+RECORDING_EVERY = 1
+
+# Precision of the simulation, see PRECISIONS
+PRECISION = "double"
+# Number of candidate servers every user keeps probabilities over in the
+# sparse association mode, 0 lets every user select every server
+CANDIDATES = 0
 
 CONSTANT_PRICING = False
 CONSTANT_OFFLOADING = False
 
-def set_parameters(case):
+# Solver of the offloading/pricing game: plain, damped, over-relaxed or anderson
+EQUILIBRIUM_SOLVER = "plain"
+MAX_GAME_ITERATIONS = 1000
+# Start the game of each timeslot from the equilibrium of the previous one
+WARM_START = False
+# Equilibria kept in the cache of the game, keyed by the servers the users
+# selected, 0 disables it. Not used with WARM_START since the equilibrium
+# then depends on the previous timeslot
+EQUILIBRIUM_CACHE_SIZE = 0
+# Do the per user work of every timeslot in buffers allocated once per run,
+# see TimeslotKernel. Only used with the plain solver, without WARM_START
+# and the constant modes
+FUSED_KERNEL = False
+
+# Timeslots between checkpoints of a running repetition, 0 disables them
+CHECKPOINT_EVERY = 0
+# Completed repetitions between checkpoints of the campaign
+CAMPAIGN_CHECKPOINT_EVERY = 10
+
+# Time every phase of the timeslots and save the report next to the results
+PROFILE = False
+
+# Number of repetitions run together by the batched engine, 1 runs them serially
+BATCH_SIZE = 1
+
+# Run the repetitions with the cohort engine, which groups users with
+# identical parameters and probabilities in weighted classes
+COHORTS = False
+# Classes whose probabilities differ less than this are merged by the cohort
+# engine, None derives it from the number of users as 1/sqrt(U), the spread
+# of the shares of the servers that sampling the users gives anyway
+COHORT_RESOLUTION = None
+# Classes of a the users are binned in by the cohort engine, see a_classes
+COHORT_CLASSES = 100
+
+# Run the deterministic mean-field approximation instead of sampling the users
+MEAN_FIELD = False
+
+# Keep the users in memory mapped files and process them in blocks of
+# USER_BLOCK_SIZE users, for populations that do not fit in memory
+OUT_OF_CORE = False
+USER_BLOCK_SIZE = 1000000
+
+# Number of processes running repetitions, 1 runs them in this process
+WORKERS = 1
+# Seed from which the seed of every repetition is derived
+ROOT_SEED = 0
+
+# Data types of the game and learning computations, of the stored histories
+# and of the stored probabilities under each precision
+PRECISIONS = {
+        "double": {"compute": np.float64, "storage": np.float64, "probabilities": np.float64},
+        "single": {"compute": np.float32, "storage": np.float32, "probabilities": np.float32},
+        "half-probabilities": {"compute": np.float32, "storage": np.float32, "probabilities": np.float16},
+        }
+
+def set_parameters(case, S=5, U=100):
     '''
     Sets the parameters used in the simulation
 
@@ -23,6 +92,11 @@ def set_parameters(case):
     case: dictionary
         Dictionary containing infromation about whether the user and the servers
         are homogeneous or heterogeneous
+    S: int
+        Number of servers. The costs and discounts of the heterogeneous
+        server cases are repeated to cover all the servers
+    U: int
+        Number of users
 
     Returns
     ----------
@@ -59,8 +133,6 @@ def set_parameters(case):
         mechanism
     '''
 
-    S = 5
-    U = 100
     e1 = 1e-02
     e2 = 1e-02
 
@@ -82,16 +154,16 @@ def set_parameters(case):
         c = 0.2 * np.ones(S)
         fs = 0.025 * np.ones(S)
     if case["servers"] == "hetero":
-        c = np.array([0.12, 0.14, 0.2, 0.17, 0.13])
-        fs = np.array([0.05, 0.04, 0.02, 0.03, 0.05])
+        c = np.resize([0.12, 0.14, 0.2, 0.17, 0.13], S)
+        fs = np.resize([0.05, 0.04, 0.02, 0.03, 0.05], S)
         # c = 0.2 + np.random.random(S)
         # fs = 0.025 + np.random.random(S) * 0.1
     if case["servers"] == "one-dominant":
-        c = np.array([0.12, 0.2, 0.2, 0.2, 0.2])
-        fs = np.array([0.05, 0.02, 0.02, 0.02, 0.02])
+        c = np.resize([0.12, 0.2, 0.2, 0.2, 0.2], S)
+        fs = np.resize([0.05, 0.02, 0.02, 0.02, 0.02], S)
     if case["servers"] == "two-dominant":
-        c = np.array([0.12, 0.12, 0.2, 0.2, 0.2])
-        fs = np.array([0.05, 0.05, 0.02, 0.02, 0.02])
+        c = np.resize([0.12, 0.12, 0.2, 0.2, 0.2], S)
+        fs = np.resize([0.05, 0.05, 0.02, 0.02, 0.02], S)
         # c = np.array([0.1, 0.12, 0.5, 0.5, 0.5])
         # fs = np.array([0.1, 0.09, 0.01, 0.01, 0.01])
 
@@ -100,3 +172,107 @@ def set_parameters(case):
     learning_rate = 0.2
 
     return locals()
+
+class GameParameters:
+    '''
+    Immutable parameters of the simulation as attributes, built once from the
+    dictionary set_parameters returns, so that the hot functions read them
+    without unpacking the dictionary on every call. The constants derived
+    from them are computed on first use and kept:
+
+    kl: k*l
+    inverse_a: 1/a of every user
+    ckl: c*k*l of every server
+    one_minus_fs: 1-fs of every server
+
+    The arrays are kept as read-only views, which also covers memory mapped
+    ones, so nothing is copied.
+    '''
+
+    FIELDS = ("S", "U", "e1", "e2", "k", "l", "a", "b_min", "b_max", "c", "fs",
+            "price_min", "learning_rate")
+
+    __slots__ = FIELDS + ("_kl", "_inverse_a", "_ckl", "_one_minus_fs")
+
+    def __init__(self, S, U, e1, e2, k, l, a, b_min, b_max, c, fs, price_min, learning_rate, **params):
+        values = locals()
+        for name in self.FIELDS:
+            value = values[name]
+            if isinstance(value, np.ndarray):
+                value = value.view()
+                value.flags.writeable = False
+            object.__setattr__(self, name, value)
+
+        for name in ("_kl", "_inverse_a", "_ckl", "_one_minus_fs"):
+            object.__setattr__(self, name, None)
+
+    @classmethod
+    def from_dict(cls, params, dtype=None):
+        '''
+        The parameters of a dictionary as returned by set_parameters, the
+        keys that are not parameters of the game are ignored. With dtype the
+        arrays a, c and fs are converted to it, and so are the constants
+        derived from them
+        '''
+
+        if dtype is not None:
+            params = dict(params, **{name: np.asarray(params[name], dtype) for name in ("a", "c", "fs")})
+
+        return cls(**params)
+
+    def check_tolerances(self, dtype):
+        '''
+        Check that the tolerances e1 and e2 of the convergence of the game are
+        larger than the spacing of dtype at the largest offloading and price,
+        otherwise the game may never converge in that precision. The price
+        of a server is at most sqrt(c*k*l*max(1/a)/(1-fs)), since the
+        pricing game weighs 1/a by the offloading of the other users.
+
+        Raises
+        ------
+
+        ValueError
+            If a tolerance is below the resolution of dtype
+        '''
+
+        price_bound = max(np.max(np.sqrt(self.ckl*np.max(self.inverse_a)/self.one_minus_fs)), self.price_min)
+
+        if np.spacing(np.asarray(self.b_max, dtype)) >= self.e1:
+            raise ValueError('e1 is below the resolution of ' + np.dtype(dtype).name + ' at b_max')
+        if np.spacing(np.asarray(price_bound, dtype)) >= self.e2:
+            raise ValueError('e2 is below the resolution of ' + np.dtype(dtype).name + ' at the largest price')
+
+    def __setattr__(self, name, value):
+        raise AttributeError('GameParameters is immutable')
+
+    def __reduce__(self):
+        return (self.__class__, tuple(getattr(self, name) for name in self.FIELDS))
+
+    def _cached(self, name, value):
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+        object.__setattr__(self, name, value)
+
+    @property
+    def kl(self):
+        if self._kl is None:
+            self._cached("_kl", self.k*self.l)
+        return self._kl
+
+    @property
+    def inverse_a(self):
+        if self._inverse_a is None:
+            self._cached("_inverse_a", 1/self.a)
+        return self._inverse_a
+
+    @property
+    def ckl(self):
+        if self._ckl is None:
+            self._cached("_ckl", self.c*self.k*self.l)
+        return self._ckl
+
+    @property
+    def one_minus_fs(self):
+        if self._one_minus_fs is None:
+            self._cached("_one_minus_fs", 1 - self.fs)
+        return self._one_minus_fs
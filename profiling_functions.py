@@ -0,0 +1,146 @@
+'''
+Functions to profile the phases of the timeslot loop of the simulation
+'''
+
+import time
+import json
+
+class PhaseProfiler:
+    '''
+    Collects the cumulative time and number of calls of every phase of the
+    simulation. The time of a phase is the time since the previous lap, so
+    every phase costs one perf_counter call.
+    '''
+
+    def __init__(self):
+        self.times = {}
+        self.calls = {}
+        self.counters = {}
+        self.last = time.perf_counter()
+
+    def start(self):
+        '''
+        Start timing the next phase
+        '''
+
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        '''
+        Add the time since the previous lap to a phase
+
+        Parameters
+        ----------
+
+        phase: string
+            Name of the phase that just finished
+        '''
+
+        now = time.perf_counter()
+        self.times[phase] = self.times.get(phase, 0) + now - self.last
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        self.last = now
+
+    def count(self, name, value=1):
+        '''
+        Add to a counter, e.g. the iterations of the inner game
+        '''
+
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        '''
+        The structured report of the run
+
+        Returns
+        -------
+
+        report: dictionary
+            Time and calls of every phase and the counters
+        '''
+
+        return {
+                "phases": {phase: {"time": self.times[phase], "calls": self.calls[phase]}
+                    for phase in self.times},
+                "counters": dict(self.counters),
+                }
+
+class NullProfiler:
+    '''
+    Profiler that does nothing, used when profiling is turned off
+    '''
+
+    def start(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def report(self):
+        return None
+
+NULL_PROFILER = NullProfiler()
+
+def save_profile(report, path):
+    '''
+    Save a profiling report as JSON
+
+    Parameters
+    ----------
+
+    report: dictionary
+        The report of a run or the aggregated report of many runs
+    path: string
+        File of the report
+    '''
+
+    with open(path, 'w') as fp:
+        json.dump(report, fp, indent=1)
+
+def aggregate_profiles(reports):
+    '''
+    Aggregate the profiling reports of many repetitions
+
+    Parameters
+    ----------
+
+    reports: list of dictionaries
+        The reports of the repetitions
+
+    Returns
+    -------
+
+    report: dictionary
+        Total and mean per repetition of the time and calls of every phase
+        and of the counters, and the share of every phase on the total time
+    '''
+
+    repetitions = len(reports)
+    phases = {}
+    counters = {}
+
+    for report in reports:
+        for phase, value in report["phases"].items():
+            total = phases.setdefault(phase, {"time": 0, "calls": 0})
+            total["time"] += value["time"]
+            total["calls"] += value["calls"]
+        for name, value in report["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+
+    total_time = sum(value["time"] for value in phases.values())
+
+    return {
+            "repetitions": repetitions,
+            "phases": {phase: {
+                "time": value["time"],
+                "calls": value["calls"],
+                "mean_time": value["time"] / repetitions,
+                "mean_calls": value["calls"] / repetitions,
+                "share": value["time"] / total_time if total_time else 0,
+                } for phase, value in phases.items()},
+            "counters": {name: {"total": value, "mean": value / repetitions}
+                for name, value in counters.items()},
+            }
@@ -0,0 +1,268 @@
+'''
+Columnar on-disk store for the results of the simulation. Every history is
+saved as a separate .npy file that can be memory mapped, next to a manifest
+describing the columns, so readers open only the columns and timeslots they
+need.
+'''
+
+import numpy as np
+import struct
+import json
+import os
+import dill
+
+MANIFEST = "manifest.json"
+
+# Axis of the timeslots on the histories that do not keep them on the first
+TIME_AXES = {"all_probabilities": 1}
+
+def save_columns(result, path, case, learning_rate, repetition):
+    '''
+    Save the result of one repetition as a directory of columns
+
+    Parameters
+    ----------
+
+    result: dictionary
+        Dictionary containing the results of the repetition
+    path: string
+        Directory where the columns are saved
+    case: dictionary
+        The case the repetition belongs to
+    learning_rate: float
+        The learning rate of the repetition
+    repetition: int
+        Index of the repetition, starting from 0
+    '''
+
+    os.makedirs(path, exist_ok=True)
+
+    columns = {}
+    scalars = {}
+    for name, value in result.items():
+        if np.ndim(value) == 0:
+            scalars[name] = value.item() if isinstance(value, np.generic) else value
+            continue
+
+        value = np.asarray(value)
+        np.save(os.path.join(path, name + ".npy"), value)
+        columns[name] = {
+                "shape": list(value.shape),
+                "dtype": value.dtype.str,
+                "time_axis": TIME_AXES.get(name, 0),
+                }
+
+    write_manifest(path, case, learning_rate, repetition, columns, scalars)
+
+def write_manifest(path, case, learning_rate, repetition, columns, scalars):
+    '''
+    Write the manifest of a directory of columns. It has to be written after
+    the columns, so that a directory with a manifest is complete
+
+    Parameters
+    ----------
+
+    path: string
+        Directory where the columns are saved
+    case: dictionary
+        The case the repetition belongs to
+    learning_rate: float
+        The learning rate of the repetition
+    repetition: int
+        Index of the repetition, starting from 0
+    columns: dictionary
+        The shape, dtype and timeslot axis of every column
+    scalars: dictionary
+        The values of the result that are not arrays
+    '''
+
+    manifest = {
+            "case": case,
+            "learning_rate": learning_rate,
+            "repetition": repetition,
+            "columns": columns,
+            "scalars": scalars,
+            }
+
+    with open(os.path.join(path, MANIFEST), 'w') as fp:
+        json.dump(manifest, fp, indent=1)
+
+class AppendableColumn:
+    '''
+    A column saved as a .npy file that grows one timeslot at a time without
+    being kept in memory. The timeslots are on the first axis and every
+    timeslot may be written in blocks. The header reserves room for the
+    final shape, which is written when the column is closed.
+
+    Parameters
+    ----------
+
+    path: string
+        The .npy file of the column
+    shape: tuple
+        Shape of the value of each timeslot
+    dtype: data-type
+        Type of the values
+    '''
+
+    # Length of the header, enough for any shape and a multiple of 64 so
+    # that the data is aligned
+    HEADER_LENGTH = 256
+
+    def __init__(self, path, shape, dtype=float):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self.fp = open(path, 'wb')
+        self.fp.write(self._header())
+
+    def _header(self):
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+                self.dtype.str, (self.length,) + self.shape)
+        # Magic string, version 1.0 and the length of the header, then the
+        # header padded with spaces and ending in a newline
+        header = header.ljust(self.HEADER_LENGTH - 10 - 1) + "\n"
+        return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode('latin1')
+
+    def write(self, values):
+        '''
+        Append values of the current timeslot, in the order of the elements
+        '''
+
+        self.fp.write(np.ascontiguousarray(values, dtype=self.dtype).tobytes())
+
+    def end_timeslot(self):
+        '''
+        Mark the current timeslot as complete
+        '''
+
+        self.length += 1
+
+    def close(self):
+        '''
+        Write the final shape on the header and close the file
+
+        Returns
+        -------
+
+        column: dictionary
+            The shape, dtype and timeslot axis of the column for the manifest
+        '''
+
+        self.fp.seek(0)
+        self.fp.write(self._header())
+        self.fp.close()
+
+        return {"shape": [self.length] + list(self.shape), "dtype": self.dtype.str, "time_axis": 0}
+
+def read_manifest(path):
+    '''
+    Read the manifest of a directory of columns
+
+    Parameters
+    ----------
+
+    path: string
+        Directory where the columns are saved
+
+    Returns
+    -------
+
+    manifest: dictionary
+        The case, learning rate and repetition of the result and the shape,
+        dtype and timeslot axis of every column
+    '''
+
+    with open(os.path.join(path, MANIFEST)) as fp:
+        return json.load(fp)
+
+def load_column(path, name, timeslots=None, manifest=None):
+    '''
+    Open one column as a read-only memory map without copying it
+
+    Parameters
+    ----------
+
+    path: string
+        Directory where the columns are saved
+    name: string
+        Name of the column
+    timeslots: slice
+        Timeslots to keep, all of them by default
+
+    Returns
+    -------
+
+    column: array
+        Memory mapped view on the column
+    '''
+
+    column = np.load(os.path.join(path, name + ".npy"), mmap_mode='r')
+
+    if timeslots is not None:
+        if manifest is None:
+            manifest = read_manifest(path)
+        axis = manifest["columns"][name]["time_axis"]
+        column = column[(slice(None),)*axis + (timeslots,)]
+
+    return column
+
+def load_columns(path, columns=None, timeslots=None):
+    '''
+    Open the columns of a result as read-only memory maps
+
+    Parameters
+    ----------
+
+    path: string
+        Directory where the columns are saved
+    columns: list
+        Names of the columns to open, all of them by default
+    timeslots: slice
+        Timeslots to keep, all of them by default
+
+    Returns
+    -------
+
+    result: dictionary
+        The requested columns and the scalars of the result
+    '''
+
+    manifest = read_manifest(path)
+
+    if columns is None:
+        columns = manifest["columns"]
+
+    result = dict(manifest["scalars"])
+    for name in columns:
+        if name in manifest["columns"]:
+            result[name] = load_column(path, name, timeslots, manifest)
+
+    return result
+
+def load_result(path, columns=None):
+    '''
+    Load a result saved either as a dill file or as a directory of columns
+
+    Parameters
+    ----------
+
+    path: string
+        The file or directory of the result
+    columns: list
+        Names of the columns to open when the result is columnar, all of
+        them by default
+
+    Returns
+    -------
+
+    result: dictionary
+        Dictionary containing the results of the repetition
+    '''
+
+    if os.path.isdir(path):
+        return load_columns(path, columns)
+
+    with open(path, 'rb') as in_strm:
+        return dill.load(in_strm)
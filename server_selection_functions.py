@@ -11,20 +11,31 @@ def server_selection(probabilities, U, S, **params):
     Parameters
     ----------
 
-    probabilities: 1-D array
-        The probabilities that the user will select the specific server
+    probabilities: 2-D array
+        The probabilities that each user will select the specific server.
+        Leading repetition axes are allowed, e.g. a 3-D array with shape
+        (repetitions, U, S)
 
     Returns
     -------
 
-    servers: 1-D array
-        list containing the server to which each user is associated
+    servers: array
+        The server to which each user is associated, with the shape of
+        probabilities without its last axis
     '''
 
     # Each user selects the server to which he will offload his data based
-    # on the probabilities distribution he has
-    servers = np.array([np.random.choice(np.arange(S), replace=True, p=probabilities[user])
-        for user in np.arange(U)])
+    # on the probabilities distribution he has, by inverting the cumulative
+    # distribution on a uniform draw. This is what np.random.choice does for
+    # a single user, so the selections are the same for the same random state
+    cumulative = np.cumsum(probabilities, axis=-1)
+    cumulative /= cumulative[..., -1:]
+
+    draws = np.random.random(probabilities.shape[:-1])
+
+    # Row-wise searchsorted with side='right': the selected server is the
+    # number of servers whose cumulative probability does not exceed the draw
+    servers = np.sum(cumulative <= draws[..., np.newaxis], axis=-1)
 
     return servers
 
@@ -50,20 +61,26 @@ def all_users_sure(probabilities):
         return True
     return False
 
-def calculate_competitiveness(all_bytes_to_server, all_fs, all_prices, U, S, b_max,  **params):
+def competitiveness_score(bytes_to_server, total_bytes_to_server, total_bytes, fs, prices, U, S, b_max):
     '''
-    Calculate the competitiveness score Rs used on the update function
+    The competitiveness score Rs of the servers from the last timeslot and
+    the bytes offloaded up to it, as computed by calculate_competitiveness
+    and CompetitivenessTracker
 
     Parameters
     ----------
 
-    all_bytes_to_server: 2-D array
-        The number of bytes the users have offloaded to the specific server
-        up to now
-    all_fs: 2-D array
-        The discount the servers have offered up to now
-    all_prices: 2-D array
-        The prices the servers have set up to now
+    bytes_to_server: 1-D array
+        The number of bytes the users offloaded to each server on the last
+        timeslot
+    total_bytes_to_server: 1-D array
+        The number of bytes the users have offloaded to each server up to now
+    total_bytes: float
+        The number of bytes the users have offloaded to all servers up to now
+    fs: 1-D array
+        The discount the servers offered on the last timeslot
+    prices: 1-D array
+        The prices the servers set on the last timeslot
     U: int
         Number of users
     S: int
@@ -85,20 +102,20 @@ def calculate_competitiveness(all_bytes_to_server, all_fs, all_prices, U, S, b_m
     '''
 
     # calculate relative pricing
-    denominator = all_prices[-1] - all_fs[-1]*all_prices[-1]
+    denominator = prices - fs*prices
     numerator = np.sum(denominator)/S
     relative_price = numerator / denominator
 
     # calculate congestion
     # set B_max of each server to be able to handle all traffic
-    tmp1 = all_bytes_to_server[-1]
+    tmp1 = bytes_to_server
     tmp2 = b_max * U
     congestion = np.power((1 + (tmp1/tmp2)),3)
 
     # calculate "penetration"
     # use np.divide to handle cases where tmp2=0
-    tmp1 = np.sum(all_bytes_to_server, axis=0)
-    tmp2 = np.sum(all_bytes_to_server)
+    tmp1 = total_bytes_to_server
+    tmp2 = total_bytes
     penetration = np.divide(tmp1, tmp2, out=np.zeros_like(tmp1), where=tmp2!=0)
 
     w1 = w2 = w3 = 1/3
@@ -106,9 +123,48 @@ def calculate_competitiveness(all_bytes_to_server, all_fs, all_prices, U, S, b_m
 
     return Rs,relative_price,congestion,penetration
 
-def update_probabilities(Rs, probabilities, server_selected, b, learning_rate,  **params):
+def calculate_competitiveness(all_bytes_to_server, all_fs, all_prices, U, S, b_max,  **params):
+    '''
+    Calculate the competitiveness score Rs used on the update function.
+    Adapter of competitiveness_score for the history of the simulation
+
+    Parameters
+    ----------
+
+    all_bytes_to_server: 2-D array
+        The number of bytes the users have offloaded to the specific server
+        up to now
+    all_fs: 2-D array
+        The discount the servers have offered up to now
+    all_prices: 2-D array
+        The prices the servers have set up to now
+    U: int
+        Number of users
+    S: int
+        Number of servers
+    b_max: int
+        Maximum number of bits that the user is willing to offload
+
+    Returns
+    -------
+
+    Rs: 1-D array
+        the competitiveness score of each server
+    relative_price: 1-D array
+        the relative pricing of each server
+    congestion: 1-D array
+        the congestion of each server
+    penetration: 1-D array
+        the penetration of each server on the offloading market
     '''
-    Update action probabilities of users on choosing a server
+
+    return competitiveness_score(all_bytes_to_server[-1], np.sum(all_bytes_to_server, axis=0),
+            np.sum(all_bytes_to_server), all_fs[-1], all_prices[-1], U, S, b_max)
+
+def learning_update(Rs, probabilities, server_selected, game):
+    '''
+    Update action probabilities of users on choosing a server as
+    update_probabilities, with the learning rate read from a GameParameters
 
     Parameters
     ----------
@@ -119,8 +175,8 @@ def update_probabilities(Rs, probabilities, server_selected, b, learning_rate,
         The probabilities that the user will select the specific server
     server_selected: 1-D array
         list containing the server to which each user is associated
-    b: 1-D array
-        offloading data each user had decided to send
+    game: GameParameters
+        The parameters of the simulation
 
     Returns
     -------
@@ -129,11 +185,19 @@ def update_probabilities(Rs, probabilities, server_selected, b, learning_rate,
         The new probabilities that the user will select the specific server
     '''
 
+    return _learning_update(Rs, probabilities, server_selected, game.learning_rate)
+
+def _learning_update(Rs, probabilities, server_selected, learning_rate):
+    # Update of the probabilities from the only parameter it reads
+
     # use np.divide to handle cases where sum(Rs)=0
     tmp1 = Rs
     tmp2 = np.sum(Rs)
     reward = np.divide(tmp1, tmp2, out=np.zeros_like(tmp1), where=tmp2!=0)
 
+    # keep the probabilities in their precision
+    reward = reward.astype(probabilities.dtype, copy=False)
+
     # create second part of probabilities update
     Pr = np.copy(probabilities)
 
@@ -149,3 +213,91 @@ def update_probabilities(Rs, probabilities, server_selected, b, learning_rate,
     probabilities = probabilities + Pr
 
     return probabilities
+
+def update_probabilities(Rs, probabilities, server_selected, b, learning_rate,  **params):
+    '''
+    Update action probabilities of users on choosing a server. Adapter of
+    learning_update for the dictionary of the parameters
+
+    Parameters
+    ----------
+
+    Rs: 1-D array
+        the competitiveness score of each server
+    probabilities: 2-D array
+        The probabilities that the user will select the specific server
+    server_selected: 1-D array
+        list containing the server to which each user is associated
+    b: 1-D array
+        offloading data each user had decided to send
+    learning_rate: float
+        The learning rate of the users
+
+    Returns
+    -------
+
+    probabilities: 2-D array
+        The new probabilities that the user will select the specific server
+    '''
+
+    return _learning_update(Rs, probabilities, server_selected, learning_rate)
+
+class CompetitivenessTracker:
+    '''
+    Keeps the cumulative bytes offloaded to each server so that the
+    competitiveness score of every timeslot is computed in O(S), instead of
+    summing the whole history like calculate_competitiveness does. The
+    relative price and the congestion are identical, the penetration may
+    differ in the last bits: calculate_competitiveness sums all bytes of the
+    history pairwise, an order a running total cannot reproduce.
+
+    Parameters
+    ----------
+
+    U: int
+        Number of users
+    S: int
+        Number of servers
+    b_max: int
+        Maximum number of bits that the user is willing to offload
+    '''
+
+    def __init__(self, U, S, b_max, **params):
+        self.U = U
+        self.S = S
+        self.b_max = b_max
+        self.total_bytes_to_server = np.zeros(S)
+
+    def update(self, bytes_to_server, fs, prices):
+        '''
+        Add the last timeslot to the totals and calculate the competitiveness
+        score Rs used on the update function
+
+        Parameters
+        ----------
+
+        bytes_to_server: 1-D array
+            The number of bytes the users offloaded to each server on the last
+            timeslot
+        fs: 1-D array
+            The discount the servers offered on the last timeslot
+        prices: 1-D array
+            The prices the servers set on the last timeslot
+
+        Returns
+        -------
+
+        Rs: 1-D array
+            the competitiveness score of each server
+        relative_price: 1-D array
+            the relative pricing of each server
+        congestion: 1-D array
+            the congestion of each server
+        penetration: 1-D array
+            the penetration of each server on the offloading market
+        '''
+
+        self.total_bytes_to_server += bytes_to_server
+
+        return competitiveness_score(bytes_to_server, self.total_bytes_to_server,
+                np.sum(self.total_bytes_to_server), fs, prices, self.U, self.S, self.b_max)
@@ -0,0 +1,432 @@
+'''
+Sharded simulation for deployments partitioned into regions, each with its
+own controller. The users and the servers are split into shards and the
+selection, game and learning loop of every shard runs in its own process,
+in step with the other shards. The state the shards share lives in shared
+memory, while the probabilities of the users stay in the process of their
+shard, so the population simulated grows with the number of processes.
+'''
+
+import numpy as np
+import multiprocessing
+import time
+
+from multiprocessing import shared_memory
+from queue import Empty
+from threading import BrokenBarrierError
+
+from parameters import GameParameters, CONSTANT_PRICING, CONSTANT_OFFLOADING, EQUILIBRIUM_SOLVER, MAX_GAME_ITERATIONS, RECORDING, RECORDING_EVERY
+from helper_functions import initialize
+from equilibrium_solvers import solve_game
+from server_selection_functions import server_selection, learning_update, all_users_sure, CompetitivenessTracker
+from metrics import calculate_server_welfare, calculate_user_utility
+from history_recorder import HistoryRecorder, SERVER_HISTORIES
+
+# Seconds the parent waits for a result before checking that the processes
+# of the shards are still alive
+POLL_INTERVAL = 1.0
+
+class SharedArrays:
+    '''
+    Arrays kept in one block of shared memory, created by the parent process
+    and attached by the workers. Pickling attaches to the same block, so the
+    arrays are shared whatever the start method of the processes.
+
+    Parameters
+    ----------
+
+    layout: dictionary
+        The (shape, dtype) of every array
+    name: string
+        Name of an existing block to attach to, None creates a new one
+    '''
+
+    def __init__(self, layout, name=None):
+        self.layout = layout
+
+        size = sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for shape, dtype in layout.values())
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=max(size, 1))
+
+        self.arrays = {}
+        offset = 0
+        for key, (shape, dtype) in layout.items():
+            self.arrays[key] = np.ndarray(shape, dtype, buffer=self.memory.buf, offset=offset)
+            offset += self.arrays[key].nbytes
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def __reduce__(self):
+        return (self.__class__, (self.layout, self.memory.name))
+
+    def close(self, unlink=False):
+        '''
+        Release the arrays and detach from the block, unlink also removes it
+        '''
+
+        self.arrays = {}
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+def partition(U, S, shards):
+    '''
+    Split the users and the servers in contiguous shards of sizes that
+    differ at most by one
+
+    Parameters
+    ----------
+
+    U: int
+        Number of users
+    S: int
+        Number of servers, at least shards
+    shards: int
+        Number of shards
+
+    Returns
+    -------
+
+    users: list of slices
+        The users of every shard
+    servers: list of slices
+        The servers of every shard
+    '''
+
+    if shards > S or shards > U:
+        raise ValueError('Every shard needs at least one user and one server')
+
+    def slices(N):
+        bounds = np.linspace(0, N, shards + 1).astype(int)
+        return [slice(first, last) for first, last in zip(bounds[:-1], bounds[1:])]
+
+    return slices(U), slices(S)
+
+def shard_parameters(params, users, servers):
+    '''
+    The parameters of the users and the servers of one shard, with the same
+    keys as params
+    '''
+
+    return dict(params, U=users.stop - users.start, S=servers.stop - servers.start,
+            a=params["a"][users], c=params["c"][servers], fs=params["fs"][servers])
+
+def shard_seed(seed, shard):
+    '''
+    Seed of the random state of one shard, derived from the seed of the run
+    '''
+
+    sequence = np.random.SeedSequence(seed, spawn_key=(shard,))
+    return int(sequence.generate_state(1)[0])
+
+def run_shard(shard, params, users, servers, coupling, seed, recording, recording_every,
+        shared, barrier, queue):
+    '''
+    Run the loop of one shard and put (shard, result) in queue, or
+    (shard, error) if it fails. Executed inside the worker processes.
+
+    Every timeslot the shard writes the offloading of its users and the
+    totals and prices of its servers in shared, then waits for the other
+    shards. With coupling the competitiveness of its servers is scored on
+    the market of all shards, otherwise on its own. Then it updates the
+    probabilities, flags whether its users are sure and waits again. A
+    shard whose users are all sure keeps its last values in shared and waits
+    for the others.
+
+    Parameters
+    ----------
+
+    shard: int
+        Index of the shard
+    params: dictionary
+        Dictonary of the parameters of all shards
+    users: slice
+        The users of the shard
+    servers: slice
+        The servers of the shard
+    coupling: Boolean
+        Whether the competitiveness is scored on the market of all shards
+    seed: int
+        Seed for the random state of the shard
+    recording: string
+        Recording profile of the histories of the shard
+    recording_every: int
+        Timeslots between the values kept of the per user histories
+    shared: SharedArrays
+        The offloading of every user, the totals and prices of every server
+        and whether the users of every shard are sure
+    barrier: multiprocessing.Barrier
+        Barrier of all the shards
+    queue: multiprocessing.Queue
+        Queue of the results
+    '''
+
+    try:
+        result = _shard_loop(shard, params, users, servers, coupling, seed, recording,
+                recording_every, shared, barrier)
+        queue.put((shard, result))
+    except BaseException as error:
+        # The other shards would wait for this one forever
+        barrier.abort()
+        queue.put((shard, error))
+    finally:
+        shared.close()
+
+def _shard_loop(shard, params, users, servers, coupling, seed, recording, recording_every,
+        shared, barrier):
+    np.random.seed(seed)
+
+    start = time.time()
+
+    shard_params = shard_parameters(params, users, servers)
+    U = shard_params['U']
+    S = shard_params['S']
+    fs = shard_params['fs']
+    c = shard_params['c']
+
+    game = GameParameters.from_dict(shard_params)
+
+    history = HistoryRecorder.from_profile(recording, U, S, recording_every)
+
+    # The competitiveness of the servers on the market of the shard, or of
+    # all shards with coupling
+    competitiveness = CompetitivenessTracker(**shard_params)
+    if coupling:
+        competitiveness = CompetitivenessTracker(**params)
+
+    probabilities, prices = initialize(**shard_params)
+    history.record_all({"all_probabilities": probabilities})
+
+    b = np.zeros(U)
+    server_selected = np.zeros(U, int)
+    shared["prices"][servers] = prices
+
+    sure = all_users_sure(probabilities)
+    shared["sure"][shard] = sure
+    barrier.wait()
+
+    timeslot = 0
+    while not shared["sure"].all():
+        if sure:
+            # Written before the other shards read the timeslot, after they
+            # read the last one of this shard
+            shared["bytes_to_server"][servers] = 0
+        else:
+            server_selected = server_selection(probabilities, U, S)
+
+            b, prices, iterations = solve_game(server_selected, np.ones(U), np.ones(S),
+                    method=EQUILIBRIUM_SOLVER, max_iterations=MAX_GAME_ITERATIONS, game=game, **shard_params)
+
+            bytes_to_server = np.bincount(server_selected, b, minlength=S)
+
+            shared["b"][users] = b
+            shared["bytes_to_server"][servers] = bytes_to_server
+            shared["prices"][servers] = prices
+
+        # Every shard has played the game of the timeslot
+        barrier.wait()
+
+        if not sure:
+            if coupling:
+                scores = competitiveness.update(shared["bytes_to_server"], params["fs"], shared["prices"])
+                Rs,relative_price,congestion,penetration = (score[servers] for score in scores)
+            else:
+                Rs,relative_price,congestion,penetration = competitiveness.update(bytes_to_server, fs, prices)
+
+            server_welfare = calculate_server_welfare(prices, bytes_to_server, **shard_params)
+            user_utility = calculate_user_utility(b, server_selected, prices, **shard_params)
+
+            probabilities = learning_update(Rs, probabilities, server_selected, game)
+
+            history.record_all({
+                "all_server_selected": server_selected,
+                "all_game_iterations": iterations,
+                "all_bytes_offloaded": b,
+                "all_bytes_to_server": bytes_to_server,
+                "all_prices": prices,
+                "all_server_welfare": server_welfare,
+                "all_user_utility": user_utility,
+                "all_Rs": Rs,
+                "all_congestion": congestion,
+                "all_penetration": penetration,
+                "all_relative_price": relative_price,
+                "all_probabilities": probabilities,
+                "all_users_on_server": np.bincount(server_selected, minlength=S),
+                "all_average_bytes_offloaded": np.mean(b),
+                "all_average_user_utility": np.mean(user_utility),
+                })
+
+            timeslot += 1
+            sure = all_users_sure(probabilities)
+            shared["sure"][shard] = sure
+
+        # Every shard has read the values of the timeslot
+        barrier.wait()
+
+    result = history.to_dict()
+    result["running_time"] = time.time() - start
+    result["timeslots"] = timeslot
+    result["recording"] = recording
+    result["recorded_every"] = recording_every
+
+    if recording != "final-state":
+        result["all_fs"] = np.broadcast_to(fs, (timeslot, S))
+        result["all_c"] = np.broadcast_to(c, (timeslot, S))
+
+    if recording != "full":
+        result["final_probabilities"] = probabilities
+        result["final_server_selected"] = server_selected
+        result["final_bytes_offloaded"] = b
+        result["final_prices"] = prices
+
+    return result
+
+def _hold_last(history, T):
+    '''
+    The history extended to T timeslots with its last value
+    '''
+
+    if len(history) == 0:
+        return np.zeros((T,) + history.shape[1:], history.dtype)
+    return np.concatenate([history, np.repeat(history[-1:], T - len(history), axis=0)])
+
+def simulate_sharded(params, shards, coupling=False, seed=0, recording=RECORDING,
+        recording_every=RECORDING_EVERY):
+    '''
+    Run one repetition of the simulation with the users and the servers
+    partitioned in shards, each run by its own controller in its own process,
+    see run_shard. The users of a shard select only among the servers of the
+    shard and the game of every shard is played by its users. Without
+    coupling every shard is the simulation of its own parameters with its
+    seed, with coupling the competitiveness of the servers is scored on the
+    market of all shards every timeslot. The shards whose users are sure
+    offload nothing more to that market.
+
+    Parameters
+    ----------
+
+    params: dictionary
+        Dictonary of the parameters as returned by set_parameters
+    shards: int
+        Number of shards, and of processes
+    coupling: Boolean
+        Whether the shards are coupled through the competitiveness of the
+        servers
+    seed: int
+        Seed from which the seed of every shard is derived
+    recording: string
+        Recording profile of the histories of every shard
+    recording_every: int
+        Timeslots between the values kept of the per user histories
+
+    Returns
+    -------
+
+    result: dictionary
+        The result of every shard under "shards", with its users and
+        servers under "users" and "servers". The per server histories of
+        all servers, a shard keeping its last values after its users are
+        sure, the final offloading of all users and prices of all servers,
+        the number of timeslots of the longest shard and the running time
+
+    Raises
+    ------
+
+    RuntimeError
+        If the process of a shard exits without putting its result, the
+        other processes are stopped
+    '''
+
+    if CONSTANT_PRICING or CONSTANT_OFFLOADING:
+        raise ValueError('The sharded simulation does not support constant pricing or offloading')
+
+    U = params['U']
+    S = params['S']
+
+    start = time.time()
+
+    users, servers = partition(U, S, shards)
+
+    shared = SharedArrays({
+        "b": ((U,), float),
+        "bytes_to_server": ((S,), float),
+        "prices": ((S,), float),
+        "sure": ((shards,), bool),
+        })
+    shared["bytes_to_server"][:] = 0
+
+    barrier = multiprocessing.Barrier(shards)
+    queue = multiprocessing.Queue()
+
+    processes = [multiprocessing.Process(target=run_shard, args=(shard, params, users[shard], servers[shard],
+            coupling, shard_seed(seed, shard), recording, recording_every, shared, barrier, queue))
+            for shard in range(shards)]
+
+    try:
+        for process in processes:
+            process.start()
+
+        # Take the results before joining, the processes end once the queue
+        # has received them. A process killed before putting its result
+        # would leave the others on the barrier and the parent on the queue,
+        # so the queue is polled and the processes checked in between
+        results = [None] * shards
+        errors = []
+        pending = set(range(shards))
+        while pending:
+            # The result of a process that exited before the poll is already
+            # in the queue
+            exited = [shard for shard in pending if processes[shard].exitcode is not None]
+            try:
+                shard, result = queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                if exited:
+                    barrier.abort()
+                    raise RuntimeError('The process of shard ' + str(exited[0]) + ' exited with code ' +
+                            str(processes[exited[0]].exitcode) + ' without a result')
+                continue
+
+            pending.discard(shard)
+            if isinstance(result, BaseException):
+                errors.append(result)
+            else:
+                results[shard] = result
+
+        for process in processes:
+            process.join()
+
+        # The error of the shard that failed, not of the ones it stopped
+        for error in errors:
+            if not isinstance(error, BrokenBarrierError):
+                raise error
+        if errors:
+            raise errors[0]
+
+        final_bytes_offloaded = shared["b"].copy()
+        final_prices = shared["prices"].copy()
+    finally:
+        # The processes left after a failure are stopped
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        shared.close(unlink=True)
+
+    T = max(result["timeslots"] for result in results)
+
+    combined = {
+            "shards": results,
+            "users": users,
+            "servers": servers,
+            "timeslots": T,
+            "final_bytes_offloaded": final_bytes_offloaded,
+            "final_prices": final_prices,
+            }
+
+    for name in SERVER_HISTORIES + ["all_users_on_server"]:
+        if name in results[0]:
+            combined[name] = np.concatenate([_hold_last(result[name], T) for result in results], axis=1)
+
+    combined["running_time"] = time.time() - start
+
+    return combined
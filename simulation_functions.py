@@ -0,0 +1,616 @@
+'''
+Functions that run a whole simulation of the MEC offloading market
+'''
+
+import numpy as np
+import time
+
+from functools import partial
+
+from parameters import GameParameters, PRECISIONS, PRECISION, CANDIDATES, CONSTANT_PRICING, CONSTANT_OFFLOADING, EQUILIBRIUM_SOLVER, MAX_GAME_ITERATIONS, WARM_START, CHECKPOINT_EVERY, PROFILE, EQUILIBRIUM_CACHE_SIZE, FUSED_KERNEL, RECORDING, RECORDING_EVERY
+from helper_functions import *
+from game_functions import *
+from equilibrium_solvers import solve_game, EquilibriumCache, _warn_not_converged
+from server_selection_functions import *
+from batched_functions import *
+from metrics import *
+from history_recorder import HistoryRecorder, USER_HISTORIES, SERVER_HISTORIES
+from profiling_functions import PhaseProfiler, NULL_PROFILER
+from kernel_functions import TimeslotKernel
+from sparse_functions import CandidateProbabilities, ring_candidates, sparse_server_selection, sparse_all_users_sure, sparse_learning_update
+
+# Prices used by the servers when CONSTANT_PRICING is set
+CONSTANT_PRICE = np.array([1.96, 1.88, 1.94, 1.78, 1.92])
+
+def constant_offloading(server_selected, b_old, prices, **params):
+    '''
+    Best response of the users when CONSTANT_OFFLOADING is set, they keep
+    the offloading they started with
+    '''
+
+    return b_old
+
+def constant_pricing(server_selected, b, **params):
+    '''
+    Best response of the servers when CONSTANT_PRICING is set, they keep
+    the prices they initally set
+    '''
+
+    return CONSTANT_PRICE
+
+def simulate(params, checkpoint_path=None, checkpoint_every=CHECKPOINT_EVERY, profile=PROFILE,
+        cache_size=EQUILIBRIUM_CACHE_SIZE, recording=RECORDING, recording_every=RECORDING_EVERY,
+        fused_kernel=FUSED_KERNEL, precision=PRECISION, candidates=CANDIDATES):
+    '''
+    Run one repetition of the simulation until every user is sure on the
+    selected server
+
+    Parameters
+    ----------
+
+    params: dictionary
+        Dictonary of the parameters as returned by set_parameters
+    checkpoint_path: string
+        File where the state of the repetition is saved every
+        checkpoint_every timeslots. If it exists the repetition resumes from
+        it, and it is removed when the repetition finishes. A checkpoint of
+        other parameters raises ValueError
+    checkpoint_every: int
+        Number of timeslots between checkpoints, 0 disables them
+    profile: bool
+        Time every phase of the timeslots
+    cache_size: int
+        Number of equilibria of the game kept in an EquilibriumCache, 0
+        disables the cache. Timeslots whose equilibrium is cached record 0
+        game iterations
+    recording: string
+        Histories kept, see RECORDING_PROFILES. Except with full, the final
+        probabilities, selected servers, offloading and prices are kept under
+        the names with a "final_" prefix
+    recording_every: int
+        Timeslots between the values kept of the per user histories
+    fused_kernel: bool
+        Do the per user work in the buffers of a TimeslotKernel, with the
+        same results. Ignored unless the game is played with the plain
+        solver from scratch on every timeslot
+    precision: string
+        Data types of the computations and of the histories, see PRECISIONS.
+        The tolerances of the game are checked against the precision of the
+        computations
+    candidates: int or CandidateProbabilities
+        Sparse association mode: the number of candidate servers of every
+        user, chosen by ring_candidates, or the initial probabilities of every
+        user over its candidates. 0 keeps the dense U x S probabilities. The
+        history of the probabilities then holds the values of the candidates,
+        which are kept under "candidate_indptr" and "candidate_indices", and
+        the fused kernel is not used
+
+    Returns
+    -------
+
+    result: dictionary
+        Dictionary containing the recorded histories, the number of timeslots
+        and the running time. all_fs and all_c are read-only broadcast views
+        of fs and c. With profile set, the report of the profiler is kept
+        under "profile", and with the cache its hits and misses under
+        "equilibrium_cache"
+    '''
+
+    U = params['U']
+    S = params['S']
+    fs = params['fs']
+    c = params['c']
+    b_max = params['b_max']
+
+    start = time.time()
+
+    profiler = PhaseProfiler() if profile else NULL_PROFILER
+
+    # The parameters with their derived constants, computed once for the run
+    # in the precision of the computations
+    dtypes = PRECISIONS[precision]
+    compute = dtypes["compute"]
+    game = GameParameters.from_dict(params, compute)
+    game.check_tolerances(compute)
+
+    # Every user keeps probabilities only over its candidate servers
+    sparse = isinstance(candidates, CandidateProbabilities) or candidates > 0
+
+    # A checkpoint only resumes the repetition of the same parameters
+    state = load_checkpoint(checkpoint_path)
+    fingerprint = parameters_fingerprint(params) if checkpoint_path is not None else None
+    if state is not None and state.get("fingerprint") != fingerprint:
+        raise ValueError('Checkpoint ' + checkpoint_path + ' belongs to a repetition with other parameters')
+
+    if state is None:
+        # Get the initial values for probabilities and prices
+        if sparse:
+            prices = initialize(S, 0)[1]
+            probabilities = candidates
+            if not isinstance(candidates, CandidateProbabilities):
+                probabilities = ring_candidates(U, S, candidates, compute)
+            probabilities_shape = probabilities.values.shape
+        else:
+            probabilities, prices = initialize(**params)
+            probabilities = probabilities.astype(compute, copy=False)
+            probabilities_shape = (U,S)
+
+        # Initialize the buffers that keep the history of the results
+        history = HistoryRecorder.from_profile(recording, U, S, recording_every,
+                dtypes["storage"], dtypes["probabilities"], probabilities_shape)
+
+        # Keeps the cumulative offloading of each server for the competitiveness
+        competitiveness = CompetitivenessTracker(**params)
+
+        # The game of an assignment seen before is not played again
+        cache = None
+        if cache_size and not WARM_START:
+            cache = EquilibriumCache(cache_size, parameters_fingerprint(params))
+
+        history.record_all({"all_probabilities": probabilities.values if sparse else probabilities})
+
+        if CONSTANT_PRICING:
+            # Set constant price if needed
+            prices = CONSTANT_PRICE
+
+        # Offloading and servers the users selected on the previous timeslot
+        b = None
+        previous_selected = None
+
+        timeslot = 0
+        elapsed = 0
+    else:
+        # Resume the repetition exactly where it was checkpointed
+        history = state["history"]
+        competitiveness = state["competitiveness"]
+        cache = state["cache"]
+        probabilities = state["probabilities"]
+        prices = state["prices"]
+        b = state["b"]
+        previous_selected = state["previous_selected"]
+        timeslot = state["timeslot"]
+        elapsed = state["running_time"]
+        np.random.set_state(state["random_state"])
+        if profile and isinstance(state["profiler"], PhaseProfiler):
+            profiler = state["profiler"]
+
+    # Users keep their offloading and servers their prices if they are
+    # constant, None plays the best responses of the game
+    offloading_game = constant_offloading if CONSTANT_OFFLOADING else None
+    pricing_game = constant_pricing if CONSTANT_PRICING else None
+
+    # The per user work of the timeslot, done in the buffers of the kernel
+    # when it is used
+    kernel = None
+    users_sure = all_users_sure
+    select_servers = partial(server_selection, U=U, S=S)
+    user_utility_of = partial(calculate_user_utility, k=game.k, l=game.l, a=game.a)
+    learn = partial(learning_update, game=game)
+    if sparse:
+        users_sure = sparse_all_users_sure
+        select_servers = sparse_server_selection
+        learn = partial(sparse_learning_update, game=game)
+    elif (fused_kernel and EQUILIBRIUM_SOLVER == "plain"
+            and not (WARM_START or CONSTANT_OFFLOADING or CONSTANT_PRICING)):
+        kernel = TimeslotKernel(probabilities, game)
+        probabilities = kernel.probabilities
+        users_sure = kernel.all_users_sure
+        select_servers = kernel.server_selection
+        user_utility_of = kernel.calculate_user_utility
+        learn = kernel.learning_update
+
+    # Repeat until every user is sure on the selected server
+    profiler.start()
+    while not users_sure(probabilities):
+        # Each user selects a server to which he will offload computation
+        server_selected = select_servers(probabilities)
+        profiler.lap("server_selection")
+
+        # Game starts in order to converge to the optimum values of data offloading
+        # Repeat until convergence for both users and servers
+
+        if CONSTANT_OFFLOADING:
+            b_old = np.ones(U, compute) * 0.586 * b_max
+        else:
+            b_old = np.ones(U, compute)
+
+        prices_old = np.ones(S, compute)
+
+        if WARM_START and previous_selected is not None:
+            # Start from the previous equilibrium, users that switched server
+            # start over
+            b_old = np.where(server_selected == previous_selected, b, b_old)
+            prices_old = prices
+
+        equilibrium = None if cache is None else cache.get(server_selected)
+        if equilibrium is None and kernel is not None:
+            b, prices, iterations = kernel.solve_game(server_selected, b_old, prices_old,
+                    MAX_GAME_ITERATIONS)
+            if cache is not None:
+                cache.put(server_selected, b, prices)
+        elif equilibrium is None:
+            b, prices, iterations = solve_game(server_selected, b_old, prices_old,
+                    method=EQUILIBRIUM_SOLVER, max_iterations=MAX_GAME_ITERATIONS,
+                    offloading_game=offloading_game, pricing_game=pricing_game, game=game, **params)
+            if cache is not None:
+                cache.put(server_selected, b, prices)
+        else:
+            b, prices = equilibrium
+            iterations = 0
+        previous_selected = server_selected
+        profiler.lap("game")
+        profiler.count("game_iterations", iterations)
+
+        # Find all bytes that are offloaded to each server
+        bytes_to_server = np.bincount(server_selected, b, minlength=S)
+
+        # Calculate the welfare of the servers
+        server_welfare = calculate_server_welfare(prices, bytes_to_server, **params)
+
+        # Calculate the perceived utility of the users
+        user_utility = user_utility_of(b, server_selected, prices)
+        profiler.lap("metrics")
+
+        # Calculate the competitiveness of each server
+        Rs,relative_price,congestion,penetration = competitiveness.update(bytes_to_server, fs, prices)
+        profiler.lap("competitiveness")
+
+        # Update the probabilities
+        probabilities = learn(Rs, probabilities, server_selected)
+        profiler.lap("update_probabilities")
+
+        # Add the values of the timeslot as a row in the histories the
+        # recording profile keeps
+        history.record_all({
+            "all_server_selected": server_selected,
+            "all_game_iterations": iterations,
+            "all_bytes_offloaded": b,
+            "all_bytes_to_server": bytes_to_server,
+            "all_prices": prices,
+            "all_server_welfare": server_welfare,
+            "all_user_utility": user_utility,
+            "all_Rs": Rs,
+            "all_congestion": congestion,
+            "all_penetration": penetration,
+            "all_relative_price": relative_price,
+            "all_probabilities": probabilities.values if sparse else probabilities,
+            "all_users_on_server": np.bincount(server_selected, minlength=S),
+            "all_average_bytes_offloaded": np.mean(b),
+            "all_average_user_utility": np.mean(user_utility),
+            })
+        profiler.lap("recording")
+
+        timeslot += 1
+        if checkpoint_path is not None and checkpoint_every and timeslot % checkpoint_every == 0:
+            save_checkpoint(checkpoint_path, {
+                "fingerprint": fingerprint,
+                "history": history,
+                "competitiveness": competitiveness,
+                "cache": cache,
+                "probabilities": probabilities,
+                "prices": prices,
+                "b": b,
+                "previous_selected": previous_selected,
+                "timeslot": timeslot,
+                "running_time": elapsed + time.time() - start,
+                "random_state": np.random.get_state(),
+                "profiler": profiler,
+                })
+            profiler.lap("checkpoint")
+
+    remove_checkpoint(checkpoint_path)
+
+    end = time.time()
+    running_time = elapsed + end - start
+
+    # Keep results in a dictionary in order to save and plot them
+    result = history.to_dict()
+    result["running_time"] = running_time
+    result["timeslots"] = timeslot
+    result["recording"] = recording
+    result["recorded_every"] = recording_every
+
+    if recording != "final-state":
+        # The discount and cost of the servers never change
+        result["all_fs"] = np.broadcast_to(fs, (timeslot, S))
+        result["all_c"] = np.broadcast_to(c, (timeslot, S))
+
+    if sparse:
+        result["candidate_indptr"] = probabilities.indptr
+        result["candidate_indices"] = probabilities.indices
+
+    if recording != "full":
+        result["final_probabilities"] = probabilities.values if sparse else probabilities
+        result["final_server_selected"] = previous_selected
+        result["final_bytes_offloaded"] = b
+        result["final_prices"] = prices
+
+    if cache is not None:
+        result["equilibrium_cache"] = cache.report()
+
+    if profile:
+        profiler.count("timeslots", timeslot)
+        if cache is not None:
+            profiler.count("cache_hits", cache.hits)
+            profiler.count("cache_misses", cache.misses)
+        result["profile"] = profiler.report()
+
+    return result
+
+def simulate_batch(params, repetitions, profile=PROFILE, recording=RECORDING,
+        recording_every=RECORDING_EVERY):
+    '''
+    Run many repetitions of the simulation in one vectorized pass. Every
+    quantity carries a leading repetition axis and every step of the
+    simulation is executed once for all the repetitions that have not yet
+    finished. Repetitions whose users are all sure on the selected server
+    are masked out.
+
+    Parameters
+    ----------
+
+    params: dictionary
+        Dictonary of the parameters as returned by set_parameters
+    repetitions: int
+        Number of repetitions to run together
+    profile: bool
+        Time every phase of the timeslots
+    recording: string
+        Histories kept, see RECORDING_PROFILES
+    recording_every: int
+        Timeslots between the values kept of the per user histories
+
+    Returns
+    -------
+
+    results: list of dictionaries
+        One dictionary per repetition with the same keys as the one returned
+        by simulate. The running time of the batch, and the time of every
+        phase with profile set, is split evenly among the repetitions
+    '''
+
+    U = params['U']
+    S = params['S']
+    fs = params['fs']
+    c = params['c']
+    b_max = params['b_max']
+    R = repetitions
+
+    start = time.time()
+
+    profiler = PhaseProfiler() if profile else NULL_PROFILER
+
+    # The histories of every repetition, sampled as simulate samples them
+    histories = [HistoryRecorder.from_profile(recording, U, S, recording_every) for _ in range(R)]
+
+    # Get the initial values for probabilities and prices
+    probabilities, prices = initialize(**params)
+    probabilities = np.repeat(probabilities[np.newaxis], R, axis=0)
+    prices = np.repeat(prices[np.newaxis], R, axis=0)
+
+    if CONSTANT_PRICING:
+        prices[:] = CONSTANT_PRICE
+
+    for r in range(R):
+        histories[r].record_all({"all_probabilities": probabilities[r]})
+
+    # Total bytes offloaded to each server up to now on every repetition
+    total_bytes_to_server = np.zeros((R,S))
+    # Number of timeslots each repetition needed
+    timeslots = np.zeros(R, int)
+
+    server_selected = np.zeros((R,U), int)
+    b = np.zeros((R,U))
+    bytes_to_server = np.zeros((R,S))
+    server_welfare = np.zeros((R,S))
+    user_utility = np.zeros((R,U))
+    Rs = np.zeros((R,S))
+    relative_price = np.zeros((R,S))
+    congestion = np.zeros((R,S))
+    penetration = np.zeros((R,S))
+    game_iterations = np.zeros(R, int)
+    total_game_iterations = np.zeros(R, int)
+
+    profiler.start()
+    active = np.flatnonzero(~batched_all_users_sure(probabilities))
+    while active.size > 0:
+        timeslots[active] += 1
+
+        # Each user of every active repetition selects a server
+        selected = batched_server_selection(probabilities[active], **params)
+        profiler.lap("server_selection")
+
+        if CONSTANT_OFFLOADING:
+            b_old = np.ones((active.size,U)) * 0.586 * b_max
+        else:
+            b_old = np.ones((active.size,U))
+
+        prices_old = np.ones((active.size,S))
+
+        if WARM_START:
+            # Start from the previous equilibrium, users that switched server
+            # start over
+            warm = (selected == server_selected[active]) & (timeslots[active] > 1)[:, np.newaxis]
+            b_old = np.where(warm, b[active], b_old)
+            prices_old = np.where(timeslots[active, np.newaxis] > 1, prices[active], prices_old)
+
+        server_selected[active] = selected
+        new_b = b_old.copy()
+        new_prices = prices_old.copy()
+        game_iterations[active] = 0
+
+        # Play the game only on the repetitions that have not converged yet
+        pending = np.arange(active.size)
+        while pending.size > 0:
+            if not CONSTANT_OFFLOADING:
+                new_b[pending] = batched_play_offloading_game(selected[pending],
+                        b_old[pending], prices_old[pending], **params)
+
+            if CONSTANT_PRICING:
+                new_prices[pending] = CONSTANT_PRICE
+            else:
+                new_prices[pending] = batched_play_pricing_game(selected[pending],
+                        new_b[pending], **params)
+
+            converged = batched_game_converged(new_b[pending], b_old[pending],
+                    new_prices[pending], prices_old[pending], **params)
+
+            b_old[pending] = new_b[pending]
+            prices_old[pending] = new_prices[pending]
+
+            game_iterations[active[pending]] += 1
+            pending = pending[~converged]
+
+            # Give up on the games that did not converge in
+            # MAX_GAME_ITERATIONS, as solve_game does
+            exhausted = game_iterations[active[pending]] >= MAX_GAME_ITERATIONS
+            for _ in range(np.count_nonzero(exhausted)):
+                _warn_not_converged(MAX_GAME_ITERATIONS)
+            pending = pending[~exhausted]
+
+        b[active] = new_b
+        prices[active] = new_prices
+        total_game_iterations[active] += game_iterations[active]
+        profiler.lap("game")
+
+        # Find all bytes that are offloaded to each server
+        bytes_to_server[active] = batched_bytes_to_server(selected, new_b, S)
+        total_bytes_to_server[active] += bytes_to_server[active]
+
+        server_welfare[active] = calculate_server_welfare(new_prices,
+                bytes_to_server[active], **params)
+        user_utility[active] = batched_calculate_user_utility(new_b, selected,
+                new_prices, **params)
+        profiler.lap("metrics")
+
+        Rs[active], relative_price[active], congestion[active], penetration[active] = \
+                batched_calculate_competitiveness(bytes_to_server[active],
+                        total_bytes_to_server[active], new_prices, **params)
+        profiler.lap("competitiveness")
+
+        probabilities[active] = batched_update_probabilities(Rs[active],
+                probabilities[active], selected, **params)
+        profiler.lap("update_probabilities")
+
+        # Add the values of the timeslot to the histories of the repetitions
+        # that played it
+        for r in active:
+            histories[r].record_all({
+                "all_server_selected": server_selected[r],
+                "all_game_iterations": game_iterations[r],
+                "all_bytes_offloaded": b[r],
+                "all_bytes_to_server": bytes_to_server[r],
+                "all_prices": prices[r],
+                "all_server_welfare": server_welfare[r],
+                "all_user_utility": user_utility[r],
+                "all_Rs": Rs[r],
+                "all_congestion": congestion[r],
+                "all_penetration": penetration[r],
+                "all_relative_price": relative_price[r],
+                "all_probabilities": probabilities[r],
+                "all_users_on_server": np.bincount(server_selected[r], minlength=S),
+                "all_average_bytes_offloaded": np.mean(b[r]),
+                "all_average_user_utility": np.mean(user_utility[r]),
+                })
+        profiler.lap("recording")
+
+        active = active[~batched_all_users_sure(probabilities[active])]
+
+    end = time.time()
+    running_time = (end - start) / R
+
+    results = []
+    for r in range(R):
+        T = timeslots[r]
+        result = histories[r].to_dict()
+        result["running_time"] = running_time
+        result["timeslots"] = int(T)
+        result["recording"] = recording
+        result["recorded_every"] = recording_every
+
+        if recording != "final-state":
+            # The discount and cost of the servers never change
+            result["all_fs"] = np.broadcast_to(fs, (T, S))
+            result["all_c"] = np.broadcast_to(c, (T, S))
+
+        if recording != "full":
+            result["final_probabilities"] = probabilities[r].copy()
+            result["final_server_selected"] = server_selected[r].copy()
+            result["final_bytes_offloaded"] = b[r].copy()
+            result["final_prices"] = prices[r].copy()
+
+        if profile:
+            report = profiler.report()
+            for value in report["phases"].values():
+                value["time"] /= R
+            report["counters"] = {
+                    "game_iterations": int(total_game_iterations[r]),
+                    "timeslots": int(T),
+                    }
+            result["profile"] = report
+
+        results.append(result)
+
+    return results
+
+def compare_precisions(params, precision="single", seed=0):
+    '''
+    Validation report of a precision against float64. Both simulations start
+    from the same seed, so their trajectories are the same until rounding
+    makes a user select another server.
+
+    Parameters
+    ----------
+
+    params: dictionary
+        Dictonary of the parameters as returned by set_parameters
+    precision: string
+        The precision compared with "double", see PRECISIONS
+    seed: int
+        Seed of both simulations
+
+    Returns
+    -------
+
+    report: dictionary
+        The timeslots of each simulation, the first timeslot on which a user
+        selected another server (None if none did), the largest absolute
+        difference of the prices, offloading to each server and probabilities
+        on the timeslots before it, the largest relative difference of the
+        final prices, and the bytes of the histories and running time of each
+        simulation
+    '''
+
+    results = {}
+    for name in ("double", precision):
+        np.random.seed(seed)
+        results[name] = simulate(params, precision=name)
+
+    reference = results["double"]
+    reduced = results[precision]
+
+    T = min(len(reference["all_prices"]), len(reduced["all_prices"]))
+    changed = np.flatnonzero(np.any(reference["all_server_selected"][:T] != reduced["all_server_selected"][:T], axis=1))
+    divergence = int(changed[0]) if changed.size > 0 else None
+    same = T if divergence is None else divergence
+
+    def difference(name, history=lambda result, name: result[name][:same]):
+        if same == 0:
+            return 0.0
+        return float(np.max(np.abs(history(reference, name) - history(reduced, name).astype(float))))
+
+    final_prices = reference["all_prices"][-1]
+
+    return {
+            "precision": precision,
+            "timeslots": {name: len(result["all_prices"]) for name, result in results.items()},
+            "first_divergence": divergence,
+            "max_price_difference": difference("all_prices"),
+            "max_bytes_to_server_difference": difference("all_bytes_to_server"),
+            "max_probability_difference": difference("all_probabilities",
+                lambda result, name: result[name][:, :same+1]),
+            "final_price_difference": float(np.max(np.abs(reduced["all_prices"][-1] - final_prices) / final_prices)),
+            "history_bytes": {name: int(sum(result[key].nbytes for key in USER_HISTORIES + SERVER_HISTORIES if key in result))
+                for name, result in results.items()},
+            "running_time": {name: result["running_time"] for name, result in results.items()},
+            }
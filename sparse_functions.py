@@ -0,0 +1,218 @@
+'''
+Sparse association mode, where every user keeps probabilities only over a
+list of candidate servers it can reach
+'''
+
+import numpy as np
+
+from server_selection_functions import server_selection
+
+class CandidateProbabilities:
+    '''
+    Probabilities of every user over its candidate servers, stored as CSR:
+    the candidates of user u are indices[indptr[u]:indptr[u+1]] and their
+    probabilities the same slice of values. Every user has at least one
+    candidate. When every user has the same number of candidates the rows
+    are handled as a U x k matrix.
+
+    Parameters
+    ----------
+
+    indptr: 1-D array
+        Start of the candidates of every user, with U+1 elements
+    indices: 1-D array
+        The candidate servers of all users
+    values: 1-D array
+        The probability that each user will select each candidate server
+    '''
+
+    def __init__(self, indptr, indices, values):
+        self.indptr = np.asarray(indptr)
+        self.indices = np.asarray(indices)
+        self.values = np.asarray(values)
+        self.U = len(self.indptr) - 1
+
+        lengths = np.diff(self.indptr)
+        if np.all(lengths == lengths[0]):
+            self.k = int(lengths[0])
+            self.repeats = self.k
+        else:
+            self.k = None
+            self.repeats = lengths
+
+    @classmethod
+    def uniform(cls, indptr, indices, dtype=float):
+        '''
+        Every user selects each of its candidates with the same probability
+        '''
+
+        indptr = np.asarray(indptr)
+        lengths = np.diff(indptr)
+        values = np.repeat(1/lengths, lengths).astype(dtype)
+        return cls(indptr, indices, values)
+
+    def with_values(self, values):
+        '''
+        The same candidates with other probabilities
+        '''
+
+        probabilities = object.__new__(self.__class__)
+        probabilities.__dict__.update(self.__dict__)
+        probabilities.values = values
+        return probabilities
+
+    def rows(self):
+        '''
+        The user of every stored probability
+        '''
+
+        return np.repeat(np.arange(self.U), self.repeats)
+
+    def to_dense(self, S):
+        '''
+        The U x S matrix of the probabilities, 0 on the servers that are not
+        candidates
+        '''
+
+        dense = np.zeros((self.U, S), self.values.dtype)
+        dense[self.rows(), self.indices] = self.values
+        return dense
+
+def ring_candidates(U, S, k, dtype=float):
+    '''
+    Candidate servers of every user as the k servers that follow a random
+    one on a ring of the S servers, a simple model of the servers near a
+    user in a metro topology. Every user starts selecting its candidates
+    uniformly.
+
+    Parameters
+    ----------
+
+    U: int
+        Number of users
+    S: int
+        Number of servers
+    k: int
+        Number of candidates of every user, at most S
+
+    Returns
+    -------
+
+    probabilities: CandidateProbabilities
+        The initial probabilities over the candidates
+    '''
+
+    k = min(k, S)
+    first = np.random.randint(S, size=U)
+    indices = ((first[:, np.newaxis] + np.arange(k)) % S).ravel()
+    return CandidateProbabilities.uniform(np.arange(U+1)*k, indices, dtype)
+
+def sparse_server_selection(probabilities):
+    '''
+    server_selection over the candidates of every user. With the same number
+    of candidates for every user the selection is the one of server_selection
+    on the U x k matrix of the probabilities.
+
+    Parameters
+    ----------
+
+    probabilities: CandidateProbabilities
+        The probabilities of every user over its candidates
+
+    Returns
+    -------
+
+    servers: 1-D array
+        The server to which each user is associated
+    '''
+
+    P = probabilities
+
+    if P.k is not None:
+        position = server_selection(P.values.reshape(P.U, P.k), P.U, P.k)
+        return P.indices[P.indptr[:-1] + position]
+
+    # Cumulative probability of every candidate within the row of its user,
+    # normalized by the total of the row. Every row is summed on its own,
+    # candidate after candidate as np.cumsum does, since subtracting the
+    # totals of the previous rows from one cumulative sum of all rows loses
+    # the precision of the rows far from the first one
+    rows = P.rows()
+    starts = P.indptr[:-1]
+    lengths = np.diff(P.indptr)
+    cumulative = np.array(P.values)
+
+    longer = np.flatnonzero(lengths > 1)
+    position = 1
+    while len(longer):
+        candidates = starts[longer] + position
+        cumulative[candidates] += cumulative[candidates - 1]
+        position += 1
+        longer = longer[lengths[longer] > position]
+
+    cumulative /= cumulative[P.indptr[1:] - 1][rows]
+
+    draws = np.random.random(P.U)
+
+    # The position of the selected candidate is the number of candidates of
+    # the user whose cumulative probability does not exceed the draw
+    position = np.bincount(rows, cumulative <= draws[rows], minlength=P.U).astype(int)
+    return P.indices[P.indptr[:-1] + position]
+
+def sparse_all_users_sure(probabilities):
+    '''
+    all_users_sure over the candidates of every user
+    '''
+
+    P = probabilities
+
+    if P.k is not None:
+        largest = np.max(P.values.reshape(P.U, P.k), axis=1)
+    else:
+        largest = np.maximum.reduceat(P.values, P.indptr[:-1])
+
+    return bool(np.all(largest > 0.9))
+
+def sparse_learning_update(Rs, probabilities, server_selected, game):
+    '''
+    learning_update over the candidates of every user, with the same
+    operations on every stored probability as learning_update on the dense
+    matrix
+
+    Parameters
+    ----------
+
+    Rs: 1-D array
+        the competitiveness score of each server
+    probabilities: CandidateProbabilities
+        The probabilities of every user over its candidates
+    server_selected: 1-D array
+        list containing the server to which each user is associated
+    game: GameParameters
+        The parameters of the simulation
+
+    Returns
+    -------
+
+    probabilities: CandidateProbabilities
+        The new probabilities of every user over its candidates
+    '''
+
+    P = probabilities
+    values = P.values
+
+    # use np.divide to handle cases where sum(Rs)=0
+    tmp1 = Rs
+    tmp2 = np.sum(Rs)
+    reward = np.divide(tmp1, tmp2, out=np.zeros_like(tmp1), where=tmp2!=0)
+    reward = reward.astype(values.dtype, copy=False)
+
+    selected = P.indices == np.repeat(server_selected, P.repeats)
+
+    # The selected candidate gains (1-p) and the others lose p, times the
+    # learning rate and the reward of the selected server
+    change = np.where(selected, 1 - values, -values)
+    change *= game.learning_rate
+    change *= np.repeat(reward[server_selected], P.repeats)
+
+    return P.with_values(values + change)
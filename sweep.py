@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+    MEC_offloading.sweep
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Parameter sweeps for the MEC_offloading
+
+    :copyright: (c) 2018 by Giorgos Mitsis.
+    :license: MIT License, see LICENSE for more details.
+"""
+
+from parameters import *
+from sweep_functions import *
+
+# Values of the case axes and of the fields of set_parameters to sweep.
+# Cells that are already saved in saved_runs/sweeps are not run again
+grid = {
+        'users': ['hetero'],
+        'servers': ['hetero'],
+        'learning_rate': [0.2],
+        }
+
+repetitions = 1000
+
+if __name__ == '__main__':
+    for cell, repetition, result in run_sweep(grid, repetitions, ROOT_SEED, WORKERS):
+        print("Repetition no: " + str(repetition+1) + " of " + str(cell))
+        print("Time of simulation:")
+        print(result["running_time"])
@@ -0,0 +1,190 @@
+'''
+Functions to run parameter sweeps whose cells are cached on disk by the hash
+of their parameters
+'''
+
+import numpy as np
+import itertools
+import json
+import os
+
+from parameters import set_parameters
+from helper_functions import parameters_fingerprint
+from parallel_functions import run_blocks, engine_settings
+from result_store import save_columns, load_result, MANIFEST
+
+SWEEP_DIRECTORY = "saved_runs/sweeps"
+
+# Axes of the grid that select the case instead of a parameter
+CASE_AXES = ("users", "servers")
+
+# Parameters of set_parameters that change the generated arrays
+GENERATED_AXES = ("S", "U")
+
+def expand_grid(grid):
+    '''
+    Expand a declarative grid to the list of its cells
+
+    Parameters
+    ----------
+
+    grid: dictionary
+        Dictionary from the name of a case axis ("users", "servers") or of a
+        field of set_parameters to the list of its values
+
+    Returns
+    -------
+
+    cells: list of dictionaries
+        One dictionary per combination of the values of the grid
+    '''
+
+    keys, values = zip(*grid.items())
+    return [dict(zip(keys, v)) for v in itertools.product(*values)]
+
+def cell_parameters(cell, parameters_seed=13):
+    '''
+    The parameters of one cell of the grid
+
+    Parameters
+    ----------
+
+    cell: dictionary
+        Values of the axes of the grid on the cell
+    parameters_seed: int
+        Seed of the random state when the parameters are generated
+
+    Returns
+    -------
+
+    params: dictionary
+        Dictonary of the parameters as returned by set_parameters with the
+        values of the cell
+    '''
+
+    case = {axis: cell[axis] for axis in CASE_AXES}
+    generated = {axis: cell[axis] for axis in GENERATED_AXES if axis in cell}
+
+    np.random.seed(parameters_seed)
+    params = set_parameters(case, **generated)
+
+    for key, value in cell.items():
+        if key in CASE_AXES or key in GENERATED_AXES:
+            continue
+        if key not in params:
+            raise ValueError('Unknown parameter ' + key)
+        params[key] = value
+
+    return params
+
+def cell_fingerprint(params, root_seed):
+    '''
+    Hash of the parameters of a cell, of the settings of the engines that
+    change the results and of the root seed, see engine_settings
+    '''
+
+    return parameters_fingerprint(dict(params, engine=engine_settings()), root_seed)
+
+def cell_seed(fingerprint, root_seed, repetition):
+    '''
+    Seed of one repetition of a cell, derived from the root seed and the
+    fingerprint of the cell
+    '''
+
+    sequence = np.random.SeedSequence([root_seed, int(fingerprint[:16], 16)], spawn_key=(repetition,))
+    return int(sequence.generate_state(1)[0])
+
+def run_sweep(grid, repetitions, root_seed=0, workers=None, directory=SWEEP_DIRECTORY):
+    '''
+    Run every repetition of every cell of the grid that is not already
+    saved. Cells are saved under the hash of their full parameters, of the
+    settings of the engines and of the root seed, see cell_fingerprint, so
+    rerunning a sweep only runs the cells that were added or changed.
+
+    Parameters
+    ----------
+
+    grid: dictionary
+        Dictionary from the name of a case axis or of a field of
+        set_parameters to the list of its values
+    repetitions: int
+        Number of repetitions of each cell
+    root_seed: int
+        Seed from which the seed of every repetition is derived
+    workers: int
+        Number of processes, by default the number of cores
+    directory: string
+        Directory of the cached cells
+
+    Returns
+    -------
+
+    Generator of (cell, repetition, result) tuples of the repetitions that
+    were run, in order of completion
+    '''
+
+    tasks = []
+    for cell in expand_grid(grid):
+        params = cell_parameters(cell)
+        fingerprint = cell_fingerprint(params, root_seed)
+        path = os.path.join(directory, fingerprint)
+
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "cell.json"), 'w') as fp:
+            json.dump({"cell": cell, "root_seed": root_seed, "engine": engine_settings()}, fp, indent=1)
+
+        for repetition in range(repetitions):
+            if not _saved(path, repetition):
+                tasks.append((cell, params, path, repetition,
+                    cell_seed(fingerprint, root_seed, repetition)))
+
+    blocks = [(params, repetition, 1, seed) for cell, params, path, repetition, seed in tasks]
+
+    for index, (repetition, results) in run_blocks(blocks, workers):
+        cell, params, path = tasks[index][:3]
+
+        case = {axis: cell[axis] for axis in CASE_AXES}
+        save_columns(results[0], _repetition_path(path, repetition), case,
+                params["learning_rate"], repetition)
+
+        yield cell, repetition, results[0]
+
+def sweep_results(grid, repetitions, root_seed=0, directory=SWEEP_DIRECTORY, columns=None):
+    '''
+    Load the saved results of every cell of the grid
+
+    Parameters
+    ----------
+
+    grid: dictionary
+        The grid of the sweep
+    repetitions: int
+        Number of repetitions of each cell
+    root_seed: int
+        The root seed of the sweep
+    directory: string
+        Directory of the cached cells
+    columns: list
+        Names of the columns to open, all of them by default
+
+    Returns
+    -------
+
+    Generator of (cell, repetition, result) tuples, with the columns of the
+    results memory mapped. Repetitions that have not been run are skipped
+    '''
+
+    for cell in expand_grid(grid):
+        fingerprint = cell_fingerprint(cell_parameters(cell), root_seed)
+        path = os.path.join(directory, fingerprint)
+
+        for repetition in range(repetitions):
+            if _saved(path, repetition):
+                yield cell, repetition, load_result(_repetition_path(path, repetition), columns)
+
+def _repetition_path(path, repetition):
+    return os.path.join(path, "rep_" + str(repetition+1))
+
+def _saved(path, repetition):
+    # The manifest is written last, so only complete repetitions have one
+    return os.path.isfile(os.path.join(_repetition_path(path, repetition), MANIFEST))
@@ -4,11 +4,86 @@ from server_selection_functions import *
 from game_functions import *
 from metrics import *
 from parameters import *
+from batched_functions import *
+from parallel_functions import repetition_seed
+import parallel_functions
+import cohort_functions
+from history_recorder import HistoryRecorder, USER_HISTORIES, SERVER_HISTORIES
+from benchmarks import play_pricing_game_masked, benchmark_functions, compare_to_baseline
+from equilibrium_solvers import solve_game, EquilibriumCache
+import simulation_functions
+from aggregation_functions import StreamingAggregator
+from result_store import save_columns, load_columns, load_result, AppendableColumn
+from sweep_functions import run_sweep, sweep_results
+from helper_functions import parameters_fingerprint
+from checkpoint_functions import run_campaign
+from profiling_functions import aggregate_profiles
+from out_of_core_functions import simulate_out_of_core
+from kernel_functions import TimeslotKernel
+from sparse_functions import CandidateProbabilities, sparse_server_selection, sparse_learning_update
+from sharded_functions import simulate_sharded, partition, shard_parameters, shard_seed
+import sharded_functions
+from cohort_functions import Cohorts, cohort_offloading_game, cohort_pricing_game, simulate_cohorts, simulate_mean_field, compare_mean_field, a_classes
+import dill
+import os
+import warnings
+import multiprocessing
+import signal
+from functools import partial
+
+# Case used by the tests that only need the shared parameters
+CASE = {"users": "homo", "servers": "homo"}
+
+def assert_same_run(U=20, S=5, engine=None, keys=None, exclude=(), close=False, **options):
+    '''
+    Run simulate and engine with options from the same seed and check that
+    they record the same histories. Returns the parameters and both results
+
+    Parameters
+    ----------
+
+    U: int
+        Number of users
+    S: int
+        Number of servers
+    engine: function
+        The simulation compared with simulate, simulate itself by default
+    keys: list
+        Names of the values compared, all but the running time by default
+    exclude: list
+        Names of the values not compared
+    close: Boolean
+        Whether the floating point values are only compared with allclose
+    '''
+
+    if engine is None:
+        engine = simulation_functions.simulate
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, S=S, U=U)
+    params["learning_rate"] = 0.9
+
+    np.random.seed(7)
+    reference = simulation_functions.simulate(params)
+    np.random.seed(7)
+    result = engine(params, **options)
+
+    if keys is None:
+        keys = [key for key in reference if key != "running_time"]
+
+    for key in keys:
+        if key in exclude:
+            continue
+        inexact = np.issubdtype(np.asarray(reference[key]).dtype, np.inexact)
+        same = np.allclose if close and inexact else np.array_equal
+        assert same(reference[key], result[key])
+
+    return params, reference, result
 
 def test_all_users_sure():
     """ Test for all_users_sure """
 
-    params = set_parameters()
+    params = set_parameters(CASE)
 
     probabilities = np.array([[1,0,0],[0.95,0.05,0]])
     assert all_users_sure(probabilities) == True
@@ -19,13 +94,14 @@ def test_all_users_sure():
 def test_server_selection():
     """ Test for server_selection """
 
-    params = set_parameters()
+    params = set_parameters(CASE)
     params["U"] = 3
     params["S"] = 3
 
     probabilities = np.array([[1,0,0],[0.95,0.05,0],[0.3,0.5,0.2]])
 
     # Run multiple times to get result based on probabilities
+    np.random.seed(13)
     tmp = []
     for i in range(100):
         tmp.append(server_selection(probabilities, **params))
@@ -42,12 +118,12 @@ def test_server_selection():
     assert np.array_equal(server_selected, np.array([0, 0, 1]))
 
     # return parameters to the original values
-    params = set_parameters()
+    params = set_parameters(CASE)
 
 def test_game_converged():
     """ Test for game_converged """
 
-    params = set_parameters()
+    params = set_parameters(CASE)
 
     # nothing changed
     b = np.array([1,1,0])
@@ -80,21 +156,34 @@ def test_game_converged():
 def test_calculate_competitiveness():
     """ Test for calculate_Rs """
 
-    params = set_parameters()
+    params = set_parameters(CASE)
+    U = params["U"] = 3
+    S = params["S"] = 3
+    b_max = params["b_max"]
 
     all_bytes_to_server = np.array([np.array([3.0,0.0,1.0])])
     fs = np.array([0.025, 0.026, 0.027])
     all_fs = np.array([fs])
+    prices = np.array([2.0, 3.0, 4.0])
+    all_prices = np.array([prices])
+
+    discounted = (1-fs)*prices
+    manual_relative_price = discounted.sum()/S / discounted
+    manual_congestion = (1 + all_bytes_to_server[0]/(b_max*U))**3
+    manual_penetration = np.array([0.75, 0, 0.25])
+    manual_Rs = (manual_relative_price + 1/manual_congestion + manual_penetration)/3
 
-    manual_Rs = np.array([0.025*0.75, 0, 0.027*0.25])
-    automatic_Rs,_,_,_ = calculate_competitiveness(all_bytes_to_server, all_fs, **params)
+    automatic_Rs,relative_price,congestion,penetration = calculate_competitiveness(all_bytes_to_server, all_fs, all_prices, **params)
 
+    assert np.allclose(manual_relative_price, relative_price)
+    assert np.allclose(manual_congestion, congestion)
+    assert np.allclose(manual_penetration, penetration)
     assert np.allclose(manual_Rs, automatic_Rs)
 
 def test_update_probabilites():
     """ Test for update_probabilities """
 
-    params = set_parameters()
+    params = set_parameters(CASE)
 
     # 3 users and 3 servers
     probabilities = np.array([np.array([0.3, 0.3, 0.4]),np.array([0.4, 0.3, 0.3]),np.array([0.3, 0.3, 0.4])])
@@ -105,11 +194,11 @@ def test_update_probabilites():
     all_fs = np.array([fs])
 
     bytes_to_server = np.array([3.0, 0.0, 1.0])
-    learning_rate = 0.7
+    learning_rate = params["learning_rate"] = 0.7
 
     sum_Rs = 0.025*0.75 + 0.027*0.25
     manual_prob = np.array([np.array([0.3 + 0.7*0.025*0.75/sum_Rs*0.7, 0.3 - 0.7*0.025*0.75/sum_Rs*0.3, 0.4 - 0.7*0.025*0.75/sum_Rs*0.4]), np.array([0.4 + 0.7*0.025*0.75/sum_Rs*0.6, 0.3 - 0.7*0.025*0.75/sum_Rs*0.3, 0.3 - 0.7*0.025*0.75/sum_Rs*0.3]), np.array([0.3 - 0.7*0.027*0.25/sum_Rs*0.3, 0.3 - 0.7*0.027*0.25/sum_Rs*0.3, 0.4 + 0.7*0.027*0.25/sum_Rs*0.6]) ])
-    Rs,_,_,_ = calculate_competitiveness(all_bytes_to_server, all_fs, **params)
+    Rs = fs*bytes_to_server/bytes_to_server.sum()
     automatic_prob = update_probabilities(Rs, probabilities, server_selected, b, **params)
 
     assert np.allclose(manual_prob, automatic_prob)
@@ -117,7 +206,7 @@ def test_update_probabilites():
 def test_play_offloading_game():
     """ Test for play_offloading_game """
 
-    params = set_parameters()
+    params = set_parameters(CASE)
     U = params["U"] = 3
     S = params["S"] = 3
     a = params["a"] = np.array([20, 30, 40])
@@ -134,12 +223,12 @@ def test_play_offloading_game():
     automatic_b = play_offloading_game(server_selected, b_old, prices, **params)
     assert np.allclose(manual_b, automatic_b)
 
-    params = set_parameters()
+    params = set_parameters(CASE)
 
 def test_play_pricing_game():
     """ Test for play_pricing_game """
 
-    params = set_parameters()
+    params = set_parameters(CASE)
     U = params["U"] = 3
     S = params["S"] = 3
     a = params["a"] = np.array([20, 30, 40])
@@ -164,12 +253,12 @@ def test_play_pricing_game():
 
     assert np.allclose(manual_price, automatic_price)
 
-    params = set_parameters()
+    params = set_parameters(CASE)
 
 def test_calculate_server_welfare():
     """ Test for calculate_server_welfare """
 
-    params = set_parameters()
+    params = set_parameters(CASE)
     c = params["c"] = np.array([0.1, 0.2, 0.3])
     fs = params["fs"] = np.array([0.2, 0.3, 0.4])
     prices = np.array([2,3,4])
@@ -180,4 +269,901 @@ def test_calculate_server_welfare():
     automatic_welfare = calculate_server_welfare(prices, bytes_to_server, **params)
     assert np.allclose(manual_welfare, automatic_welfare)
 
-    params = set_parameters()
+    params = set_parameters(CASE)
+
+def test_batched_game_matches_serial():
+    """ Test that the batched game functions match the serial ones """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"})
+    U = params["U"]
+    S = params["S"]
+
+    server_selected = np.random.randint(S, size=(3, U))
+    b_old = np.random.random((3, U)) * params["b_max"]
+    prices = 1 + np.random.random((3, S))
+
+    batched_b = batched_play_offloading_game(server_selected, b_old, prices, **params)
+    batched_prices = batched_play_pricing_game(server_selected, batched_b, **params)
+
+    for r in range(3):
+        b = play_offloading_game(server_selected[r], b_old[r], prices[r], **params)
+        assert np.allclose(b, batched_b[r])
+        assert np.allclose(play_pricing_game(server_selected[r], b, **params), batched_prices[r])
+
+def test_batched_update_probabilities():
+    """ Test that batched_update_probabilities matches update_probabilities """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"})
+    U = params["U"]
+    S = params["S"]
+
+    probabilities = np.random.dirichlet(np.ones(S), size=(2, U))
+    server_selected = np.random.randint(S, size=(2, U))
+    Rs = np.random.random((2, S))
+
+    automatic_prob = batched_update_probabilities(Rs, probabilities, server_selected, **params)
+
+    for r in range(2):
+        manual_prob = update_probabilities(Rs[r], probabilities[r], server_selected[r], None, **params)
+        assert np.allclose(manual_prob, automatic_prob[r])
+
+def test_repetition_seed():
+    """ Test for repetition_seed """
+
+    case = {"users": "hetero", "servers": "hetero"}
+    other_case = {"users": "homo", "servers": "hetero"}
+
+    assert repetition_seed(0, case, 3) == repetition_seed(0, case, 3)
+    assert repetition_seed(0, case, 3) != repetition_seed(0, case, 4)
+    assert repetition_seed(0, case, 3) != repetition_seed(0, other_case, 3)
+    assert repetition_seed(0, case, 3) != repetition_seed(1, case, 3)
+
+def test_history_recorder():
+    """ Test for HistoryRecorder """
+
+    history = HistoryRecorder(capacity=2)
+    history.add("prices", (3,))
+    history.add("probabilities", (2,3), axis=1)
+
+    rows = np.random.random((5, 3))
+    probabilities = np.random.random((5, 2, 3))
+    for t in range(5):
+        history.record("prices", rows[t])
+        history.record("probabilities", probabilities[t])
+
+    result = history.to_dict()
+    assert np.array_equal(result["prices"], rows)
+    assert np.array_equal(result["probabilities"], probabilities.swapaxes(0, 1))
+    assert result["probabilities"].flags["C_CONTIGUOUS"]
+
+def test_competitiveness_tracker():
+    """ Test that CompetitivenessTracker matches calculate_competitiveness """
+
+    params = set_parameters({"users": "hetero", "servers": "hetero"})
+    S = params["S"]
+    fs = params["fs"]
+
+    tracker = CompetitivenessTracker(**params)
+    all_bytes_to_server = np.empty((0, S))
+    all_prices = np.empty((0, S))
+    all_fs = np.empty((0, S))
+
+    for t in range(50):
+        bytes_to_server = np.random.random(S) * 1e4
+        prices = 1 + np.random.random(S)
+        all_bytes_to_server = np.append(all_bytes_to_server, [bytes_to_server], axis=0)
+        all_prices = np.append(all_prices, [prices], axis=0)
+        all_fs = np.append(all_fs, [fs], axis=0)
+
+        manual = calculate_competitiveness(all_bytes_to_server, all_fs, all_prices, **params)
+        automatic = tracker.update(bytes_to_server, fs, prices)
+
+        # The total of all bytes is summed pairwise by calculate_competitiveness
+        for manual_value, automatic_value in zip(manual, automatic):
+            assert np.allclose(manual_value, automatic_value, rtol=1e-12, atol=0)
+        assert np.array_equal(manual[1], automatic[1])
+        assert np.array_equal(manual[2], automatic[2])
+
+def test_server_selection_matches_random_choice():
+    """ Test that server_selection draws the same servers as np.random.choice """
+
+    U = 1000
+    S = 5
+    probabilities = np.random.dirichlet(np.ones(S), size=U)
+
+    np.random.seed(3)
+    manual = np.array([np.random.choice(np.arange(S), p=probabilities[user]) for user in range(U)])
+
+    np.random.seed(3)
+    automatic = server_selection(probabilities, U, S)
+    assert np.array_equal(manual, automatic)
+
+    # the batched mode draws the repetitions one after the other
+    np.random.seed(3)
+    automatic = server_selection(np.array([probabilities[:500], probabilities[500:]]), U, S)
+    assert np.array_equal(manual, automatic.ravel())
+
+def test_play_pricing_game_many_servers():
+    """ Test play_pricing_game against the masked implementation """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, S=50, U=1000)
+    server_selected = np.random.randint(40, size=1000)
+    b = np.random.random(1000) * params["b_max"]
+
+    manual_price = play_pricing_game_masked(server_selected, b, **params)
+    automatic_price = play_pricing_game(server_selected, b, **params)
+    assert np.allclose(manual_price, automatic_price)
+
+def test_solve_game():
+    """ Test that every equilibrium solver reaches the same equilibrium """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"})
+    U = params["U"]
+    S = params["S"]
+    server_selected = np.random.randint(S, size=U)
+
+    b, prices, iterations = solve_game(server_selected, np.ones(U), np.ones(S), **params)
+    assert game_converged(play_offloading_game(server_selected, b, prices, **params), b,
+            play_pricing_game(server_selected, b, **params), prices, **params)
+
+    for method in ["damped", "over-relaxed", "anderson"]:
+        other_b, other_prices, other_iterations = solve_game(server_selected, np.ones(U), np.ones(S), method=method, **params)
+        assert np.allclose(b, other_b, atol=10*params["e1"])
+        assert np.allclose(prices, other_prices, atol=10*params["e2"])
+        assert other_iterations <= 1000
+
+def test_warm_start(monkeypatch):
+    """ Test that warm starting the game records fewer iterations """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, U=20)
+    params["learning_rate"] = 0.9
+
+    iterations = {}
+    for warm_start in [False, True]:
+        monkeypatch.setattr(simulation_functions, "WARM_START", warm_start)
+        np.random.seed(7)
+        result = simulation_functions.simulate(params)
+        assert len(result["all_game_iterations"]) == len(result["all_prices"])
+        iterations[warm_start] = result["all_game_iterations"]
+
+    assert iterations[True][1:].sum() < iterations[False][1:].sum()
+
+def test_simulate_batch_game_iterations_cap(monkeypatch):
+    """ Test that the batched game gives up after MAX_GAME_ITERATIONS """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, U=20)
+    params["learning_rate"] = 0.9
+
+    monkeypatch.setattr(simulation_functions, "MAX_GAME_ITERATIONS", 2)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        results = simulation_functions.simulate_batch(params, 2)
+
+    assert any(issubclass(warning.category, RuntimeWarning) for warning in caught)
+    for result in results:
+        assert result["all_game_iterations"].max() == 2
+
+def test_streaming_aggregator():
+    """ Test StreamingAggregator against padding every history explicitly """
+
+    S = 3
+    lengths = [4, 7, 2, 7, 5]
+    results = []
+    for T in lengths:
+        results.append({
+            "all_prices": np.random.random((T, S)),
+            "all_bytes_offloaded": np.random.random((T, 4)),
+            "all_server_selected": np.random.randint(S, size=(T, 4)),
+            "running_time": 1.0,
+            })
+
+    aggregator = StreamingAggregator(S, elements=["all_prices"])
+    for result in results:
+        aggregator.add(result)
+    average_result = aggregator.result()
+
+    T = max(lengths)
+    padded = np.array([np.concatenate((r["all_prices"], np.repeat(r["all_prices"][-1:], T - len(r["all_prices"]), axis=0))) for r in results])
+
+    assert np.allclose(average_result["all_prices"], padded.mean(axis=0))
+    assert np.allclose(average_result["all_prices_std"], padded.std(axis=0))
+    assert np.array_equal(average_result["number_of_timeslots"], [5, 5, 4, 4, 3, 2, 2])
+    assert average_result["median_timeslots"] == 5
+    assert average_result["average_timeslots"] == 5
+    assert np.allclose(average_result["all_server_selected"].sum(axis=1), 4)
+
+    # Per user histories sampled every few timeslots are not mixed with
+    # histories sampled differently, results without them are
+    aggregator = StreamingAggregator(S)
+    aggregator.add(dict(results[0], recorded_every=3))
+    aggregator.add({"all_prices": results[1]["all_prices"], "running_time": 1.0, "recorded_every": 1})
+    try:
+        aggregator.add(results[2])
+        assert False
+    except ValueError:
+        pass
+    assert aggregator.result()["recorded_every"] == 3
+
+def test_result_store(tmp_path):
+    """ Test saving and loading a result as columns """
+
+    result = {
+        "all_prices": np.random.random((6, 3)),
+        "all_server_selected": np.random.randint(3, size=(6, 4)),
+        "all_probabilities": np.random.random((4, 7, 3)),
+        "running_time": 2.5,
+        }
+    case = {"users": "hetero", "servers": "hetero"}
+    path = str(tmp_path / "hetero_hetero_lr_0.20_rep_1")
+
+    save_columns(result, path, case, 0.2, 0)
+
+    loaded = load_result(path)
+    for name in ["all_prices", "all_server_selected", "all_probabilities"]:
+        assert np.array_equal(loaded[name], result[name])
+        assert loaded[name].dtype == result[name].dtype
+    assert loaded["running_time"] == 2.5
+
+    loaded = load_columns(path, ["all_prices", "all_probabilities"], timeslots=slice(2, 4))
+    assert np.array_equal(loaded["all_prices"], result["all_prices"][2:4])
+    assert np.array_equal(loaded["all_probabilities"], result["all_probabilities"][:, 2:4])
+    assert "all_server_selected" not in loaded
+
+def test_run_sweep(tmp_path, monkeypatch):
+    """ Test that run_sweep only runs the cells that are not saved """
+
+    directory = str(tmp_path)
+    grid = {"users": ["homo"], "servers": ["hetero"], "U": [10], "learning_rate": [0.9]}
+
+    ran = list(run_sweep(grid, 2, workers=1, directory=directory))
+    assert len(ran) == 2
+    assert list(run_sweep(grid, 2, workers=1, directory=directory)) == []
+
+    grid["learning_rate"] = [0.9, 0.8]
+    ran = list(run_sweep(grid, 2, workers=1, directory=directory))
+    assert [cell["learning_rate"] for cell, repetition, result in ran] == [0.8, 0.8]
+
+    saved = list(sweep_results(grid, 2, directory=directory, columns=["all_prices"]))
+    assert len(saved) == 4
+
+    # The cells run with other settings of the engine are not the saved ones
+    monkeypatch.setattr(simulation_functions, "WARM_START", True)
+    assert len(list(sweep_results(grid, 2, directory=directory))) == 0
+    assert len(list(run_sweep(grid, 2, workers=1, directory=directory))) == 4
+
+def test_simulate_resumes_from_checkpoint(tmp_path, monkeypatch):
+    """ Test that an interrupted repetition resumes exactly where it stopped """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, U=20)
+    params["learning_rate"] = 0.9
+    checkpoint_path = str(tmp_path / "checkpoint")
+
+    np.random.seed(7)
+    reference = simulation_functions.simulate(params)
+
+    # Interrupt the repetition on the 12th timeslot
+    calls = []
+    def interrupted_update(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 12:
+            raise KeyboardInterrupt
+        return learning_update(*args, **kwargs)
+
+    monkeypatch.setattr(simulation_functions, "learning_update", interrupted_update)
+    np.random.seed(7)
+    try:
+        simulation_functions.simulate(params, checkpoint_path, checkpoint_every=5)
+    except KeyboardInterrupt:
+        pass
+    monkeypatch.undo()
+    assert os.path.isfile(checkpoint_path)
+
+    # The checkpoint does not resume a repetition of other parameters
+    try:
+        simulation_functions.simulate(dict(params, learning_rate=0.5), checkpoint_path, checkpoint_every=5)
+        assert False
+    except ValueError:
+        pass
+
+    np.random.seed(1)
+    resumed = simulation_functions.simulate(params, checkpoint_path, checkpoint_every=5)
+    assert not os.path.isfile(checkpoint_path)
+
+    for key in reference:
+        if key != "running_time":
+            assert np.array_equal(reference[key], resumed[key])
+
+def test_run_campaign_resumes(tmp_path, monkeypatch):
+    """ Test that a restarted campaign only runs the missing repetitions """
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("saved_runs/parameters")
+    os.makedirs("saved_runs/results/individual")
+
+    np.random.seed(13)
+    params = set_parameters({"users": "homo", "servers": "hetero"}, U=10)
+    params["learning_rate"] = 0.9
+    with open("saved_runs/parameters/homo_hetero_lr_0.20", 'wb') as fp:
+        dill.dump(params, fp)
+
+    cases = [{"users": "homo", "servers": "hetero"}]
+    path = "saved_runs/checkpoints/campaign"
+
+    reference = {repetition: result["all_prices"] for case, repetition, result in
+            run_campaign(cases, 4, workers=1, path="saved_runs/checkpoints/reference", checkpoint_every=0)}
+
+    # Stop the campaign after two repetitions
+    for case, repetition, result in run_campaign(cases, 4, workers=1, path=path, checkpoint_every=1):
+        if repetition == 1:
+            break
+
+    resumed = {repetition: result["all_prices"] for case, repetition, result in
+            run_campaign(cases, 4, workers=1, path=path, checkpoint_every=1)}
+
+    assert sorted(resumed) == [2, 3]
+    for repetition in resumed:
+        assert np.array_equal(reference[repetition], resumed[repetition])
+
+    with open(path, 'rb') as in_strm:
+        campaign = dill.load(in_strm)
+    assert campaign["completed"][parameters_fingerprint(params, 0)] == {0, 1, 2, 3}
+    assert campaign["aggregators"]["homo_hetero"].repetitions == 4
+    assert campaign["finished"]
+
+    # A finished campaign is not resumed, an unfinished one of other
+    # parameters is refused
+    assert len(list(run_campaign(cases, 1, workers=1, path=path))) == 1
+    for case, repetition, result in run_campaign(cases, 4, workers=1, path=path, checkpoint_every=1):
+        break
+    params["learning_rate"] = 0.5
+    with open("saved_runs/parameters/homo_hetero_lr_0.20", 'wb') as fp:
+        dill.dump(params, fp)
+    try:
+        next(run_campaign(cases, 4, workers=1, path=path))
+        assert False
+    except ValueError:
+        pass
+    params["learning_rate"] = 0.9
+    with open("saved_runs/parameters/homo_hetero_lr_0.20", 'wb') as fp:
+        dill.dump(params, fp)
+
+    # A campaign recording only the final state
+    monkeypatch.setattr(parallel_functions, "simulate", partial(simulation_functions.simulate, recording="final-state"))
+    final = {repetition: result for case, repetition, result in
+            run_campaign(cases, 2, workers=1, path="saved_runs/checkpoints/final", checkpoint_every=1)}
+    assert sorted(final) == [0, 1]
+    assert np.array_equal(final[0]["final_prices"], reference[0][-1])
+    with open("saved_runs/checkpoints/final", 'rb') as in_strm:
+        average = dill.load(in_strm)["aggregators"]["homo_hetero"].result()
+    assert average["median_timeslots"] > 0
+
+def test_profile():
+    """ Test that profiling reports every phase and leaves the run unchanged """
+
+    params, reference, profiled = assert_same_run(profile=True)
+    assert "profile" not in reference
+
+    T = len(profiled["all_bytes_offloaded"])
+    report = profiled["profile"]
+    for phase in ["server_selection", "game", "metrics", "competitiveness",
+            "update_probabilities", "recording"]:
+        assert report["phases"][phase]["calls"] == T
+    assert report["counters"]["game_iterations"] == profiled["all_game_iterations"].sum()
+    assert report["counters"]["timeslots"] == T
+
+    aggregated = aggregate_profiles([report, report])
+    assert aggregated["repetitions"] == 2
+    assert aggregated["phases"]["game"]["calls"] == 2*T
+    assert np.isclose(aggregated["phases"]["game"]["mean_time"], report["phases"]["game"]["time"])
+    assert np.isclose(sum(value["share"] for value in aggregated["phases"].values()), 1)
+
+def test_benchmark_baseline():
+    """ Test that the benchmarks cover every function and flag regressions """
+
+    results = benchmark_functions(U_values=(20,), S_values=(3, 5), repeats=1)
+
+    assert len(results) == 12
+    assert {row["function"] for row in results} == {"server_selection", "play_offloading_game",
+            "play_pricing_game", "calculate_competitiveness", "update_probabilities", "timeslot"}
+    assert all(row["time"] > 0 and row["peak"] >= 0 for row in results)
+
+    assert compare_to_baseline(results, results) == []
+
+    slower = [dict(row, time=row["time"] + 1) if row["function"] == "timeslot" else row for row in results]
+    regressions = compare_to_baseline(slower, results)
+    assert [(row["function"], row["S"], row["metric"]) for row in regressions] == [
+            ("timeslot", 3, "time"), ("timeslot", 5, "time")]
+
+def test_cohort_game_matches_users():
+    """ Test that the game on groups of users equals the game on every user """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"})
+    S = params["S"]
+
+    group_server = np.array([0, 0, 2, 3, 3, 4])
+    group_a = np.array([2e3, 5e3, 2e3, 2e3, 8e3, 5e3])
+    group_users = np.array([3, 1, 4, 2, 2, 5])
+    b_old = np.random.random(len(group_users)) * params["b_max"]
+    prices = 1 + np.random.random(S)
+
+    users = np.repeat(np.arange(len(group_users)), group_users)
+    user_params = dict(params, a=group_a[users], U=len(users))
+    group_params = dict(params, a=group_a, weights=group_users)
+
+    b = play_offloading_game(group_server[users], b_old[users], prices, **user_params)
+    assert np.allclose(b, cohort_offloading_game(group_server, b_old, prices, **group_params)[users])
+
+    manual_prices = play_pricing_game(group_server[users], b, **user_params)
+    assert np.allclose(manual_prices, cohort_pricing_game(group_server, b[np.searchsorted(users, np.arange(len(group_users)))], **group_params))
+
+def test_simulate_cohorts(monkeypatch):
+    """ Test that the cohort engine keeps every user and compresses the classes """
+
+    cohorts = Cohorts.from_users(np.array([1.0, 2.0, 1.0, 1.0]), np.array([[0.5, 0.5, 0], [0.5, 0.5, 0], [0.5, 0.5, 0], [0.2, 0.3, 0.5]]))
+    assert len(cohorts) == 3
+    assert cohorts.weights.sum() == 4
+    counts = cohorts.draw()
+    assert np.array_equal(counts.sum(axis=1), cohorts.weights)
+    assert np.all(counts[cohorts.probabilities == 0] == 0)
+
+    np.random.seed(13)
+    params = set_parameters({"users": "homo", "servers": "hetero"}, U=50)
+    params["learning_rate"] = 0.9
+
+    np.random.seed(7)
+    result = simulate_cohorts(params)
+    np.random.seed(7)
+    assert np.array_equal(result["all_prices"], simulate_cohorts(params)["all_prices"])
+
+    assert np.all(result["all_users_on_server"].sum(axis=1) == 50)
+    assert result["all_classes"][0] <= params["S"]
+    assert np.all(result["all_classes"] <= 50)
+    assert result["final_weights"].sum() == 50
+    assert all_users_sure(result["final_probabilities"])
+    assert np.array_equal(result["all_fs"], np.tile(params["fs"], (len(result["all_prices"]), 1)))
+    assert not result["all_c"].flags.writeable
+
+    aggregator = StreamingAggregator(params["S"])
+    aggregator.add(result)
+    assert np.array_equal(aggregator.result()["all_server_selected"], result["all_users_on_server"])
+
+    # Heterogeneous users are binned in classes of a
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, U=200)
+    params["learning_rate"] = 0.9
+    result = simulate_cohorts(params, 0.05, classes=10)
+    assert len(np.unique(result["final_a"])) <= 10
+    assert result["all_classes"][0] <= 10*params["S"]
+    assert result["final_weights"].sum() == 200
+    assert np.all(result["all_users_on_server"].sum(axis=1) == 200)
+
+    # Without a resolution the engine derives one from the number of users
+    monkeypatch.setattr(parallel_functions, "COHORTS", True)
+    monkeypatch.setattr(parallel_functions, "COHORT_CLASSES", 10)
+    np.random.seed(7)
+    results = parallel_functions.run_block(params, 0, 1, 7)[1]
+    np.random.seed(7)
+    assert np.array_equal(results[0]["all_prices"], simulate_cohorts(params, 1/np.sqrt(200), 10)["all_prices"])
+
+def test_mean_field(monkeypatch):
+    """ Test the mean-field mode and compare it with simulate """
+
+    a_values, weights = a_classes(np.arange(1000.0), classes=10)
+    assert len(a_values) == 10
+    assert weights.sum() == 1000
+    assert np.isclose(np.dot(a_values, weights), np.arange(1000.0).sum())
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, U=200)
+    params["learning_rate"] = 0.5
+
+    result = simulate_mean_field(params, max_timeslots=100)
+    assert np.allclose(result["all_users_on_server"].sum(axis=1), 200)
+    assert np.allclose(result["final_probabilities"].sum(axis=1), 1)
+    assert np.array_equal(result["all_c"], np.tile(params["c"], (len(result["all_prices"]), 1)))
+    assert not result["all_fs"].flags.writeable
+    assert np.array_equal(result["all_prices"], simulate_mean_field(params, max_timeslots=100)["all_prices"])
+
+    # The update does not depend on a, so every class keeps the shares x of
+    # the users on the servers and they follow x + lr*x*(reward - x.reward)
+    shares = result["all_users_on_server"] / 200
+    reward = result["all_Rs"] / result["all_Rs"].sum(axis=1, keepdims=True)
+    expected = shares[:-1] + 0.5*shares[:-1]*(reward[:-1] - np.sum(shares[:-1]*reward[:-1], axis=1, keepdims=True))
+    assert np.allclose(shares[0], 1/params["S"], rtol=1e-12, atol=0)
+    assert np.allclose(shares[1:], expected, rtol=1e-12, atol=0)
+
+    # The average share of repetitions of simulate is within five standard
+    # deviations of its sampling error, at most sqrt(0.25/(U*repetitions))
+    U = 1000
+    repetitions = 5
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, U=U)
+    params["learning_rate"] = 0.5
+    np.random.seed(7)
+    assert np.all(compare_mean_field(params, repetitions, timeslots=50) < 5*np.sqrt(0.25/(U*repetitions)))
+
+    # The comparison does not depend on the recording profile simulate
+    # defaults to
+    np.random.seed(7)
+    difference = compare_mean_field(params, 1, timeslots=10)
+    monkeypatch.setattr(cohort_functions, "simulate", partial(simulation_functions.simulate, recording="final-state"))
+    np.random.seed(7)
+    assert np.array_equal(compare_mean_field(params, 1, timeslots=10), difference)
+
+def test_equilibrium_cache():
+    """ Test the LRU cache of equilibria and that it leaves the run unchanged """
+
+    cache = EquilibriumCache(capacity=2)
+    assert cache.get(np.array([0, 1])) is None
+    cache.put(np.array([0, 1]), np.ones(2), np.ones(3))
+    cache.put(np.array([1, 1]), 2*np.ones(2), np.ones(3))
+    b, prices = cache.get(np.array([0, 1]))
+    assert np.array_equal(b, np.ones(2))
+    assert not b.flags.writeable
+
+    # [1, 1] is the least recently used, so it is evicted
+    cache.put(np.array([1, 0]), 3*np.ones(2), np.ones(3))
+    assert cache.get(np.array([1, 1])) is None
+    assert cache.get(np.array([1, 0])) is not None
+    assert cache.report() == {"hits": 2, "misses": 2, "size": 2, "capacity": 2}
+
+    params, reference, cached = assert_same_run(exclude=["all_game_iterations"], cache_size=16)
+
+    report = cached["equilibrium_cache"]
+    assert report["hits"] > 0
+    assert report["hits"] + report["misses"] == len(reference["all_prices"])
+    assert np.sum(cached["all_game_iterations"] == 0) == report["hits"]
+
+def test_incremental_game_state():
+    """ Test that the incremental game state plays the same game as the reference """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, U=50)
+    S = params["S"]
+
+    server_selected = np.random.randint(S, size=50)
+    b = np.random.random(50) * params["b_max"]
+    state = IncrementalGameState(server_selected, b, **params)
+
+    # Point updates
+    for user in range(0, 50, 7):
+        server_selected[user] = (server_selected[user] + 1) % S
+        state.move(user, server_selected[user])
+        b[user] /= 2
+        state.set(user, b[user])
+    assert np.allclose(state.pricing_game(server_selected, b, **params), play_pricing_game(server_selected, b, **params))
+
+    # Vectorized updates of a few users
+    server_selected[:3] = 0
+    b[40:45] = 0
+    state.assign(server_selected)
+    prices = state.pricing_game(server_selected, b, **params)
+    assert np.allclose(prices, play_pricing_game(server_selected, b, **params))
+    assert np.allclose(state.B_server, np.bincount(server_selected, b, minlength=S))
+
+    # The state keeps the sums of the offloading the best response returns
+    new_b = state.offloading_game(server_selected, b, prices, **params)
+    assert np.allclose(new_b, play_offloading_game(server_selected, b, prices, **params))
+    assert np.allclose(state.B_server, np.bincount(server_selected, new_b, minlength=S))
+    assert np.allclose(state.pricing_game(server_selected, new_b, **params), play_pricing_game(server_selected, new_b, **params))
+
+    single = IncrementalGameState(server_selected, b, dtype=np.float32, **params)
+    assert single.offloading_game(server_selected, single.b, prices.astype(np.float32), **params).dtype == np.float32
+    assert single.B_server.dtype == np.float32
+
+def test_simulate_out_of_core(tmp_path):
+    """ Test that the out-of-core simulation matches simulate """
+
+    column = AppendableColumn(str(tmp_path / "column.npy"), (4, 2))
+    values = np.random.random((3, 4, 2))
+    for value in values:
+        column.write(value[:3])
+        column.write(value[3:])
+        column.end_timeslot()
+    assert column.close()["shape"] == [3, 4, 2]
+    assert np.array_equal(np.load(str(tmp_path / "column.npy"), mmap_mode='r'), values)
+
+    params, reference, result = assert_same_run(engine=simulate_out_of_core, close=True,
+            keys=["all_server_selected", "all_game_iterations", "all_bytes_offloaded", "all_user_utility",
+                "all_prices", "all_Rs", "all_bytes_to_server"],
+            path=str(tmp_path / "result"), block_size=6)
+    assert np.array_equal(reference["all_fs"], result["all_fs"])
+    assert np.array_equal(reference["all_c"], result["all_c"])
+
+    assert not os.path.exists(str(tmp_path / "result" / "state"))
+    assert isinstance(result["all_bytes_offloaded"], np.memmap)
+    assert np.allclose(reference["all_probabilities"], np.swapaxes(result["all_probabilities"], 0, 1))
+
+def test_recording_profiles():
+    """ Test that every recording profile keeps the same values as the full one """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, U=20)
+    params["learning_rate"] = 0.9
+
+    results = {}
+    for recording in ["full", "summary", "server-only", "final-state"]:
+        np.random.seed(7)
+        results[recording] = simulation_functions.simulate(params, recording=recording, recording_every=3)
+
+    full = results["full"]
+    T = full["timeslots"]
+    assert len(full["all_prices"]) == T
+    assert len(full["all_server_selected"]) == (T-1)//3 + 1
+    assert full["all_probabilities"].shape[1] == T//3 + 1
+    assert np.array_equal(full["all_fs"], np.tile(params["fs"], (T, 1)))
+    assert not full["all_fs"].flags.writeable
+
+    for recording in ["summary", "server-only"]:
+        result = results[recording]
+        assert "all_bytes_offloaded" not in result and "all_probabilities" not in result
+        for key in ["all_prices", "all_bytes_to_server", "all_users_on_server", "all_game_iterations"]:
+            assert np.array_equal(full[key], result[key])
+    assert np.array_equal(results["summary"]["all_users_on_server"].sum(axis=1), np.full(T, 20))
+
+    final = results["final-state"]
+    assert final["timeslots"] == T and "all_prices" not in final
+    assert all_users_sure(final["final_probabilities"])
+    assert np.array_equal(final["final_probabilities"], results["summary"]["final_probabilities"])
+    assert np.array_equal(final["final_prices"], full["all_prices"][-1])
+
+    aggregator = StreamingAggregator(params["S"])
+    for result in results.values():
+        aggregator.add(result)
+    average = aggregator.result()
+    assert average["median_timeslots"] == T
+    assert np.array_equal(average["all_server_selected"], full["all_users_on_server"])
+
+    batch = simulation_functions.simulate_batch(params, 2, recording="summary")
+    for result in batch:
+        assert len(result["all_average_user_utility"]) == result["timeslots"]
+        assert result["final_probabilities"].shape == (20, params["S"])
+
+def test_simulate_batch_recording_every():
+    """ Test that the batched engine samples the histories as simulate """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, U=20)
+    params["learning_rate"] = 0.9
+
+    np.random.seed(7)
+    serial = simulation_functions.simulate(params, recording_every=5)
+    np.random.seed(7)
+    batched = simulation_functions.simulate_batch(params, 1, recording_every=5)[0]
+
+    assert serial["timeslots"] % 5 != 0
+    assert np.array_equal(serial["all_server_selected"], batched["all_server_selected"])
+    for key in USER_HISTORIES + SERVER_HISTORIES:
+        assert serial[key].shape == batched[key].shape
+        assert np.allclose(serial[key], batched[key])
+
+def test_timeslot_kernel():
+    """ Test that the fused kernel gives the same results bit for bit """
+
+    params = assert_same_run(U=50, fused_kernel=True)[0]
+
+    probabilities = np.random.random((50, params["S"]))
+    kernel = TimeslotKernel(probabilities, GameParameters.from_dict(params))
+    server_selected = np.random.randint(params["S"], size=50)
+    Rs = np.random.random(params["S"])
+    expected = update_probabilities(Rs, probabilities, server_selected, None, **params)
+    updated = kernel.learning_update(Rs, kernel.probabilities, server_selected)
+    assert updated is kernel.probabilities
+    assert np.array_equal(expected, updated)
+
+def test_game_parameters():
+    """ Test that GameParameters is immutable and matches the dictionary interface """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"})
+    game = GameParameters.from_dict(params)
+
+    assert game.kl == params["k"]*params["l"]
+    assert np.allclose(game.ckl, params["c"]*params["k"]*params["l"])
+    assert game.inverse_a is game.inverse_a
+    try:
+        game.k = 1
+        assert False
+    except AttributeError:
+        pass
+    assert not game.a.flags.writeable and params["a"].flags.writeable
+
+    restored = dill.loads(dill.dumps(game))
+    assert np.array_equal(restored.one_minus_fs, game.one_minus_fs)
+
+    server_selected = np.random.randint(params["S"], size=params["U"])
+    b_old = np.random.random(params["U"])*params["b_max"]
+    prices = 1 + np.random.random(params["S"])
+
+    b = offloading_best_response(server_selected, b_old, prices, game)
+    assert np.array_equal(b, play_offloading_game(server_selected, b_old, prices, **params))
+
+    # The same expression as before the parameters were computed once
+    B_minus_u = np.sum(b_old) - b_old
+    expected = (B_minus_u/params["l"]) * ((params["k"]*params["l"]/(params["a"]*prices[server_selected])) - 1)
+    assert np.array_equal(b, np.clip(expected, params["b_min"], params["b_max"]))
+
+    assert np.array_equal(pricing_best_response(server_selected, b, game),
+            play_pricing_game(server_selected, b, **params))
+    assert best_responses_converged(b, b, prices, prices, game)
+
+def test_adapters_documented_parameters():
+    """ Test that the adapters only need the parameters they document """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"})
+    U = params["U"]
+    S = params["S"]
+    server_selected = np.random.randint(S, size=U)
+    b_old = np.random.random(U)*params["b_max"]
+    prices = 1 + np.random.random(S)
+    Rs = np.random.random(S)
+    probabilities = np.full((U, S), 1/S)
+
+    b = play_offloading_game(server_selected, b_old, prices, k=params["k"], l=params["l"], a=params["a"],
+            b_max=params["b_max"], b_min=params["b_min"])
+    assert np.array_equal(b, play_offloading_game(server_selected, b_old, prices, **params))
+
+    new_prices = play_pricing_game(server_selected, b, S=S, k=params["k"], l=params["l"], a=params["a"],
+            c=params["c"], fs=params["fs"], price_min=params["price_min"])
+    assert np.array_equal(new_prices, play_pricing_game(server_selected, b, **params))
+
+    all_bytes_to_server = np.bincount(server_selected, b, minlength=S)[np.newaxis]
+    scores = calculate_competitiveness(all_bytes_to_server, params["fs"][np.newaxis], new_prices[np.newaxis],
+            U=U, S=S, b_max=params["b_max"])
+    for score, expected in zip(scores, calculate_competitiveness(all_bytes_to_server,
+            params["fs"][np.newaxis], new_prices[np.newaxis], **params)):
+        assert np.array_equal(score, expected)
+
+    updated = update_probabilities(Rs, probabilities, server_selected, b, learning_rate=0.9)
+    assert np.array_equal(updated, learning_update(Rs, probabilities, server_selected,
+            GameParameters.from_dict(dict(params, learning_rate=0.9))))
+
+def test_precision():
+    """ Test that the single precision trajectory follows the double one """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, U=20)
+    params["learning_rate"] = 0.9
+
+    np.random.seed(7)
+    result = simulation_functions.simulate(params, precision="half-probabilities")
+    assert result["all_probabilities"].dtype == np.float16
+    assert result["all_bytes_offloaded"].dtype == np.float32
+    assert result["all_server_selected"].dtype == int
+
+    report = simulation_functions.compare_precisions(params, "single", seed=7)
+    assert report["timeslots"]["single"] > 0
+    assert report["max_price_difference"] < 1e-4
+    assert report["history_bytes"]["single"] < report["history_bytes"]["double"]
+
+    game = GameParameters.from_dict(params, np.float32)
+    game.check_tolerances(np.float32)
+    try:
+        game.check_tolerances(np.float16)
+        assert False
+    except ValueError:
+        pass
+
+def test_sparse_candidates():
+    """ Test the sparse association mode against the dense probabilities """
+
+    U = 30
+    S = 5
+
+    # With every server a candidate the simulation is the dense one
+    candidates = CandidateProbabilities.uniform(np.arange(U+1)*S, np.tile(np.arange(S), U))
+    params, dense, sparse = assert_same_run(U=U, S=S, exclude=["all_probabilities"], candidates=candidates)
+    assert np.array_equal(dense["all_probabilities"], sparse["all_probabilities"].reshape(U, S, -1).transpose(0, 2, 1))
+
+    np.random.seed(7)
+    ring = simulation_functions.simulate(params, candidates=2)
+    indices = ring["candidate_indices"].reshape(U, 2)
+    assert ring["all_probabilities"].shape == (2*U, ring["timeslots"]+1)
+    for server_selected in ring["all_server_selected"]:
+        assert np.all((indices == server_selected[:, np.newaxis]).any(axis=1))
+
+def test_sparse_ragged_candidates():
+    """ Test the selection and the update over different numbers of candidates """
+
+    np.random.seed(13)
+    U = 30000
+    S = 6
+    lengths = np.random.randint(1, 4, size=U)
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    indices = np.concatenate([np.sort(np.random.choice(S, length, replace=False)) for length in lengths])
+
+    # The users with the same number of candidates select them with the
+    # same probabilities
+    shares = {1: [1.0], 2: [0.25, 0.75], 3: [0.2, 0.3, 0.5]}
+    values = np.concatenate([shares[length] for length in lengths])
+    candidates = CandidateProbabilities(indptr, indices, values)
+    assert candidates.k is None
+
+    np.random.seed(7)
+    servers = sparse_server_selection(candidates)
+    np.random.seed(7)
+    assert np.array_equal(servers, server_selection(candidates.to_dense(S), U, S))
+
+    selected = indices == np.repeat(servers, lengths)
+    assert np.array_equal(np.bincount(candidates.rows(), selected, minlength=U), np.ones(U))
+    position = np.flatnonzero(selected) - indptr[:-1]
+    for length, expected in shares.items():
+        users = lengths == length
+        frequency = np.bincount(position[users], minlength=length) / users.sum()
+        assert np.all(np.abs(frequency - expected) < 5*np.sqrt(0.25/users.sum()))
+
+    Rs = np.random.random(S)
+    game = GameParameters.from_dict(dict(set_parameters(CASE, S=S, U=U), learning_rate=0.9))
+    updated = sparse_learning_update(Rs, candidates, servers, game)
+    assert np.allclose(np.add.reduceat(updated.values, indptr[:-1]), 1)
+    assert np.array_equal(updated.to_dense(S), learning_update(Rs, candidates.to_dense(S), servers, game))
+
+def test_simulate_sharded():
+    """ Test that uncoupled shards are the simulations of their own parameters """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, S=6, U=40)
+    params["learning_rate"] = 0.9
+
+    result = simulate_sharded(params, 2, seed=3)
+    users, servers = partition(40, 6, 2)
+
+    for shard in range(2):
+        np.random.seed(shard_seed(3, shard))
+        expected = simulation_functions.simulate(shard_parameters(params, users[shard], servers[shard]))
+        for key in expected:
+            if key != "running_time":
+                assert np.array_equal(expected[key], result["shards"][shard][key])
+
+    assert result["all_prices"].shape == (result["timeslots"], 6)
+    assert np.array_equal(result["final_prices"][servers[1]], result["shards"][1]["all_prices"][-1])
+
+    coupled = simulate_sharded(params, 3, coupling=True, seed=3)
+    assert coupled["timeslots"] == max(shard["timeslots"] for shard in coupled["shards"])
+    assert np.array_equal(coupled["all_users_on_server"].sum(axis=1), np.full(coupled["timeslots"], 40))
+
+    # With coupling the shards whose users are sure add no more bytes to the
+    # penetration of the servers of the others
+    result = simulate_sharded(params, 2, coupling=True, seed=3)
+    lengths = [shard["timeslots"] for shard in result["shards"]]
+    assert lengths[0] != lengths[1]
+    T = max(lengths)
+    bytes_to_server = np.concatenate([np.concatenate((shard["all_bytes_to_server"],
+            np.zeros((T - shard["timeslots"], 3)))) for shard in result["shards"]], axis=1)
+    total_bytes_to_server = np.cumsum(bytes_to_server, axis=0)
+    penetration = total_bytes_to_server / total_bytes_to_server.sum(axis=1, keepdims=True)
+    for shard in range(2):
+        expected = penetration[:lengths[shard], servers[shard]]
+        assert np.allclose(result["shards"][shard]["all_penetration"], expected)
+
+def test_simulate_sharded_killed_shard(monkeypatch):
+    """ Test that the parent stops instead of waiting for a killed shard """
+
+    np.random.seed(13)
+    params = set_parameters({"users": "hetero", "servers": "hetero"}, S=6, U=40)
+    params["learning_rate"] = 0.9
+
+    shard_loop = sharded_functions._shard_loop
+    def killed_loop(shard, *args):
+        if shard == 1:
+            os.kill(os.getpid(), signal.SIGKILL)
+        return shard_loop(shard, *args)
+
+    # The forked processes run the patched loop
+    if multiprocessing.get_start_method() == "fork":
+        monkeypatch.setattr(sharded_functions, "_shard_loop", killed_loop)
+        monkeypatch.setattr(sharded_functions, "POLL_INTERVAL", 0.1)
+        try:
+            simulate_sharded(params, 2)
+            assert False
+        except RuntimeError:
+            pass